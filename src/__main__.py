@@ -1,3 +1,8 @@
+import time
+
+# import time is measured from here; the interpreter's own startup isn't included
+_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 import json
@@ -10,11 +15,16 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
 
-from src.handlers import setup_routers
+from src import memory_profile, workers
+from src.error_reporter import reporter
+from src.handlers import resume_jobs, setup_routers
+from src.metrics import metrics
 from src.middlewares import AntiFloodMiddleware
-from src.settings import Settings
+from src.settings import settings
 
-settings = Settings()
+IMPORT_SECONDS = time.perf_counter() - _STARTED
+# the local API server answers at once; don't hold up startup when it's missing
+LOCAL_API_PROBE_TIMEOUT = aiohttp.ClientTimeout(total=2)
 
 
 def _patch_poll_data(obj: Any) -> None:
@@ -39,34 +49,74 @@ def _patched_json_loads(value: str, **kwargs: Any) -> Any:
     return data
 
 
-async def create_bot_session() -> AiohttpSession:
-    """Creates a bot session using the local Telegram API if available, falling back to the default server."""
+async def create_bot_session(base: str = "http://nginx") -> AiohttpSession:
+    """Creates a bot session using the local Telegram API at `base` if available, falling back to the default server."""
     try:
-        async with aiohttp.ClientSession() as session:
-            await session.get("http://nginx")
+        async with aiohttp.ClientSession(timeout=LOCAL_API_PROBE_TIMEOUT) as session:
+            async with session.get(base):
+                pass
         return AiohttpSession(
-            api=TelegramAPIServer.from_base("http://nginx"),
+            api=TelegramAPIServer.from_base(base),
             json_loads=_patched_json_loads,
         )
-    except aiohttp.ClientConnectorError as e:
-        logging.warning("Can't connect to local bot api, using default server. Error: %s", e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning("Can't connect to local bot api, using default server. Error: %r", e)
         return AiohttpSession(json_loads=_patched_json_loads)
 
 
+async def _preload_converter() -> None:
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(workers.preload)
+    except Exception as e:
+        logging.exception("Can't load the converter: %s", e)
+        return
+    logging.info("Converter loaded in %.2fs", time.perf_counter() - start)
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher) -> None:
+    """Fetches the bot identity once (`bot.me()` caches it for the handlers), reports the
+    startup time, then loads the converter and resumes interrupted jobs in the background
+    while polling starts."""
+    me = await bot.me()
+    startup = time.perf_counter() - _STARTED
+    metrics.observe("startup.imports.seconds", IMPORT_SECONDS)
+    metrics.observe("startup.seconds", startup)
+    logging.info("Started as @%s in %.2fs (imports %.2fs)", me.username, startup, IMPORT_SECONDS)
+    for coroutine in (_preload_converter(), resume_jobs(bot, dispatcher)):
+        task = asyncio.create_task(coroutine)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+def create_dispatcher() -> Dispatcher:
+    """Creates the dispatcher with all routers and middlewares."""
+    storage = aiogram.fsm.storage.memory.MemoryStorage()
+    dp = Dispatcher(storage=storage)
+
+    router = setup_routers()
+    dp.include_router(router)
+    dp.message.middleware(AntiFloodMiddleware())
+    dp.startup.register(on_startup)
+    dp.startup.register(reporter.start)
+    dp.shutdown.register(reporter.stop)
+    return dp
+
+
 async def main() -> None:
     logging.basicConfig(
             level=logging.INFO,
             format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
     )
+    workers.workspaces.sweep()
+    memory_profile.start()
     bot_session = await create_bot_session()
 
     bot = Bot(token=settings.BOT_TOKEN.get_secret_value(), session=bot_session)
-    storage = aiogram.fsm.storage.memory.MemoryStorage()
-    dp = Dispatcher(storage=storage)
-
-    router = setup_routers()
-    dp.include_router(router)
-    dp.message.middleware(AntiFloodMiddleware())
+    dp = create_dispatcher()
 
     try:
         await dp.start_polling(
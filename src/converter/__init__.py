@@ -1,3 +1,42 @@
-from .image import convert_to_images
-from .video import convert_video
-from .exceptions import ConversionError, TileLimitError, DimensionError
+"""Conversion pipeline.
+
+The converters are loaded on first use of their names, so importing the package (and the
+handlers that use it) doesn't pull in NumPy and Pillow at startup; `preload` loads them
+ahead of the first job.
+"""
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+from .exceptions import ConversionError, TileLimitError, DimensionError, WorkspaceQuotaError, ProcessError, ProcessTimeoutError
+from .workspace import Workspace, WorkspaceManager
+
+if TYPE_CHECKING:
+    from .image import convert_to_images, header_size, open_image, plan_image, plan_image_size
+    from .encoder import encode_tiles, TILE_EXTENSIONS
+    from .video import convert_video, probe_video, is_still, extract_frame, plan_normalization, plan_video_dimensions, VideoInfo, VideoBackend, SubprocessBackend
+    from .assemble import assemble_image, assemble_video
+
+_LAZY = {
+    ".image": ("convert_to_images", "header_size", "open_image", "plan_image", "plan_image_size"),
+    ".encoder": ("encode_tiles", "TILE_EXTENSIONS"),
+    ".video": ("convert_video", "probe_video", "is_still", "extract_frame", "plan_normalization", "plan_video_dimensions", "VideoInfo", "VideoBackend", "SubprocessBackend"),
+    ".assemble": ("assemble_image", "assemble_video"),
+}
+_MODULES = {name: module for module, names in _LAZY.items() for name in names}
+
+
+def __getattr__(name: str) -> Any:
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def preload() -> None:
+    """Imports every converter module."""
+    for names in _LAZY.values():
+        for name in names:
+            __getattr__(name)
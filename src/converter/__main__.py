@@ -0,0 +1,232 @@
+"""Offline batch conversion of a directory of images and videos.
+
+Usage:
+    python -m src.converter INPUT_DIR OUTPUT_DIR [w=5] [h=3] [b=#ffffff] [b_sim=30] [b_blend=0] [start=0] [len=5] [--jobs 4]
+
+Options after the directories use the /convert syntax of the bot. Every input gets
+OUTPUT_DIR/<file name>/ (extension included, so a.png and a.jpg don't collide) with its tiles and a manifest.json describing the grid, tile sizes
+and timings.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any
+
+from src.converter.encoder import TILE_EXTENSIONS, TILE_PROFILES, encode_tiles
+from src.converter.image import convert_to_images, open_image
+from src.converter.process import job_limits
+from src.converter.video import VP9_PROFILES, SubprocessBackend, convert_video
+from src.converter.workspace import WorkspaceManager
+from src.utils.command import parse_seconds
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".gif", ".mov", ".mkv")
+# same defaults as the bot's handlers
+DEFAULT_B_SIM = {"image": 30, "video": 20}
+
+
+def parse_options(args: list[str]) -> dict[str, Any]:
+    """Parses key=value options the way the /convert handlers do."""
+    command_map = {k: v for k, v in (arg.split("=", 1) for arg in args if "=" in arg)}
+    unknown = set(command_map) - {"w", "h", "b", "b_sim", "b_blend", "start", "len"}
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+    options: dict[str, Any] = {
+        "custom_width": max(0, int(command_map.get("w", 0))) * 100,
+        "custom_height": max(0, int(command_map.get("h", 0))) * 100,
+        "bg_color": command_map.get("b"),
+        "b_blend": max(0.0, min(100.0, float(command_map.get("b_blend", 0)))),
+        "start": parse_seconds(command_map.get("start", "0")),
+        "length": parse_seconds(command_map["len"]) if "len" in command_map else None,
+    }
+    if "b_sim" in command_map:
+        options["b_sim"] = max(0.0, min(100.0, float(command_map["b_sim"])))
+    return options
+
+
+def _kind(path: str) -> str | None:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    if extension in VIDEO_EXTENSIONS:
+        return "video"
+    return None
+
+
+def _convert_image(path: str, output_dir: str, options: dict[str, Any], profile: str, timings: dict[str, float]) -> tuple[list[str], int, int]:
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        image, size = open_image(f, options["custom_width"], options["custom_height"])
+        image.load()
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tiles, tiles_width, tiles_height = convert_to_images(
+        image,
+        options["custom_width"],
+        options["custom_height"],
+        options["bg_color"],
+        options.get("b_sim", DEFAULT_B_SIM["image"]),
+        options["b_blend"],
+        size,
+    )
+    timings["tile"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoded = encode_tiles(tiles, profile)
+    timings["encode"] = time.perf_counter() - start
+
+    filenames = []
+    for index, data in enumerate(encoded):
+        filename = os.path.join(output_dir, f"tile_{index:03d}.{TILE_EXTENSIONS[profile]}")
+        with open(filename, "wb") as f:
+            f.write(data)
+        filenames.append(filename)
+    return filenames, tiles_width, tiles_height
+
+
+def _convert_video(path: str, output_dir: str, options: dict[str, Any], engine: str, vp9_profile: str, timeout: float, timings: dict[str, float]) -> tuple[list[str], int, int]:
+    if engine == "pyav":
+        from src.converter.pyav_backend import PyAVBackend
+        backend = PyAVBackend()
+    else:
+        backend = SubprocessBackend(engine)
+
+    async def convert() -> tuple[list[str], int, int]:
+        with WorkspaceManager().job() as workspace, job_limits(timeout):
+            with open(path, "rb") as f:
+                tiles, tiles_width, tiles_height = await convert_video(
+                    f,
+                    options["custom_width"],
+                    options["custom_height"],
+                    options["bg_color"],
+                    options.get("b_sim", DEFAULT_B_SIM["video"]),
+                    options["b_blend"],
+                    workspace=workspace,
+                    backend=backend,
+                    encoder_profile=vp9_profile,
+                    start=options["start"],
+                    length=options["length"],
+                )
+            filenames = []
+            for index, tile in enumerate(tiles):
+                filename = os.path.join(output_dir, f"tile_{index:03d}.webm")
+                shutil.move(tile, filename)
+                filenames.append(filename)
+            return filenames, tiles_width, tiles_height
+
+    start = time.perf_counter()
+    result = asyncio.run(convert())
+    timings["convert"] = time.perf_counter() - start
+    return result
+
+
+def convert_file(path: str, output_root: str, options: dict[str, Any], profile: str, engine: str, vp9_profile: str, timeout: float) -> dict[str, Any]:
+    """Converts one input and writes its tiles and manifest.json; runs in a worker process.
+
+    Returns:
+        The manifest
+    """
+    kind = _kind(path)
+    output_dir = os.path.join(output_root, os.path.basename(path))
+    manifest: dict[str, Any] = {"input": path, "kind": kind, "options": options}
+    timings: dict[str, float] = {}
+    start = time.perf_counter()
+    try:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+        if kind == "image":
+            filenames, tiles_width, tiles_height = _convert_image(path, output_dir, options, profile, timings)
+        else:
+            filenames, tiles_width, tiles_height = _convert_video(path, output_dir, options, engine, vp9_profile, timeout, timings)
+    except Exception as e:
+        # a bad input fails on its own, whatever the converter raises for it
+        manifest["error"] = f"{type(e).__name__}: {e}"
+    else:
+        sizes = [os.path.getsize(filename) for filename in filenames]
+        digests = set()
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                digests.add(hashlib.sha256(f.read()).digest())
+        manifest.update({
+            "grid": {"columns": tiles_width, "rows": tiles_height},
+            "tiles": [
+                {"file": os.path.basename(filename), "bytes": size}
+                for filename, size in zip(filenames, sizes)
+            ],
+            "distinct_tiles": len(digests),
+            "total_bytes": sum(sizes),
+            "max_tile_bytes": max(sizes, default=0),
+        })
+    timings["total"] = time.perf_counter() - start
+    manifest["timings"] = {name: round(seconds, 4) for name, seconds in timings.items()}
+    try:
+        with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+    except OSError as e:
+        manifest.setdefault("error", f"{type(e).__name__}: {e}")
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.converter", description=__doc__.split("\n\n")[0])
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("options", nargs="*", help="w=, h=, b=, b_sim=, b_blend=, start=, len= as in /convert")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--tile-profile", choices=list(TILE_PROFILES), default="default")
+    parser.add_argument("--engine", choices=["filter", "frames", "pyav"], default="filter",
+                        help='ffmpeg engine, or "pyav" for the in-process backend')
+    parser.add_argument("--vp9-profile", choices=list(VP9_PROFILES), default="default")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per video")
+    args = parser.parse_args()
+
+    try:
+        options = parse_options(args.options)
+    except ValueError as e:
+        parser.error(str(e))
+    inputs = sorted(
+        os.path.join(args.input_dir, name)
+        for name in os.listdir(args.input_dir)
+        if _kind(name) is not None
+    )
+    if not inputs:
+        parser.error(f"No images or videos in {args.input_dir}")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(convert_file, path, args.output_dir, options, args.tile_profile, args.engine, args.vp9_profile, args.timeout): path
+            for path in inputs
+        }
+        for future in as_completed(futures):
+            name = os.path.basename(futures[future])
+            try:
+                manifest = future.result()
+            except Exception as e:
+                # e.g. the worker process died
+                manifest = {"error": f"{type(e).__name__}: {e}"}
+            if "error" in manifest:
+                failed += 1
+                print(f"{name}: {manifest['error']}")
+                continue
+            grid = manifest["grid"]
+            print(
+                f"{name}: {grid['columns']}x{grid['rows']} tiles, {manifest['total_bytes']} bytes, "
+                f"{manifest['timings']['total']:.2f}s"
+            )
+    print(f"{len(inputs) - failed}/{len(inputs)} converted in {time.perf_counter() - start:.1f}s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Assembles custom emoji tiles back into one image or video."""
+
+import asyncio
+import io
+from concurrent.futures import Executor
+
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+from src.converter import process
+from src.converter.workspace import Workspace
+
+TILE_SIZE = 100
+# custom emoji videos are at most 3 seconds long; shorter ones loop
+EMOJI_DURATION = 3
+
+
+def _decode_tile(data: bytes) -> Image:
+    tile = PILImage.open(io.BytesIO(data)).convert("RGBA")
+    if tile.size != (TILE_SIZE, TILE_SIZE):
+        tile = tile.resize((TILE_SIZE, TILE_SIZE), PILImage.Resampling.LANCZOS)
+    return tile
+
+
+def assemble_image(rows: list[list[bytes]]) -> Image:
+    """Paste static tiles row by row into one transparent image.
+
+    Args:
+        rows: Encoded tiles (WebP/PNG) of every row; rows may differ in length
+
+    Returns:
+        RGBA image, as wide as the longest row
+    """
+    width = max(len(row) for row in rows)
+    image = PILImage.new("RGBA", (width * TILE_SIZE, len(rows) * TILE_SIZE), (0, 0, 0, 0))
+    decoded: dict[bytes, Image] = {}
+    for y, row in enumerate(rows):
+        for x, data in enumerate(row):
+            if data not in decoded:
+                decoded[data] = _decode_tile(data)
+            image.paste(decoded[data], (x * TILE_SIZE, y * TILE_SIZE))
+    return image
+
+
+def _write_inputs(workspace: Workspace, rows: list[list[tuple[str, bytes]]]) -> tuple[list[str], list[tuple[int, int, int]]]:
+    """Write every distinct tile into the workspace.
+
+    Returns:
+        Tuple of (ffmpeg input arguments, (input index, x, y) of every cell)
+    """
+    inputs: list[str] = []
+    paths: dict[bytes, int] = {}
+    cells: list[tuple[int, int, int]] = []
+    for y, row in enumerate(rows):
+        for x, (kind, data) in enumerate(row):
+            if data not in paths:
+                index = len(paths)
+                paths[data] = index
+                if kind == "video":
+                    path = workspace.file(f"emoji{index}.webm")
+                    with open(path, "wb") as f:
+                        f.write(data)
+                    # libvpx-vp9 keeps the alpha channel the native decoder drops
+                    inputs += ["-stream_loop", "-1", "-c:v", "libvpx-vp9", "-i", path]
+                else:
+                    path = workspace.file(f"emoji{index}.png")
+                    _decode_tile(data).save(path)
+                    inputs += ["-loop", "1", "-i", path]
+            cells.append((paths[data], x, y))
+    return inputs, cells
+
+
+async def assemble_video(workspace: Workspace, rows: list[list[tuple[str, bytes]]], fps: int = 30, executor: Executor | None = None) -> str:
+    """Stack video and static tiles into one looping H.264 clip.
+
+    Args:
+        workspace: Workspace for the tile files and the output
+        rows: (format, data) of every tile, format being "video" (WebM) or "static"
+        fps: Output frame rate
+        executor: Where the tiles are decoded and written (default: the loop's default executor)
+
+    Returns:
+        Path of the MP4 file
+    """
+    inputs, cells = await asyncio.get_running_loop().run_in_executor(executor, _write_inputs, workspace, rows)
+    workspace.check_quota()
+
+    tiles = 1 + max(index for index, _, _ in cells)
+    uses = [[cell for cell, (index, _, _) in enumerate(cells) if index == i] for i in range(tiles)]
+    filters = []
+    for index, cell_numbers in enumerate(uses):
+        outputs = "".join(f"[c{cell}]" for cell in cell_numbers)
+        filters.append(
+            f"[{index}:v]fps={fps},scale={TILE_SIZE}:{TILE_SIZE},format=rgba,"
+            f"split={len(cell_numbers)}{outputs}"
+        )
+    width = max(len(row) for row in rows) * TILE_SIZE
+    height = len(rows) * TILE_SIZE
+    labels = "".join(f"[c{cell}]" for cell in range(len(cells)))
+    if len(cells) == 1:
+        filters.append(f"{labels}null[stacked]")
+    else:
+        layout = "|".join(f"{x * TILE_SIZE}_{y * TILE_SIZE}" for _, x, y in cells)
+        filters.append(f"{labels}xstack=inputs={len(cells)}:layout={layout}:fill=black@0[stacked]")
+    # transparent parts end up white, like the chat background in the light theme
+    filters.append(
+        f"color=white:s={width}x{height}:r={fps}[bg];"
+        f"[bg][stacked]overlay=shortest=1,format=yuv420p[out]"
+    )
+
+    output = workspace.file("assembled.mp4")
+    await process.run([
+        "ffmpeg",
+        "-v", "error",
+        "-y",
+        *inputs,
+        "-filter_complex", ";".join(filters),
+        "-map", "[out]",
+        "-t", str(EMOJI_DURATION),
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        output,
+    ])
+    workspace.check_quota()
+    return output
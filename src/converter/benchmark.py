@@ -0,0 +1,176 @@
+"""Benchmarks for the conversion pipeline.
+
+Usage:
+    python -m src.converter.benchmark tiles [IMAGE ...]
+    python -m src.converter.benchmark vp9 [VIDEO ...]
+    python -m src.converter.benchmark backends [VIDEO ...]
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+from src.converter.encoder import TILE_PROFILES, encode_tiles
+from src.converter.exceptions import ConversionError
+from src.converter.image import convert_to_images
+from src.converter.video import VP9_PROFILES, SubprocessBackend, VideoBackend, crop_tiles, plan_normalization
+from src.converter.workspace import WorkspaceManager
+
+
+def _sample_images() -> dict[str, Image]:
+    """Synthetic inputs: a noisy photo-like image and a flat graphic with a transparent border."""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, 800, dtype=np.float32)
+    photo = np.stack([
+        np.tile(gradient, (600, 1)),
+        np.tile(gradient[:600, None], (1, 800)),
+        rng.normal(128, 40, (600, 800)),
+    ], axis=2).clip(0, 255).astype(np.uint8)
+    graphic = np.zeros((500, 800, 4), dtype=np.uint8)
+    graphic[100:400, 100:700] = (255, 200, 0, 255)
+    graphic[200:300, 300:500] = (20, 20, 20, 255)
+    return {
+        "photo": PILImage.fromarray(photo, "RGB"),
+        "graphic": PILImage.fromarray(graphic, "RGBA"),
+    }
+
+
+def benchmark_tiles(images: dict[str, Image], repeat: int = 3) -> None:
+    """Print encode time per tile and upload bytes for every static tile profile."""
+    print(f"{'input':<20} {'profile':<10} {'ms/tile':>8} {'bytes':>10} {'bytes/tile':>10}")
+    for label, image in images.items():
+        tiles, _, _ = convert_to_images(image)
+        for profile in TILE_PROFILES:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                encoded = encode_tiles(tiles, profile)
+                best = min(best, time.perf_counter() - start)
+            total = sum(len(data) for data in encoded)
+            print(
+                f"{label[:20]:<20} {profile:<10} {best / len(tiles) * 1000:>8.2f} "
+                f"{total:>10} {total // len(tiles):>10}"
+            )
+
+
+def _sample_video(tempdir: str) -> str:
+    """Synthetic 3 second 300x200 clip at 30 fps."""
+    filename = os.path.join(tempdir, "sample.mp4")
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=300x200:rate=30:duration=3",
+        "-pix_fmt", "yuv420p",
+        filename,
+    ], check=True)
+    return filename
+
+
+async def benchmark_vp9(videos: list[str], width: int, height: int) -> None:
+    """Print encode time and size per tile for every VP9 speed profile."""
+    print(f"{'input':<20} {'profile':<10} {'s/tile':>8} {'bytes/tile':>10} {'max bytes':>10}")
+    for video in videos:
+        for profile in VP9_PROFILES:
+            tempdir = tempfile.mkdtemp()
+            try:
+                shutil.copy(video, os.path.join(tempdir, "video.mp4"))
+                start = time.perf_counter()
+                try:
+                    await crop_tiles(tempdir, "video.mp4", width, height, encoder_profile=profile)
+                except ConversionError:
+                    pass  # oversized tiles are still on disk and show up in the sizes
+                elapsed = time.perf_counter() - start
+                sizes = [os.path.getsize(tile) for tile in glob.glob(os.path.join(tempdir, "tile*.webm"))]
+            finally:
+                shutil.rmtree(tempdir, ignore_errors=True)
+            if not sizes:
+                print(f"{os.path.basename(video)[:20]:<20} {profile:<10} failed")
+                continue
+            print(
+                f"{os.path.basename(video)[:20]:<20} {profile:<10} {elapsed / len(sizes):>8.3f} "
+                f"{sum(sizes) // len(sizes):>10} {max(sizes):>10}"
+            )
+
+
+def _backends() -> dict[str, VideoBackend]:
+    backends: dict[str, VideoBackend] = {
+        "filter": SubprocessBackend("filter"),
+        "frames": SubprocessBackend("frames"),
+    }
+    try:
+        from src.converter.pyav_backend import PyAVBackend
+        backends["pyav"] = PyAVBackend()
+    except ImportError:
+        print("PyAV is not installed, skipping the pyav backend")
+    return backends
+
+
+async def benchmark_backends(videos: list[str], width: int, height: int, profiles: list[str]) -> None:
+    """Print probe + tile time and size per tile for every video backend."""
+    print(f"{'input':<20} {'backend':<8} {'profile':<10} {'s/tile':>8} {'bytes/tile':>10} {'max bytes':>10}")
+    manager = WorkspaceManager()
+    for video in videos:
+        for name, backend in _backends().items():
+            for profile in profiles:
+                with manager.job() as workspace:
+                    start = time.perf_counter()
+                    try:
+                        filename = shutil.copy(video, workspace.file("video.mp4"))
+                        source = await backend.probe(filename)
+                        target = plan_normalization(source, width, height)
+                        tiles = await backend.tile(workspace, filename, target, None, 0, 0, False, profile)
+                    except ConversionError as e:
+                        print(f"{os.path.basename(video)[:20]:<20} {name:<8} {profile:<10} failed: {e}")
+                        continue
+                    elapsed = time.perf_counter() - start
+                    sizes = [os.path.getsize(tile) for tile in tiles]
+                print(
+                    f"{os.path.basename(video)[:20]:<20} {name:<8} {profile:<10} {elapsed / len(sizes):>8.3f} "
+                    f"{sum(sizes) // len(sizes):>10} {max(sizes):>10}"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.converter.benchmark")
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+
+    tiles_parser = subparsers.add_parser("tiles", help="static tile encoder profiles")
+    tiles_parser.add_argument("images", nargs="*", help="images to tile (synthetic samples if omitted)")
+    tiles_parser.add_argument("--repeat", type=int, default=3)
+
+    vp9_parser = subparsers.add_parser("vp9", help="VP9 encoder speed profiles")
+    vp9_parser.add_argument("videos", nargs="*", help="videos to tile (a synthetic clip if omitted)")
+    vp9_parser.add_argument("--width", type=int, default=300, help="width of the tiled area")
+    vp9_parser.add_argument("--height", type=int, default=200, help="height of the tiled area")
+
+    backends_parser = subparsers.add_parser("backends", help="subprocess and in-process video backends")
+    backends_parser.add_argument("videos", nargs="*", help="videos to tile (a synthetic clip if omitted)")
+    backends_parser.add_argument("--width", type=int, default=300, help="width of the tiled area")
+    backends_parser.add_argument("--height", type=int, default=200, help="height of the tiled area")
+    backends_parser.add_argument("--profile", choices=list(VP9_PROFILES), action="append",
+                                 help="VP9 profiles to run (default: all)")
+
+    args = parser.parse_args()
+    if args.suite == "tiles":
+        images = {path: PILImage.open(path) for path in args.images} or _sample_images()
+        benchmark_tiles(images, args.repeat)
+    elif args.suite == "vp9":
+        with tempfile.TemporaryDirectory() as tempdir:
+            videos = args.videos or [_sample_video(tempdir)]
+            asyncio.run(benchmark_vp9(videos, args.width, args.height))
+    elif args.suite == "backends":
+        with tempfile.TemporaryDirectory() as tempdir:
+            videos = args.videos or [_sample_video(tempdir)]
+            asyncio.run(benchmark_backends(videos, args.width, args.height, args.profile or list(VP9_PROFILES)))
+
+
+if __name__ == "__main__":
+    main()
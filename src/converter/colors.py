@@ -40,3 +40,11 @@ def normalize_hex_color(color: str | None) -> str | None:
         return None
 
     return value.lower()
+
+
+def hex_to_rgb(color: str | None) -> tuple[int, int, int] | None:
+    """Return the (r, g, b) components of a hex or named color, or None if invalid."""
+    normalized = normalize_hex_color(color)
+    if normalized is None:
+        return None
+    return int(normalized[0:2], 16), int(normalized[2:4], 16), int(normalized[4:6], 16)
@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+# Static custom emoji accept both PNG and WEBP files.
+TILE_PROFILES = ("default", "fast", "small", "webp")
+TILE_EXTENSIONS: dict[str, str] = {
+    "default": "png",
+    "fast": "png",
+    "small": "png",
+    "webp": "webp",
+}
+
+
+def _to_palette(tile: Image) -> Image | None:
+    """
+    Convert a tile to an exact RGBA palette image
+    :param tile: Input tile
+    :return: Palette image, or None if the tile has more than 256 colors
+    """
+    tile = tile.convert("RGBA")
+    if tile.getcolors(256) is None:
+        return None
+    # view every RGBA pixel as one uint32 so the unique colors come from a 1-D sort
+    pixels = np.ascontiguousarray(np.asarray(tile)).view(np.uint32).ravel()
+    colors, indexes = np.unique(pixels, return_inverse=True)
+    palette_image = PILImage.fromarray(indexes.reshape(tile.height, tile.width).astype(np.uint8), "P")
+    palette_image.putpalette(colors.tobytes(), rawmode="RGBA")
+    return palette_image
+
+
+def encode_tile(tile: Image, profile: str = "default") -> bytes:
+    """
+    Encode a single tile
+    :param tile: Tile to encode
+    :param profile: "default" (Pillow defaults), "fast" (low zlib level),
+        "small" (optimized PNG, palette when the tile has at most 256 colors)
+        or "webp" (lossless WEBP)
+    :return: Encoded file contents
+    """
+    buffer = io.BytesIO()
+    if profile == "fast":
+        tile.save(buffer, format="PNG", compress_level=1)
+    elif profile == "small":
+        palette_image = _to_palette(tile)
+        (palette_image or tile).save(buffer, format="PNG", optimize=True)
+    elif profile == "webp":
+        tile.save(buffer, format="WEBP", lossless=True, method=4)
+    elif profile == "default":
+        tile.save(buffer, format="PNG")
+    else:
+        raise ValueError(f"Unknown tile profile: {profile}")
+    return buffer.getvalue()
+
+
+def encode_tiles(tiles: list[Image], profile: str = "default") -> list[bytes]:
+    """
+    Encode a batch of tiles with the same profile
+    :param tiles: Tiles to encode
+    :param profile: Encoder profile, see `encode_tile`
+    :return: Encoded file contents, in the order of `tiles`
+    """
+    return [encode_tile(tile, profile) for tile in tiles]
@@ -10,3 +10,22 @@ class TileLimitError(ConversionError):
 class DimensionError(ConversionError):
     """Raised when image/video dimensions are invalid"""
     pass
+
+
+class WorkspaceQuotaError(ConversionError):
+    """Raised when a job uses more temporary space than its workspace allows"""
+    pass
+
+
+class ProcessError(ConversionError):
+    """Raised when ffmpeg/ffprobe fails; the message ends with the tail of its stderr"""
+
+    def __init__(self, message: str, returncode: int | None = None, stderr: str = ""):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class ProcessTimeoutError(ProcessError):
+    """Raised when an external process exceeds its timeout or the job deadline"""
+    pass
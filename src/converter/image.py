@@ -1,12 +1,48 @@
+import io
 import logging
 import math
+from typing import BinaryIO
+
 import numpy as np
 
 from PIL import Image as PILImage
 from PIL.Image import Image
-from src.converter.colors import normalize_hex_color
+from src.converter.colors import hex_to_rgb
 from src.converter.exceptions import TileLimitError, DimensionError
 
+# Pixel budget for input images, checked before decoding.
+MAX_PIXELS = 100_000_000
+# Pillow's own limit (about 89 megapixels, an error at twice that) is checked on open, before
+# `plan_image` can apply the configured budget, which open_image checks from the header instead
+PILImage.MAX_IMAGE_PIXELS = None
+
+
+def apply_color_key(data: np.ndarray, color: tuple[int, int, int], similarity: float = 20, blend: float = 0) -> None:
+    """
+    Make pixels close to a color transparent, modifying the array in place
+    :param data: RGBA pixel array of shape (height, width, 4)
+    :param color: Key color as (r, g, b)
+    :param similarity: Color similarity threshold (0-100, default 20)
+    :param blend: Blend amount for edge smoothing (0-100, default 0)
+    """
+    # Convert 0-100 scale to 0.0-1.0 scale
+    similarity_normalized = similarity / 100.0
+    blend_normalized = blend / 100.0
+
+    # Calculate color distance
+    diff = data[:, :, :3].astype(np.float32)
+    diff -= np.array(color, dtype=np.float32)
+    distance = np.sqrt((diff * diff).sum(axis=2) / (255.0 ** 2 * 3))
+
+    alpha = data[:, :, 3]
+    if blend_normalized > 0:
+        # Smooth transition
+        mask = np.clip((distance - similarity_normalized) / blend_normalized, 0, 1)
+        data[:, :, 3] = (alpha * mask).astype(np.uint8)
+    else:
+        # Hard edge
+        alpha[distance <= similarity_normalized] = 0
+
 
 def remove_background(image: Image, bg_color: str, similarity: float = 20, blend: float = 0) -> Image:
     """
@@ -22,55 +58,29 @@ def remove_background(image: Image, bg_color: str, similarity: float = 20, blend
         image = image.convert('RGBA')
     
     # Resolve named colors and normalize to 6-char hex.
-    normalized_color = normalize_hex_color(bg_color)
-    if normalized_color is None:
+    color = hex_to_rgb(bg_color)
+    if color is None:
         logging.warning(f"Invalid background color format: {bg_color}")
         return image
-    target_r = int(normalized_color[0:2], 16)
-    target_g = int(normalized_color[2:4], 16)
-    target_b = int(normalized_color[4:6], 16)
     
     # Convert image to numpy array
     data = np.array(image)
-    r, g, b, a = data[:, :, 0], data[:, :, 1], data[:, :, 2], data[:, :, 3]
-    
-    # Convert 0-100 scale to 0.0-1.0 scale
-    similarity_normalized = similarity / 100.0
-    blend_normalized = blend / 100.0
-    
-    # Calculate color distance
-    distance = np.sqrt(
-        ((r.astype(float) - target_r) ** 2 +
-         (g.astype(float) - target_g) ** 2 +
-         (b.astype(float) - target_b) ** 2) / (255.0 ** 2 * 3)
-    )
-    
-    # Create mask based on similarity
-    if blend_normalized > 0:
-        # Smooth transition
-        mask = np.clip((distance - similarity_normalized) / blend_normalized, 0, 1)
-        a = (a * mask).astype(np.uint8)
-    else:
-        # Hard edge
-        mask = distance > similarity_normalized
-        a = np.where(mask, a, 0).astype(np.uint8)
-    
-    # Update alpha channel
-    data[:, :, 3] = a
+    apply_color_key(data, color, similarity, blend)
     
     return PILImage.fromarray(data, 'RGBA')
 
 
-def adjust_size(image: Image, custom_width: int = 0, custom_height: int = 0) -> Image:
+def plan_image_size(width: int, height: int, custom_width: int = 0, custom_height: int = 0) -> tuple[int, int]:
     """
-    Adjust image size to be in range 100x100 - 800x5000 that is max 50 tiles in total
-    :param image:
+    Compute the image size in range 100x100 - 800x5000 that is max 50 tiles in total
+    :param width: Source width in pixels
+    :param height: Source height in pixels
     :param custom_width: Custom width in pixels (0 = auto)
     :param custom_height: Custom height in pixels (0 = auto)
-    :return:
+    :return: Tuple of (width, height)
     """
     # check the image size
-    aspect_ratio = image.width / image.height
+    aspect_ratio = width / height
     if 0.02 > aspect_ratio or aspect_ratio > 50:
         logging.debug("Image size is not ok", aspect_ratio)
         raise DimensionError("Image aspect ratio is not supported (must be between 0.02 and 50)")
@@ -120,14 +130,12 @@ def adjust_size(image: Image, custom_width: int = 0, custom_height: int = 0) ->
         custom_width = max(custom_width, 100)
         custom_height = max(custom_height, 100)
         
-        image = image.resize((custom_width, custom_height))
-        return image
+        return custom_width, custom_height
     
-    if image.width > 100 or image.height > 100:
-        logging.debug("Resizing image")
+    if width > 100 or height > 100:
         # Calculate final dimensions in one pass to avoid multiple resizes
-        final_width = image.width
-        final_height = image.height
+        final_width = width
+        final_height = height
         
         # Apply width constraint
         if final_width > 800:
@@ -151,13 +159,82 @@ def adjust_size(image: Image, custom_width: int = 0, custom_height: int = 0) ->
             max_width = 50 / math.ceil(final_height / 100)
             final_width = min(int(max_width) * 100, final_width)
         
-        # Perform single resize operation
-        if final_width != image.width or final_height != image.height:
-            image = image.resize((final_width, final_height))
+        return final_width, final_height
+    return width, height
+
+
+def adjust_size(image: Image, custom_width: int = 0, custom_height: int = 0, size: tuple[int, int] | None = None) -> Image:
+    """
+    Adjust image size to be in range 100x100 - 800x5000 that is max 50 tiles in total
+    :param image:
+    :param custom_width: Custom width in pixels (0 = auto)
+    :param custom_height: Custom height in pixels (0 = auto)
+    :param size: Final size already planned by `open_image` (the image may be decoded at a reduced scale)
+    :return:
+    """
+    if size is None:
+        size = plan_image_size(image.width, image.height, custom_width, custom_height)
+    # Perform single resize operation
+    if size != image.size:
+        logging.debug("Resizing image")
+        image = image.resize(size)
     return image
 
 
-def convert_to_images(image: Image, custom_width: int = 0, custom_height: int = 0, bg_color: str | None = None, bg_similarity: float = 30, bg_blend: float = 0) -> tuple[list[Image], int, int]:
+def header_size(head: bytes) -> tuple[int, int] | None:
+    """
+    Read the size of an image from the first bytes of its file
+    :param head: Start of the file
+    :return: (width, height), or None if the header is cut off or the format is unknown
+    """
+    try:
+        return PILImage.open(io.BytesIO(head)).size
+    except (OSError, SyntaxError):
+        return None
+
+
+def plan_image(width: int, height: int, custom_width: int = 0, custom_height: int = 0, max_pixels: int = MAX_PIXELS) -> tuple[int, int]:
+    """
+    Check an image of the given size against the pixel budget and plan its tiled size,
+    e.g. from metadata before the image is downloaded
+    :param width: Source width in pixels
+    :param height: Source height in pixels
+    :param custom_width: Custom width in pixels (0 = auto)
+    :param custom_height: Custom height in pixels (0 = auto)
+    :param max_pixels: Pixel budget
+    :return: Final size to pass to `convert_to_images`
+    :raises DimensionError: if the image is over the pixel budget or has invalid dimensions
+    :raises TileLimitError: if the custom size needs too many tiles
+    """
+    if width * height > max_pixels:
+        raise DimensionError(
+            f"Image is too large ({width}x{height}, max {max_pixels // 1_000_000} megapixels)"
+        )
+    return plan_image_size(width, height, custom_width, custom_height)
+
+
+def open_image(fp: BinaryIO, custom_width: int = 0, custom_height: int = 0, max_pixels: int = MAX_PIXELS) -> tuple[Image, tuple[int, int]]:
+    """
+    Open an image and decode it close to the size it will be converted to
+    :param fp: Image file
+    :param custom_width: Custom width in pixels (0 = auto)
+    :param custom_height: Custom height in pixels (0 = auto)
+    :param max_pixels: Pixel budget; bigger images are rejected before decoding
+    :return: Tuple of (image, final size to pass to `convert_to_images`)
+    """
+    image = PILImage.open(fp)  # only reads the header
+    size = plan_image(image.width, image.height, custom_width, custom_height, max_pixels)
+    if image.format == "JPEG":
+        # let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying above the target size
+        image.draft(image.mode, size)
+    else:
+        factor = min(image.width // size[0], image.height // size[1])
+        if factor >= 2 and image.mode in ("L", "LA", "RGB", "RGBA"):
+            image = image.reduce(factor)
+    return image, size
+
+
+def convert_to_images(image: Image, custom_width: int = 0, custom_height: int = 0, bg_color: str | None = None, bg_similarity: float = 30, bg_blend: float = 0, size: tuple[int, int] | None = None) -> tuple[list[Image], int, int]:
     """
     Slice image to 100x100 tiles
     :param image:
@@ -166,13 +243,14 @@ def convert_to_images(image: Image, custom_width: int = 0, custom_height: int =
     :param bg_color: Background color to remove as hex or name (e.g., "#FFFFFF", "white")
     :param bg_similarity: Color similarity threshold (0-100, default 30)
     :param bg_blend: Blend amount for edge smoothing (0-100, default 0)
+    :param size: Final size returned by `open_image`, if the image was opened with it
     :return: Tuple of (tiles, tiles_width, tiles_height)
     """
     # Remove background if color is specified
     if bg_color:
         image = remove_background(image, bg_color, bg_similarity, bg_blend)
     
-    image = adjust_size(image, custom_width, custom_height)
+    image = adjust_size(image, custom_width, custom_height, size)
     tiles_width = math.ceil(image.width / 100)
     tiles_height = math.ceil(image.height / 100)
     transparent = PILImage.new("RGBA", (tiles_width * 100, tiles_height * 100),
@@ -0,0 +1,131 @@
+"""Runs external processes (ffmpeg, ffprobe) with deadlines, CPU weighting and guaranteed cleanup."""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import signal
+import time
+from typing import Iterator, NamedTuple
+
+from src.converter.exceptions import ProcessError, ProcessTimeoutError
+
+# Per-call timeout in seconds when the caller doesn't pass one.
+DEFAULT_TIMEOUT = 120.0
+# How much of stderr ends up in ProcessError messages.
+STDERR_TAIL = 500
+
+
+class JobLimits(NamedTuple):
+    deadline: float | None = None  # time.monotonic() value
+    nice: int = 0
+    cgroup: str | None = None
+
+
+_limits: contextvars.ContextVar[JobLimits] = contextvars.ContextVar("job_limits", default=JobLimits())
+
+
+@contextlib.contextmanager
+def job_limits(timeout: float | None = None, nice: int = 0, cgroup: str | None = None) -> Iterator[None]:
+    """Applies limits to every process started inside the block (in this task and tasks it spawns).
+
+    Args:
+        timeout: Seconds the whole job may take; each call's timeout is cut to what remains
+        nice: Niceness increment for the processes, to run background work at lower priority
+        cgroup: cgroup v2 directory the processes are moved to, e.g. one with a lower cpu.weight
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    token = _limits.set(JobLimits(deadline, nice, cgroup))
+    try:
+        yield
+    finally:
+        _limits.reset(token)
+
+
+def remaining_time(timeout: float | None = DEFAULT_TIMEOUT) -> float | None:
+    """Returns the smaller of `timeout` and the time left until the job deadline.
+
+    Raises:
+        ProcessTimeoutError: if the job deadline has already passed
+    """
+    deadline = _limits.get().deadline
+    if deadline is None:
+        return timeout
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise ProcessTimeoutError("The job took too long")
+    return left if timeout is None else min(timeout, left)
+
+
+def stderr_tail(stderr: bytes | None) -> str:
+    if not stderr:
+        return ""
+    tail = stderr[-STDERR_TAIL:]
+    if len(stderr) > STDERR_TAIL and b"\n" in tail:
+        tail = tail.split(b"\n", 1)[1]  # don't start in the middle of a line
+    return tail.decode("utf-8", errors="replace").strip()
+
+
+async def spawn(*cmd: str, **kwargs) -> asyncio.subprocess.Process:
+    """Starts a process in its own process group, applying the current job's CPU weighting.
+
+    Keyword arguments are passed to `asyncio.create_subprocess_exec`.
+    """
+    limits = _limits.get()
+    if limits.nice:
+        cmd = ("nice", "-n", str(limits.nice), *cmd)
+    proc = await asyncio.create_subprocess_exec(*cmd, start_new_session=True, **kwargs)
+    if limits.cgroup:
+        try:
+            with open(os.path.join(limits.cgroup, "cgroup.procs"), "w") as f:
+                f.write(str(proc.pid))
+        except OSError as e:
+            logging.warning("Can't move process %s to cgroup %s: %s", proc.pid, limits.cgroup, e)
+    return proc
+
+
+async def kill(proc: asyncio.subprocess.Process) -> None:
+    """Kills the process together with everything it started, and reaps it."""
+    if proc.returncode is not None:
+        return
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(proc.pid, signal.SIGKILL)
+    await proc.wait()
+
+
+async def run(cmd: list[str], timeout: float | None = DEFAULT_TIMEOUT, capture_stderr: bool = True) -> bytes:
+    """Runs a command and returns its stdout.
+
+    The process group is killed if the timeout or job deadline expires,
+    or if the awaiting task is cancelled.
+
+    Args:
+        cmd: Command and arguments
+        timeout: Seconds this call may take (None = only the job deadline)
+        capture_stderr: Keep stderr for error messages instead of discarding it
+
+    Raises:
+        ProcessTimeoutError: if the process didn't finish in time
+        ProcessError: if the process exited with a non-zero code
+    """
+    timeout = remaining_time(timeout)
+    proc = await spawn(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE if capture_stderr else asyncio.subprocess.DEVNULL,
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise ProcessTimeoutError(f"{cmd[0]} timed out after {timeout:.1f}s") from None
+    finally:
+        await kill(proc)
+    if proc.returncode:
+        tail = stderr_tail(err)
+        raise ProcessError(
+            f"{cmd[0]} exited with code {proc.returncode}" + (f": {tail}" if tail else ""),
+            returncode=proc.returncode,
+            stderr=tail,
+        )
+    return out
@@ -0,0 +1,206 @@
+"""In-process video backend built on PyAV (`pip install av`).
+
+The source is decoded, normalized, keyed and encoded into every tile inside one
+process, so the per-call ffmpeg startup and codec initialization of
+`SubprocessBackend` are paid once per job instead of once per tile.
+"""
+
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import threading
+from concurrent.futures import Executor
+from fractions import Fraction
+from typing import List
+
+import numpy as np
+
+from src.converter import process
+from src.converter.colors import hex_to_rgb
+from src.converter.exceptions import ConversionError, ProcessTimeoutError
+from src.converter.image import apply_color_key
+from src.converter.video import VP9_PROFILES, VideoInfo, _raise_oversized, modify_video_duration
+from src.converter.workspace import Workspace
+
+try:
+    import av
+except ImportError:  # optional dependency
+    av = None
+
+
+def codec_options(encoder_profile: str) -> dict[str, str]:
+    """Turns the ffmpeg arguments of a VP9_PROFILES entry into codec options."""
+    args = VP9_PROFILES[encoder_profile]
+    return {"crf": "40", **{key.lstrip("-"): value for key, value in zip(args[::2], args[1::2])}}
+
+
+def probe(filename: str) -> VideoInfo:
+    """Probes size, average frame rate and duration of a video, like `probe_video`."""
+    try:
+        with av.open(filename) as container:
+            stream = container.streams.video[0]
+            fps = Fraction(stream.average_rate or 0)
+            duration = None
+            if container.duration is not None:
+                duration = container.duration / av.time_base
+            elif stream.duration is not None and stream.time_base:
+                duration = float(stream.duration * stream.time_base)
+            return VideoInfo(stream.codec_context.width, stream.codec_context.height, fps or Fraction(30), duration)
+    except (av.FFmpegError, IndexError) as e:
+        # FFmpeg errors name the workspace file, they go to the log only
+        logging.warning("Can't read the video: %s", e)
+        raise ConversionError("Can't read the video") from e
+
+
+def encode_tiles(filename: str, tiles: List[str], target: VideoInfo, key_color: tuple[int, int, int] | None, bg_similarity: float, bg_blend: float, encoder_profile: str, cancelled: threading.Event) -> None:
+    """Decodes the video once and encodes every 100x100 tile of each normalized frame.
+
+    Args:
+        filename: Source video
+        tiles: Output filenames, row by row
+        target: Window, size, frame rate and duration to normalize to, see `plan_normalization`
+        key_color: Background color to make transparent, or None
+        bg_similarity: Color similarity threshold (0-100)
+        bg_blend: Blend amount for edge smoothing (0-100)
+        encoder_profile: Name of the VP9_PROFILES entry to encode with
+        cancelled: Set by the caller to stop early
+    """
+    num_cols = math.ceil(target.width / 100)
+    frame_width, frame_height = num_cols * 100, math.ceil(target.height / 100) * 100
+    max_frames = round(target.duration * target.fps) if target.duration else None
+    options = codec_options(encoder_profile)
+
+    with av.open(filename) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        start = None
+        if target.start:
+            # seek to the keyframe before the window and drop the frames up to its start, like `-ss`
+            start = target.start + float((stream.start_time or 0) * stream.time_base)
+            container.seek(int(start / stream.time_base), stream=stream)
+        # same chain as the frames engine: resample, scale, pad to whole tiles with transparency
+        graph = av.filter.Graph()
+        chain = [
+            graph.add_buffer(template=stream),
+            graph.add("fps", str(target.fps)),
+            graph.add("scale", f"{target.width}:{target.height}"),
+            graph.add("format", "rgba"),
+            graph.add("pad", f"{frame_width}:{frame_height}:0:0:color=black@0"),
+            graph.add("buffersink"),
+        ]
+        for source, sink in zip(chain, chain[1:]):
+            source.link_to(sink)
+        graph.configure()
+
+        outputs = []
+        try:
+            for tile_filename in tiles:
+                output = av.open(tile_filename, "w", format="webm")
+                output.metadata["title"] = "@itosbot"
+                tile_stream = output.add_stream("libvpx-vp9", rate=target.fps, options=options)
+                tile_stream.width = tile_stream.height = 100
+                tile_stream.pix_fmt = "yuva420p"
+                outputs.append((output, tile_stream))
+
+            count = 0
+
+            def encode(frame: "av.VideoFrame") -> None:
+                nonlocal count
+                data = frame.to_ndarray()
+                if not data.flags.writeable:
+                    data = data.copy()
+                if key_color is not None:
+                    apply_color_key(data, key_color, bg_similarity, bg_blend)
+                for index, (output, tile_stream) in enumerate(outputs):
+                    row, col = divmod(index, num_cols)
+                    tile = av.VideoFrame.from_ndarray(
+                        np.ascontiguousarray(data[row * 100:(row + 1) * 100, col * 100:(col + 1) * 100]),
+                        format="rgba",
+                    )
+                    tile.pts = count
+                    output.mux(tile_stream.encode(tile.reformat(format="yuva420p")))
+                count += 1
+
+            def drain() -> bool:
+                """Encodes the filtered frames that are ready; False once enough frames are written."""
+                while True:
+                    if max_frames is not None and count >= max_frames:
+                        return False
+                    try:
+                        encode(graph.vpull())
+                    except (BlockingIOError, av.EOFError):
+                        return True
+
+            for frame in container.decode(stream):
+                if cancelled.is_set():
+                    raise ProcessTimeoutError("Tile encoding timed out")
+                if start is not None and frame.time is not None and frame.time < start:
+                    continue
+                graph.vpush(frame)
+                if not drain():
+                    break
+            else:
+                graph.vpush(None)
+                drain()
+
+            for output, tile_stream in outputs:
+                output.mux(tile_stream.encode(None))
+        finally:
+            for output, _ in outputs:
+                output.close()
+
+
+class PyAVBackend:
+    """Probes and encodes with PyAV on an executor, one process for the whole job.
+
+    Args:
+        executor: Where the blocking decode/encode loop runs (default: the loop's default executor)
+    """
+
+    def __init__(self, executor: Executor | None = None):
+        if av is None:
+            raise ImportError("The PyAV backend needs the av package")
+        self.executor = executor
+
+    async def probe(self, filename: str) -> VideoInfo:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, probe, filename)
+
+    async def tile(self, workspace: Workspace, filename: str, target: VideoInfo, bg_color: str | None, bg_similarity: float, bg_blend: float, strip_metadata: bool, encoder_profile: str) -> List[str]:
+        num_rows = math.ceil(target.height / 100)
+        num_cols = math.ceil(target.width / 100)
+        key_color = None
+        if bg_color:
+            key_color = hex_to_rgb(bg_color)
+            if key_color is None:
+                logging.warning("Invalid background color format: %s", bg_color)
+        tiles = [workspace.file(f"tile{i}_{j}.webm") for i in range(num_rows) for j in range(num_cols)]
+
+        # the thread can't be killed, so it is asked to stop and awaited on timeout or cancellation
+        cancelled = threading.Event()
+        job = asyncio.get_running_loop().run_in_executor(
+            self.executor, encode_tiles, filename, tiles, target, key_color, bg_similarity, bg_blend, encoder_profile, cancelled
+        )
+        try:
+            await asyncio.wait_for(asyncio.shield(job), process.remaining_time())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            cancelled.set()
+            # whatever the stopped job ends with, the timeout or cancellation is what is raised
+            with contextlib.suppress(Exception):
+                await job
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise ProcessTimeoutError("Tile encoding timed out") from None
+        except av.FFmpegError as e:
+            logging.warning("Tile encoding failed: %s", e)
+            raise ConversionError("Something went wrong during tile cropping") from e
+
+        max_size = 0
+        for tile_filename in tiles:
+            # Modify duration metadata to bypass duration checks
+            await modify_video_duration(tile_filename, strip_metadata)
+            max_size = max(max_size, os.path.getsize(tile_filename))
+        if max_size > 64 * 1024:
+            _raise_oversized(max_size)
+        return tiles
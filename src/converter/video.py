@@ -3,27 +3,59 @@ import logging
 import math
 import os
 import shutil
-import subprocess
 import tempfile
 import asyncio
-from typing import BinaryIO, Tuple, List
+import json
+from fractions import Fraction
+from typing import BinaryIO, NamedTuple, Protocol, Tuple, List
 
+import numpy as np
 import PIL
 from PIL.Image import Image
 
-from src.converter.colors import normalize_hex_color
-from src.converter.exceptions import ConversionError, TileLimitError
-
-
-async def async_check_output(cmd, stderr=None) -> bytes:
-    """Run a subprocess command asynchronously and return its stdout output as bytes."""
-    if stderr == subprocess.DEVNULL:
-        stderr = asyncio.subprocess.DEVNULL
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=stderr)
-    out, err = await proc.communicate()
-    if proc.returncode:
-        raise subprocess.CalledProcessError(proc.returncode, cmd, output=out, stderr=err)
-    return out
+from src.converter import process, webm
+from src.converter.colors import hex_to_rgb, normalize_hex_color
+from src.converter.exceptions import ConversionError, ProcessError, ProcessTimeoutError, TileLimitError, WorkspaceQuotaError
+from src.converter.image import apply_color_key
+from src.converter.workspace import Workspace
+
+
+# libvpx-vp9 speed settings for tile encodes; "default" leaves libvpx's good-quality defaults.
+VP9_PROFILES: dict[str, list[str]] = {
+    "default": [],
+    "fast": [
+        "-deadline", "realtime",
+        "-cpu-used", "8",
+        "-row-mt", "1",
+        "-lag-in-frames", "0",
+        "-g", "300",
+        "-threads", "1",
+    ],
+    "balanced": [
+        "-deadline", "good",
+        "-cpu-used", "4",
+        "-row-mt", "1",
+        "-lag-in-frames", "16",
+        "-g", "300",
+        "-threads", "1",
+    ],
+    "quality": [
+        "-deadline", "good",
+        "-cpu-used", "1",
+        "-row-mt", "1",
+        "-lag-in-frames", "25",
+        "-g", "300",
+        "-threads", "2",
+    ],
+}
+
+
+async def async_check_output(cmd, timeout: float | None = process.DEFAULT_TIMEOUT) -> bytes:
+    """Run a subprocess command asynchronously and return its stdout output as bytes.
+
+    See `process.run` for timeouts, cancellation and errors.
+    """
+    return await process.run(cmd, timeout)
 
 
 async def probe_video_dimensions(tempdir: str, filename: str) -> Tuple[int, int]:
@@ -34,13 +66,118 @@ async def probe_video_dimensions(tempdir: str, filename: str) -> Tuple[int, int]
         "-show_entries", "stream=width,height",
         "-of", "csv=p=0:s=x",
         "-i", f"{tempdir}/{filename}"
-    ], stderr=subprocess.DEVNULL)
+    ])
     dims = output.decode("utf-8").strip().split("x")
     return int(dims[0]), int(dims[1])
 
 
+class VideoInfo(NamedTuple):
+    """Video stream metadata, either probed or the planned result of `normalize_video`."""
+    width: int
+    height: int
+    fps: Fraction
+    duration: float | None
+    start: float = 0  # where a planned video starts in the source, in seconds
+
+
+def _window_args(target: VideoInfo) -> list[str]:
+    """Input options that seek to the planned window and stop reading after it."""
+    args = []
+    if target.start:
+        args += ["-ss", f"{target.start:.3f}"]
+    if target.duration:
+        args += ["-t", f"{target.duration:.3f}"]
+    return args
+
+
+async def probe_video(filename: str) -> VideoInfo:
+    """Probes size, average frame rate and duration of a video with a single ffprobe call."""
+    output = await async_check_output([
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate:format=duration",
+        "-of", "json",
+        filename
+    ])
+    data = json.loads(output)
+    stream = data["streams"][0]
+    try:
+        fps = Fraction(stream.get("avg_frame_rate", "0/0"))
+    except (ValueError, ZeroDivisionError):
+        fps = Fraction(0)
+    try:
+        duration = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    # GIFs and some containers report 0/0 when the rate is unknown
+    return VideoInfo(int(stream["width"]), int(stream["height"]), fps or Fraction(30), duration)
+
+
+STILL_SAMPLE_SIZE = 64
+
+
+async def is_still(filename: str, start: float = 0, duration: float | None = None, samples: int = 8, tolerance: int = 8) -> bool:
+    """Checks whether a video shows a single picture, e.g. a one-frame GIF or a screenshot saved as a video.
+
+    Decodes `samples` frames spread over the window at a small size and compares them with
+    the first one; that is cheap next to encoding, and downscaling evens out dithering noise.
+
+    Args:
+        filename: Video file
+        start: Start of the window in seconds
+        duration: Length of the window in seconds, None for the whole video
+        samples: Frames to compare
+        tolerance: Largest per-channel difference (0-255) still counted as the same picture
+
+    Returns:
+        True if at least two frames were sampled and all of them match the first one
+    """
+    size = STILL_SAMPLE_SIZE
+    rate = f"{samples / duration:.6f}" if duration else "1"
+    output = await async_check_output([
+        "ffmpeg",
+        "-v", "error",
+        *_window_args(VideoInfo(0, 0, Fraction(0), duration, start)),
+        "-i", filename,
+        "-vf", f"fps={rate}:eof_action=pass,scale={size}:{size}:flags=area,format=rgba",
+        "-frames:v", str(samples),
+        "-f", "rawvideo",
+        "pipe:1",
+    ])
+    frame_size = size * size * 4
+    frames = np.frombuffer(output[:len(output) // frame_size * frame_size], dtype=np.uint8).reshape(-1, frame_size)
+    if len(frames) == 0:
+        raise ConversionError("No frames in the selected part of the video")
+    if len(frames) < 2:
+        # nothing to compare with; encoding it as a video is always correct
+        return False
+    difference = np.abs(frames[1:].astype(np.int16) - frames[0].astype(np.int16))
+    return int(difference.max()) <= tolerance
+
+
+async def extract_frame(filename: str, start: float = 0) -> bytes:
+    """Returns the frame at `start` as a PNG, keeping transparency."""
+    return await async_check_output([
+        "ffmpeg",
+        "-v", "error",
+        *(["-ss", f"{start:.3f}"] if start else []),
+        "-i", filename,
+        "-frames:v", "1",
+        "-pix_fmt", "rgba",
+        "-c:v", "png",
+        "-f", "image2pipe",
+        "pipe:1",
+    ])
+
+
 async def ensure_even_dimensions(width: float, height: float) -> Tuple[int, int]:
     """Ensures both width and height are even numbers."""
+    return even_dimensions(width, height)
+
+
+def even_dimensions(width: float, height: float) -> Tuple[int, int]:
+    """Synchronous version of `ensure_even_dimensions`."""
     width = int(width)
     height = int(height)
     # Make sure both dimensions are even
@@ -52,6 +189,70 @@ async def ensure_even_dimensions(width: float, height: float) -> Tuple[int, int]
     return width, height
 
 
+def plan_video_dimensions(width: int, height: int, custom_width: int = 0, custom_height: int = 0) -> Tuple[int, int]:
+    """Computes the frame size a video is scaled to before tiling.
+
+    Mirrors the scaling steps of `convert_video`, so the result can be applied in a single ffmpeg pass.
+
+    Args:
+        width: Source width in pixels
+        height: Source height in pixels
+        custom_width: Custom width in pixels (0 = auto)
+        custom_height: Custom height in pixels (0 = auto)
+
+    Returns:
+        Tuple of (width, height)
+    """
+    if custom_width > 0 or custom_height > 0:
+        aspect_ratio = width / height
+        if custom_width > 0 and custom_height > 0:
+            final_width = custom_width
+            final_height = custom_height
+            total_tiles = math.ceil(final_width / 100) * math.ceil(final_height / 100)
+            if total_tiles > 50:
+                raise TileLimitError(f"Custom dimensions would create {total_tiles} tiles (max 50). Reduce width or height.")
+        elif custom_width > 0:
+            final_width = custom_width
+            final_height = max(int(custom_width / aspect_ratio), 100)
+        else:
+            final_height = custom_height
+            final_width = max(int(custom_height * aspect_ratio), 100)
+
+        max_tiles_width = math.ceil(final_width / 100)
+        if max_tiles_width * math.ceil(final_height / 100) > 50:
+            final_height = min(final_height, (50 // max_tiles_width) * 100)
+        width, height = even_dimensions(max(final_width, 100), max(final_height, 100))
+
+    if width > 100 or height > 100:
+        if width > 800:
+            width, height = even_dimensions(800, height / (width / 800))
+        if height > 5000:
+            width, height = even_dimensions(width / (height / 5000), 5000)
+
+        aspect_ratio = width / height
+        if aspect_ratio > 1:
+            max_height = 50 / math.ceil(width / 100)
+            target_height = min(int(max_height) * 100, height)
+            target_width = int(width * (target_height / height))
+        elif aspect_ratio == 1:
+            max_size = 50 / math.ceil(width / 100)
+            target_width = target_height = min(int(max_size) * 100, width)
+        else:
+            max_width = 50 / math.ceil(height / 100)
+            target_width = min(int(max_width) * 100, width)
+            target_height = int(height * (target_width / width))
+        width, height = even_dimensions(target_width, target_height)
+
+        if math.ceil(width / 100) * math.ceil(height / 100) <= 50:
+            width, height = even_dimensions(math.ceil(width / 100) * 100, math.ceil(height / 100) * 100)
+
+    num_cells = math.ceil(width / 100) * math.ceil(height / 100)
+    if num_cells > 50:
+        scale_factor = math.sqrt(50 / num_cells)
+        width, height = even_dimensions(int(width * scale_factor), int(height * scale_factor))
+    return width, height
+
+
 async def scale_video(tempdir: str, input_filename: str, output_filename: str, scale_filter: str) -> None:
     """Scales a video using ffmpeg with the specified scale filter."""
     await async_check_output([
@@ -61,7 +262,52 @@ async def scale_video(tempdir: str, input_filename: str, output_filename: str, s
         "-an",
         "-vf", scale_filter,
         f"{tempdir}/{output_filename}"
-    ], stderr=subprocess.DEVNULL)
+    ])
+
+async def normalize_video(tempdir: str, input_filename: str, output_filename: str, target: VideoInfo, max_size: int | None = None) -> None:
+    """Scales, caps the frame rate, trims and drops audio in a single ffmpeg pass.
+
+    The output is lossless FFV1, which keeps transparency for the tile encoders.
+
+    Raises:
+        WorkspaceQuotaError: If the output would be larger than `max_size` bytes
+    """
+    output = f"{tempdir}/{output_filename}"
+    await async_check_output([
+        "ffmpeg", "-y",
+        *_window_args(target),
+        "-i", f"{tempdir}/{input_filename}",
+        "-an",
+        "-vf", f"fps={target.fps},scale={target.width}:{target.height}",
+        "-c:v", "ffv1",
+        *(["-fs", str(max_size)] if max_size is not None else []),
+        output
+    ])
+    # -fs makes ffmpeg stop writing at the limit instead of failing, leaving a cut video
+    if max_size is not None and os.path.getsize(output) >= max_size:
+        raise WorkspaceQuotaError(
+            f"The video needs more than {max_size / 2**20:.1f}MB of temporary space, please send a shorter or smaller one"
+        )
+
+
+def plan_normalization(source: VideoInfo, custom_width: int = 0, custom_height: int = 0, max_fps: float = 30, max_duration: float = 5, start: float = 0, length: float | None = None) -> VideoInfo:
+    """Computes the metadata of the video `normalize_video` produces from the source.
+
+    Only the window of `length` seconds (at most `max_duration`) from `start` is kept,
+    so longer videos are cut instead of rejected.
+
+    Raises:
+        ConversionError: If the window starts after the end of the video
+    """
+    width, height = plan_video_dimensions(source.width, source.height, custom_width, custom_height)
+    fps = min(source.fps, Fraction(max_fps).limit_denominator(1001))
+    duration = max_duration if length is None else min(length, max_duration)
+    if source.duration:
+        if start >= source.duration:
+            raise ConversionError(f"The video is only {source.duration:.1f} seconds long, it can't start at {start:g}.")
+        duration = min(duration, source.duration - start)
+    return VideoInfo(width, height, fps, duration, start)
+
 
 async def get_video_length(filename: str) -> float:
     """Gets the length of a video file in seconds."""
@@ -71,24 +317,17 @@ async def get_video_length(filename: str) -> float:
         "-show_entries", "format=duration",
         "-of", "default=noprint_wrappers=1:nokey=1",
         filename
-    ], stderr=subprocess.DEVNULL)
+    ])
     return float(output.decode("utf-8").strip())
 
-async def modify_video_duration(filename: str) -> None:
-    """Modifies the duration metadata in a WebM file to bypass duration checks."""
-    with open(filename, "rb") as f:
-        data = bytearray(f.read())
-    
-    DURATION_ID = b'\x44\x89'
-    MICROVALUE = b'\x00\x40\xbf\x48\x00\x00'
-    
-    index = data.find(DURATION_ID)
-    if index != -1:
-        index += len(DURATION_ID)
-        data[index:index + len(MICROVALUE)] = MICROVALUE
-        
-        with open(filename, "wb") as f:
-            f.write(data)
+async def modify_video_duration(filename: str, strip_metadata: bool = False) -> None:
+    """Modifies the duration metadata in a WebM file to bypass duration checks.
+
+    Args:
+        filename: Path to the WebM file
+        strip_metadata: Also remove the title and tags to save bytes
+    """
+    webm.postprocess(filename, strip_metadata)
 
 async def reencode_tile_with_higher_compression(tile_filename: str, source_video: str, crop_filter: str, crf: int = 50) -> bool:
     """Re-encodes a tile with higher compression (higher CRF) to reduce file size.
@@ -113,7 +352,7 @@ async def reencode_tile_with_higher_compression(tile_filename: str, source_video
             "-pix_fmt", "yuva420p",
             "-metadata", "title=@itosbot",
             tile_filename
-        ], stderr=subprocess.PIPE)
+        ])
         
         await modify_video_duration(tile_filename)
         
@@ -122,7 +361,7 @@ async def reencode_tile_with_higher_compression(tile_filename: str, source_video
     except:
         return False
 
-async def crop_tiles(tempdir: str, filename: str, width: int, height: int, bg_color: str | None = None, bg_similarity: float = 30, bg_blend: float = 0) -> List[str]:
+async def crop_tiles(tempdir: str, filename: str, width: int, height: int, bg_color: str | None = None, bg_similarity: float = 30, bg_blend: float = 0, strip_metadata: bool = False, encoder_profile: str = "default") -> List[str]:
     """Crops the video into 100x100 tiles and returns a list of tile filenames."""
     tiles = []
     num_rows = math.ceil(height / 100)
@@ -168,16 +407,21 @@ async def crop_tiles(tempdir: str, filename: str, width: int, height: int, bg_co
                     "-vf", vf_string,
                     "-crf", "40",
                     "-c:v", "libvpx-vp9",
+                    *VP9_PROFILES[encoder_profile],
                     "-pix_fmt", "yuva420p",
                     "-metadata", "title=@itosbot",
                     tile_filename
-                ], stderr=subprocess.PIPE)
+                ])
             #     WHY DOES ARGUMENT ORDER FOR OUTPUT MATTER? IF NOT LAST FFMPEG WILL NOT FORCE PIX_FMT
-            except subprocess.CalledProcessError as e:
+            except ProcessTimeoutError:
+                raise
+            except ProcessError as e:
+                # the stderr names workspace files and filters, it goes to the log only
+                logging.warning("Tile cropping failed: %s", e)
                 raise ConversionError("Something went wrong during tile cropping") from e
             
             # Modify duration metadata to bypass duration checks
-            await modify_video_duration(tile_filename)
+            await modify_video_duration(tile_filename, strip_metadata)
             
             # Check file size and track oversized tiles
             file_size = os.path.getsize(tile_filename)
@@ -188,163 +432,231 @@ async def crop_tiles(tempdir: str, filename: str, width: int, height: int, bg_co
     
     # Try to fix oversized tiles with higher compression
     if oversized_tiles:
-        max_size = max(file_size for _, _, file_size in oversized_tiles)
-        max_size_kb = max_size / 1024
-        raise ConversionError(
-            f"Video quality is too high for Telegram's limits. "
-            f"Largest tile: {max_size_kb:.1f}KB (max: 64KB). "
-            f"Try a shorter video, lower resolution, or simpler content."
-            )
+        _raise_oversized(max(file_size for _, _, file_size in oversized_tiles))
     
     return tiles
 
 
-async def convert_video(video: BinaryIO, custom_width: int = 0, custom_height: int = 0, bg_color: str | None = None, bg_similarity: float = 20, bg_blend: float = 0) -> tuple[List[str], int, int]:
-    """Converts an input video into a set of cropped tile video files.
-    
+def _raise_oversized(max_size: int) -> None:
+    max_size_kb = max_size / 1024
+    raise ConversionError(
+        f"Video quality is too high for Telegram's limits. "
+        f"Largest tile: {max_size_kb:.1f}KB (max: 64KB). "
+        f"Try a shorter video, lower resolution, or simpler content."
+        )
+
+
+async def crop_tiles_from_frames(tempdir: str, filename: str, target: VideoInfo, bg_color: str | None = None, bg_similarity: float = 30, bg_blend: float = 0, strip_metadata: bool = False, encoder_profile: str = "default") -> List[str]:
+    """Decodes and normalizes the video once into raw RGBA frames and feeds 100x100 slices to per-tile encoders.
+
+    Unlike `crop_tiles`, the source is decoded a single time and the background is keyed
+    in NumPy (the same way `remove_background` does for images) instead of in every tile's filtergraph.
+
     Args:
-        video: Input video file as BinaryIO
-        custom_width: Custom width in pixels (0 = auto)
-        custom_height: Custom height in pixels (0 = auto)
+        tempdir: Directory holding the source video; tiles are written next to it
+        filename: Source video filename
+        target: Size, frame rate and duration to normalize the video to, see `plan_normalization`
         bg_color: Background color to remove as hex or name (e.g., "#FFFFFF", "white")
-        bg_similarity: Color similarity threshold (0-100, default 20)
+        bg_similarity: Color similarity threshold (0-100, default 30)
         bg_blend: Blend amount for edge smoothing (0-100, default 0)
-    
+        strip_metadata: Remove the title and tags from the tiles
+        encoder_profile: Name of the VP9_PROFILES entry to encode with
+
     Returns:
-        Tuple of (tiles, tiles_width, tiles_height)
+        List of tile filenames, row by row
     """
-    tempdir = tempfile.mkdtemp()
-    completed = False
-    filename = "video.mp4"
-    with open(f"{tempdir}/{filename}", "wb") as f:
-        f.write(video.read())
-
-    width, height = await probe_video_dimensions(tempdir, filename)
+    num_rows = math.ceil(target.height / 100)
+    num_cols = math.ceil(target.width / 100)
+    key_color = None
+    if bg_color:
+        key_color = hex_to_rgb(bg_color)
+        if key_color is None:
+            logging.warning("Invalid background color format: %s", bg_color)
 
-    # Apply custom dimensions if specified
-    if custom_width > 0 or custom_height > 0:
-        aspect_ratio = width / height
+    fps = str(target.fps)
+    frame_width, frame_height = num_cols * 100, num_rows * 100
 
-        # Determine final dimensions
-        if custom_width > 0 and custom_height > 0:
-            # Both specified - use both
-            final_width = custom_width
-            final_height = custom_height
+    decoder = await process.spawn(
+        "ffmpeg",
+        "-v", "error",
+        *_window_args(target),
+        "-i", f"{tempdir}/{filename}",
+        "-an",
+        # pad to whole tiles with transparent pixels, like convert_to_images does
+        "-vf", f"fps={fps},scale={target.width}:{target.height},format=rgba,"
+               f"pad={frame_width}:{frame_height}:0:0:color=black@0",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgba",
+        "-",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    decoder_errors = asyncio.ensure_future(decoder.stderr.read())
+    tiles = [f"{tempdir}/tile{i}_{j}.webm" for i in range(num_rows) for j in range(num_cols)]
+    encoders = []
+    try:
+        async with asyncio.timeout(process.remaining_time()):
+            await _pipe_tiles(decoder, encoders, tiles, fps, frame_width, frame_height, key_color, bg_similarity, bg_blend, encoder_profile)
+        if decoder.returncode:
+            tail = process.stderr_tail(await decoder_errors)
+            raise ProcessError(f"ffmpeg exited with code {decoder.returncode}: {tail}", decoder.returncode, tail)
+        if any(encoder.returncode for encoder in encoders):
+            raise ConversionError("Something went wrong during tile cropping")
+    except TimeoutError:
+        raise ProcessTimeoutError("Tile encoding timed out") from None
+    except (BrokenPipeError, ConnectionResetError) as e:
+        raise ConversionError("Something went wrong during tile cropping") from e
+    finally:
+        for proc in (decoder, *encoders):
+            await process.kill(proc)
+        decoder_errors.cancel()
+
+    max_size = 0
+    for tile_filename in tiles:
+        # Modify duration metadata to bypass duration checks
+        await modify_video_duration(tile_filename, strip_metadata)
+        max_size = max(max_size, os.path.getsize(tile_filename))
+    if max_size > 64 * 1024:
+        _raise_oversized(max_size)
 
-            # Check tile limit when both dimensions are specified
-            max_tiles_width = math.ceil(final_width / 100)
-            max_tiles_height = math.ceil(final_height / 100)
-            total_tiles = max_tiles_width * max_tiles_height
+    return tiles
 
-            if total_tiles > 50:
-                raise TileLimitError(f"Custom dimensions would create {total_tiles} tiles (max 50). Reduce width or height.")
-        elif custom_width > 0:
-            # Only width specified - calculate height from aspect ratio
-            final_width = custom_width
-            final_height = max(int(custom_width / aspect_ratio), 100)
-        else:
-            # Only height specified - calculate width from aspect ratio
-            final_height = custom_height
-            final_width = max(int(custom_height * aspect_ratio), 100)
 
-        custom_width = final_width
-        custom_height = final_height
+async def _pipe_tiles(decoder: asyncio.subprocess.Process, encoders: list, tiles: List[str], fps: str, frame_width: int, frame_height: int, key_color: tuple[int, int, int] | None, bg_similarity: float, bg_blend: float, encoder_profile: str) -> None:
+    """Starts one encoder per tile and feeds it the tile's slice of every decoded frame."""
+    for tile_filename in tiles:
+        encoders.append(await process.spawn(
+            "ffmpeg",
+            "-y",
+            "-f", "rawvideo",
+            "-pix_fmt", "rgba",
+            "-s", "100x100",
+            "-framerate", fps,
+            "-i", "-",
+            "-crf", "40",
+            "-c:v", "libvpx-vp9",
+            *VP9_PROFILES[encoder_profile],
+            "-pix_fmt", "yuva420p",
+            "-metadata", "title=@itosbot",
+            tile_filename,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        ))
+
+    # one buffer is reused for every frame; keying and slicing work on views of it
+    num_cols = frame_width // 100
+    buffer = bytearray(frame_width * frame_height * 4)
+    frame = np.frombuffer(buffer, dtype=np.uint8).reshape(frame_height, frame_width, 4)
+    while True:
+        try:
+            buffer[:] = await decoder.stdout.readexactly(len(buffer))
+        except asyncio.IncompleteReadError:
+            break
+        if key_color is not None:
+            apply_color_key(frame, key_color, bg_similarity, bg_blend)
+        for index, encoder in enumerate(encoders):
+            row, col = divmod(index, num_cols)
+            encoder.stdin.write(frame[row * 100:(row + 1) * 100, col * 100:(col + 1) * 100].tobytes())
+        await asyncio.gather(*(encoder.stdin.drain() for encoder in encoders))
+
+    for encoder in encoders:
+        encoder.stdin.close()
+    await asyncio.gather(*(encoder.wait() for encoder in encoders))
+    await decoder.wait()
+
+
+class VideoBackend(Protocol):
+    """Probes a video and turns it into tile files; `convert_video` delegates to one of these."""
+
+    async def probe(self, filename: str) -> VideoInfo:
+        """Size, frame rate and duration of the video."""
+        ...
+
+    async def tile(self, workspace: Workspace, filename: str, target: VideoInfo, bg_color: str | None, bg_similarity: float, bg_blend: float, strip_metadata: bool, encoder_profile: str) -> List[str]:
+        """Normalizes the video to `target` and encodes its tiles.
+
+        `filename` is inside the workspace, and so are the tiles.
+
+        Returns:
+            List of tile filenames, row by row
+        """
+        ...
+
+
+class SubprocessBackend:
+    """Runs ffprobe and ffmpeg processes.
 
-        # Ensure we don't exceed 50 tiles (100x100 each)
-        max_tiles_width = math.ceil(custom_width / 100)
-        max_tiles_height = math.ceil(custom_height / 100)
-        total_tiles = max_tiles_width * max_tiles_height
+    Args:
+        engine: "filter" crops and keys each tile in its own ffmpeg filtergraph,
+            "frames" decodes once to raw frames and tiles them in NumPy
+    """
 
-        if total_tiles > 50:
-            # Adjust height to fit within 50 tiles
-            max_allowed_height = (50 // max_tiles_width) * 100
-            custom_height = min(custom_height, max_allowed_height)
+    def __init__(self, engine: str = "filter"):
+        self.engine = engine
 
-        # Ensure minimum dimensions and even numbers
-        custom_width = max(custom_width, 100)
-        custom_height = max(custom_height, 100)
-        custom_width, custom_height = await ensure_even_dimensions(custom_width, custom_height)
+    async def probe(self, filename: str) -> VideoInfo:
+        return await probe_video(filename)
 
-        # Apply the custom dimensions
-        new_filename = "video_custom.mp4"
-        await scale_video(tempdir, filename, new_filename, f"scale={custom_width}:{custom_height}")
-        filename = new_filename
-        width, height = await probe_video_dimensions(tempdir, filename)
+    async def tile(self, workspace: Workspace, filename: str, target: VideoInfo, bg_color: str | None, bg_similarity: float, bg_blend: float, strip_metadata: bool, encoder_profile: str) -> List[str]:
+        tempdir = workspace.path
+        filename = os.path.basename(filename)
+        if self.engine == "frames":
+            # the decoder normalizes on the fly, no intermediate file
+            return await crop_tiles_from_frames(tempdir, filename, target, bg_color, bg_similarity, bg_blend, strip_metadata, encoder_profile)
+        new_filename = "video_normalized.mkv"
+        await normalize_video(tempdir, filename, new_filename, target, workspace.remaining())
+        workspace.check_quota()
+        return await crop_tiles(tempdir, new_filename, target.width, target.height, bg_color, bg_similarity, bg_blend, strip_metadata, encoder_profile)
 
-    if width > 100 or height > 100:
-        # Scale if width exceeds 800
-        if width > 800:
-            scaled = height / (width / 800)
-            resized, _ = await ensure_even_dimensions(800, scaled)
-            new_filename = "video_1.mp4"
-            await scale_video(tempdir, filename, new_filename, f"scale={resized}:{_}")
-            filename = new_filename
-            width, height = await probe_video_dimensions(tempdir, filename)
-
-        # Scale if height exceeds 5000
-        if height > 5000:
-            scaled = width / (height / 5000)
-            resized, _ = await ensure_even_dimensions(scaled, 5000)
-            new_filename = "video_2.mp4"
-            await scale_video(tempdir, filename, new_filename, f"scale={resized}:{_}")
-            filename = new_filename
-            width, height = await probe_video_dimensions(tempdir, filename)
-
-        # Adjust video based on aspect ratio
-        aspect_ratio = width / height
-        if aspect_ratio > 1:
-            new_filename = "video_3.mp4"
-            max_height = 50 / math.ceil(width / 100)
-            target_height = min(int(max_height) * 100, height)
-            # Calculate width to maintain aspect ratio
-            target_width = int(width * (target_height / height))
-            target_width, target_height = await ensure_even_dimensions(target_width, target_height)
-            await scale_video(tempdir, filename, new_filename, f"scale={target_width}:{target_height}")
-            filename = new_filename
-        elif aspect_ratio == 1:
-            new_filename = "video_3.mp4"
-            max_size = 50 / math.ceil(width / 100)
-            target_size = min(int(max_size) * 100, width)
-            target_width, target_height = await ensure_even_dimensions(target_size, target_size)
-            await scale_video(tempdir, filename, new_filename, f"scale={target_width}:{target_height}")
-            filename = new_filename
-        else:
-            new_filename = "video_3.mp4"
-            max_width = 50 / math.ceil(height / 100)
-            target_width = min(int(max_width) * 100, width)
-            # Calculate height to maintain aspect ratio
-            target_height = int(height * (target_width / width))
-            target_width, target_height = await ensure_even_dimensions(target_width, target_height)
-            await scale_video(tempdir, filename, new_filename, f"scale={target_width}:{target_height}")
-            filename = new_filename
 
-        # Further scaling if the total number of tiles is small
-        width, height = await probe_video_dimensions(tempdir, filename)
-        if math.ceil(width / 100) * math.ceil(height / 100) <= 50:
-            new_filename = "video_4.webm"
-            target_width = math.ceil(width / 100) * 100
-            target_height = math.ceil(height / 100) * 100
-            target_width, target_height = await ensure_even_dimensions(target_width, target_height)
-            await scale_video(tempdir, filename, new_filename, f"scale={target_width}:{target_height}")
-            filename = new_filename
-            width, height = await probe_video_dimensions(tempdir, filename)
-
-    # Final check to ensure we don't exceed 50 cells
-    num_cells = math.ceil(width / 100) * math.ceil(height / 100)
-    if num_cells > 50:
-        # Calculate scaling factor to get under 50 cells
-        scale_factor = math.sqrt(50 / num_cells)
-        new_width = int(width * scale_factor)
-        new_height = int(height * scale_factor)
-        new_width, new_height = await ensure_even_dimensions(new_width, new_height)
-
-        new_filename = "video_final.webm"
-        await scale_video(tempdir, filename, new_filename, f"scale={new_width}:{new_height}")
-        filename = new_filename
-        width, height = await probe_video_dimensions(tempdir, filename)
-
-    tiles_width = math.ceil(width / 100)
-    tiles_height = math.ceil(height / 100)
-    tiles = await crop_tiles(tempdir, filename, width, height, bg_color, bg_similarity, bg_blend)
+async def convert_video(video: BinaryIO | str, custom_width: int = 0, custom_height: int = 0, bg_color: str | None = None, bg_similarity: float = 20, bg_blend: float = 0, engine: str = "filter", workspace: Workspace | None = None, strip_metadata: bool = False, encoder_profile: str = "default", max_fps: float = 30, max_duration: float = 5, source: VideoInfo | None = None, backend: VideoBackend | None = None, start: float = 0, length: float | None = None) -> tuple[List[str], int, int]:
+    """Converts an input video into a set of cropped tile video files.
+    
+    Args:
+        video: Input video file as BinaryIO, or the path of a file already in the workspace
+        custom_width: Custom width in pixels (0 = auto)
+        custom_height: Custom height in pixels (0 = auto)
+        bg_color: Background color to remove as hex or name (e.g., "#FFFFFF", "white")
+        bg_similarity: Color similarity threshold (0-100, default 20)
+        bg_blend: Blend amount for edge smoothing (0-100, default 0)
+        engine: Engine of the default `SubprocessBackend`, "filter" or "frames"
+        workspace: Workspace for intermediate and tile files; its quota is checked
+            between stages (default: a new temp directory the caller has to remove)
+        strip_metadata: Remove the title and tags from the tiles to save bytes
+        encoder_profile: VP9 speed profile, one of VP9_PROFILES
+        max_fps: Frame rate cap; faster videos are resampled
+        max_duration: Longer videos are trimmed to this many seconds
+        source: Metadata of the input if the caller already has it, e.g. from a header probe;
+            the input is only probed if this is missing or its frame rate is unknown (0)
+        backend: How the video is probed and encoded (default: ffmpeg processes, see `SubprocessBackend`)
+        start: Where the converted window starts, in seconds; decoding seeks there
+        length: Length of the window in seconds (default and cap: max_duration)
+    
+    Returns:
+        Tuple of (tiles, tiles_width, tiles_height)
+    """
+    if workspace is None:
+        workspace = Workspace(tempfile.mkdtemp())
+    tempdir = workspace.path
+    completed = False
+    if isinstance(video, str):
+        filename = os.path.relpath(video, tempdir)
+    else:
+        filename = "video.mp4"
+        with open(f"{tempdir}/{filename}", "wb") as f:
+            f.write(video.read())
+    workspace.check_quota()
+
+    if backend is None:
+        backend = SubprocessBackend(engine)
+    if source is None or not source.fps:
+        source = await backend.probe(f"{tempdir}/{filename}")
+    target = plan_normalization(source, custom_width, custom_height, max_fps, max_duration, start, length)
+    tiles_width = math.ceil(target.width / 100)
+    tiles_height = math.ceil(target.height / 100)
+
+    tiles = await backend.tile(workspace, f"{tempdir}/{filename}", target, bg_color, bg_similarity, bg_blend, strip_metadata, encoder_profile)
+    workspace.check_quota()
     completed = True
     return tiles, tiles_width, tiles_height
@@ -0,0 +1,236 @@
+"""Post-processing of WebM tiles on the EBML level, without remuxing."""
+
+import os
+from typing import Iterator, NamedTuple
+
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+DURATION = 0x4489
+TITLE = 0x7BA9
+TAGS = 0x1254C367
+CLUSTER = 0x1F43B675
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TRACK_POSITIONS = 0xB7
+CUE_CLUSTER_POSITION = 0xF1
+VOID = 0xEC
+
+# Written over the Duration element's size and value; this is what makes Telegram
+# accept tiles regardless of their real length.
+DURATION_PATCH = b"\x00\x40\xbf\x48\x00\x00"
+
+# Info comes right after the SeekHead and a Void, so it is within the first few hundred bytes.
+HEADER_CHUNK = 4096
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class Element(NamedTuple):
+    id: int
+    start: int  # offset of the element ID
+    size_start: int  # offset of the element size
+    data_start: int  # offset of the element data
+    end: int  # offset right after the element data
+    unknown_size: bool = False
+
+
+class TruncatedError(ValueError):
+    """Raised when an element runs past the end of the available data."""
+
+
+def _vint_length(first_byte: int) -> int:
+    if first_byte == 0:
+        raise ValueError("Invalid EBML variable size integer")
+    return 9 - first_byte.bit_length()
+
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool = False) -> tuple[int, int]:
+    """Returns (value, length) of the variable size integer at pos."""
+    if pos >= len(data):
+        raise TruncatedError("EBML data ends inside an element header")
+    length = _vint_length(data[pos])
+    if pos + length > len(data):
+        raise TruncatedError("EBML data ends inside an element header")
+    value = data[pos] if keep_marker else data[pos] & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    return value, length
+
+
+def _read_element(data: bytes, pos: int, parent_end: int) -> Element:
+    element_id, id_length = _read_vint(data, pos, keep_marker=True)
+    size, size_length = _read_vint(data, pos + id_length)
+    data_start = pos + id_length + size_length
+    if size == (1 << (7 * size_length)) - 1:  # unknown size, runs to the end of the parent
+        return Element(element_id, pos, pos + id_length, data_start, parent_end, True)
+    return Element(element_id, pos, pos + id_length, data_start, data_start + size)
+
+
+def iter_elements(data: bytes, start: int, end: int) -> Iterator[Element]:
+    """Iterates over the elements between start and end, without descending into them."""
+    pos = start
+    while pos < end:
+        element = _read_element(data, pos, end)
+        yield element
+        pos = element.end
+
+
+def _find_child(data: bytes, parent: Element, element_id: int) -> Element | None:
+    for element in iter_elements(data, parent.data_start, min(parent.end, len(data))):
+        if element.id == element_id:
+            return element
+    return None
+
+
+def _find_segment(data: bytes) -> Element:
+    for element in iter_elements(data, 0, len(data)):
+        if element.id == SEGMENT:
+            return element
+    raise ValueError("No Segment element found")
+
+
+def _find_info(data: bytes) -> Element:
+    """Finds Segment/Info; raises TruncatedError if data doesn't reach its end yet."""
+    segment = _find_segment(data)
+    for element in iter_elements(data, segment.data_start, segment.end):
+        if element.id == INFO:
+            if element.end > len(data):
+                raise TruncatedError("Info element is not complete")
+            return element
+        if element.id == CLUSTER:
+            break
+    raise ValueError("No Info element found before the first Cluster")
+
+
+def _duration_offset(data: bytes) -> int | None:
+    duration = _find_child(data, _find_info(data), DURATION)
+    return None if duration is None else duration.size_start
+
+
+def patch_duration(filename: str) -> bool:
+    """Patches the Segment/Info/Duration element in place, reading only the file header.
+
+    Returns:
+        True if the element was found and patched
+    """
+    with open(filename, "r+b") as f:
+        data = b""
+        while True:
+            chunk = f.read(HEADER_CHUNK)
+            data += chunk
+            try:
+                offset = _duration_offset(data)
+                break
+            except TruncatedError:
+                if not chunk or len(data) >= MAX_HEADER_SIZE:
+                    return False
+            except ValueError:
+                return False
+        if offset is None:
+            return False
+        os.pwrite(f.fileno(), DURATION_PATCH, offset)
+        return True
+
+
+def _write_uint(data: bytearray, element: Element, value: int) -> None:
+    """Overwrites an unsigned integer element keeping its size."""
+    data[element.data_start:element.end] = value.to_bytes(element.end - element.data_start, "big")
+
+
+def _write_size(data: bytearray, element: Element, size: int) -> None:
+    """Overwrites the size field of an element keeping its length."""
+    length = element.data_start - element.size_start
+    data[element.size_start:element.data_start] = ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def _make_void(data: bytearray, element: Element) -> None:
+    """Turns an element with a 2+ byte ID into a Void of the same total length."""
+    # the size field takes the bytes freed by the 1-byte ID, up to the longest EBML size
+    length = min(element.data_start - element.start - 1, 8)
+    size = element.end - element.start - 1 - length
+    data[element.start] = VOID
+    data[element.start + 1:element.start + 1 + length] = ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def strip_metadata(data: bytes) -> bytes:
+    """Removes Segment/Info/Title and Segment/Tags (title, encoder and duration tags).
+
+    Segment size, SeekHead and Cues positions are adjusted to the removed bytes.
+    """
+    segment = _find_segment(data)
+    info = _find_info(data)
+    title = _find_child(data, info, TITLE)
+    removed = [title] if title else []
+    removed += [
+        element for element in iter_elements(data, segment.data_start, min(segment.end, len(data)))
+        if element.id == TAGS
+    ]
+    if not removed:
+        return data
+
+    def shift(position: int) -> int:
+        """Maps an offset relative to the segment data to the stripped file."""
+        absolute = segment.data_start + position
+        return position - sum(e.end - e.start for e in removed if e.end <= absolute)
+
+    output = bytearray(data)
+    for element in iter_elements(data, segment.data_start, min(segment.end, len(data))):
+        if element.id == SEEK_HEAD:
+            for seek in iter_elements(data, element.data_start, element.end):
+                if seek.id != SEEK:
+                    continue
+                seek_id = _find_child(data, seek, SEEK_ID)
+                position = _find_child(data, seek, SEEK_POSITION)
+                if seek_id is None or position is None:
+                    continue
+                if data[seek_id.data_start:seek_id.end] == TAGS.to_bytes(4, "big"):
+                    # keep the SeekHead size by turning the entry into a Void of the same length
+                    _make_void(output, seek)
+                else:
+                    value = int.from_bytes(data[position.data_start:position.end], "big")
+                    _write_uint(output, position, shift(value))
+        elif element.id == CUES:
+            for cue_point in iter_elements(data, element.data_start, element.end):
+                if cue_point.id != CUE_POINT:
+                    continue
+                for positions in iter_elements(data, cue_point.data_start, cue_point.end):
+                    if positions.id != CUE_TRACK_POSITIONS:
+                        continue
+                    cluster = _find_child(data, positions, CUE_CLUSTER_POSITION)
+                    if cluster is not None:
+                        value = int.from_bytes(data[cluster.data_start:cluster.end], "big")
+                        _write_uint(output, cluster, shift(value))
+    if title:
+        _write_size(output, info, info.end - info.data_start - (title.end - title.start))
+    if not segment.unknown_size:
+        _write_size(output, segment, segment.end - segment.data_start - sum(e.end - e.start for e in removed))
+
+    for element in sorted(removed, key=lambda e: e.start, reverse=True):
+        del output[element.start:element.end]
+    return bytes(output)
+
+
+def postprocess(filename: str, strip: bool = False) -> None:
+    """Patches the duration of a WebM tile, optionally stripping its metadata first.
+
+    Without `strip` only the header is read and the file is patched in place;
+    stripping has to rewrite the file once.
+    """
+    if not strip:
+        patch_duration(filename)
+        return
+    with open(filename, "rb") as f:
+        data = f.read()
+    try:
+        data = bytearray(strip_metadata(data))
+    except ValueError:
+        patch_duration(filename)
+        return
+    offset = _duration_offset(data)
+    if offset is not None:
+        data[offset:offset + len(DURATION_PATCH)] = DURATION_PATCH
+    with open(filename, "wb") as f:
+        f.write(data)
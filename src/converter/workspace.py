@@ -0,0 +1,145 @@
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Iterator
+
+from src.converter.exceptions import WorkspaceQuotaError
+
+PREFIX = "itosjob_"
+
+
+class Workspace:
+    """Temporary directory holding the intermediate files of one conversion job."""
+
+    def __init__(self, path: str, manager: "WorkspaceManager | None" = None):
+        self.path = path
+        self.manager = manager
+
+    def file(self, name: str) -> str:
+        """Returns the path of a file inside the workspace."""
+        return os.path.join(self.path, name)
+
+    def usage(self) -> int:
+        """Returns the number of bytes currently stored in the workspace."""
+        total = 0
+        with contextlib.suppress(FileNotFoundError):
+            for entry in os.scandir(self.path):
+                with contextlib.suppress(FileNotFoundError):
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        return total
+
+    def check_quota(self) -> None:
+        """Raises WorkspaceQuotaError if the job or all jobs together use too much space."""
+        if self.manager is not None:
+            self.manager.check_quota(self)
+
+    def remaining(self) -> int | None:
+        """Bytes the job can still write before exceeding a quota, None if there is no quota."""
+        if self.manager is None:
+            return None
+        return self.manager.remaining(self)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # a process of another user
+    return True
+
+
+class WorkspaceManager:
+    """Creates job workspaces under one root, enforces byte quotas and guarantees removal.
+
+    The root should be dedicated to the bot and ideally RAM-backed (tmpfs). Workspace
+    names carry the PID of the process that created them, so `sweep` leaves those of
+    another running instance alone.
+    """
+
+    def __init__(self, root: str | None = None, job_quota: int = 0, total_quota: int = 0):
+        """
+        Args:
+            root: Directory for job workspaces (default: a directory of the bot in the system temp dir)
+            job_quota: Max bytes per job (0 = unlimited)
+            total_quota: Max bytes for all active jobs together (0 = unlimited)
+        """
+        self.root = root or os.path.join(tempfile.gettempdir(), "itosbot")
+        self.job_quota = job_quota
+        self.total_quota = total_quota
+        self._active: set[Workspace] = set()
+        self._started = time.time()
+
+    @contextlib.contextmanager
+    def job(self) -> Iterator[Workspace]:
+        """Creates a workspace that is removed with all its files when the block exits."""
+        os.makedirs(self.root, exist_ok=True)
+        workspace = Workspace(tempfile.mkdtemp(prefix=f"{PREFIX}{os.getpid()}_", dir=self.root), self)
+        self._active.add(workspace)
+        try:
+            yield workspace
+        finally:
+            self._active.discard(workspace)
+            workspace.remove()
+
+    def usage(self) -> int:
+        """Returns the number of bytes used by all active workspaces."""
+        return sum(workspace.usage() for workspace in self._active)
+
+    def remaining(self, workspace: Workspace) -> int | None:
+        limits = []
+        if self.job_quota:
+            limits.append(self.job_quota - workspace.usage())
+        if self.total_quota:
+            limits.append(self.total_quota - self.usage())
+        return max(0, min(limits)) if limits else None
+
+    def check_quota(self, workspace: Workspace) -> None:
+        if self.job_quota:
+            used = workspace.usage()
+            if used > self.job_quota:
+                raise WorkspaceQuotaError(
+                    f"Job uses {used / 2**20:.1f}MB of temporary space (max {self.job_quota / 2**20:.0f}MB)"
+                )
+        if self.total_quota:
+            used = self.usage()
+            if used > self.total_quota:
+                raise WorkspaceQuotaError("The bot is out of temporary space right now, please try again later")
+
+    def sweep(self) -> int:
+        """Removes workspaces left behind by a previous process. Call it before any job starts.
+
+        Workspaces of a process that is still running, or changed since this one started,
+        are kept.
+
+        Returns:
+            Number of removed workspaces
+        """
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        active = {workspace.path for workspace in self._active}
+        for entry in os.scandir(self.root):
+            if not entry.name.startswith(PREFIX) or not entry.is_dir(follow_symlinks=False) or entry.path in active:
+                continue
+            pid = entry.name[len(PREFIX):].split("_", 1)[0]
+            if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                continue  # another instance, e.g. during a rolling deploy
+            with contextlib.suppress(FileNotFoundError):
+                # created since this process started: an instance whose PIDs we can't see
+                # (file times come from a coarser clock, hence the margin)
+                if entry.stat(follow_symlinks=False).st_mtime >= self._started - 1:
+                    continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+        if removed:
+            logging.info("Removed %s orphaned workspaces from %s", removed, self.root)
+        return removed
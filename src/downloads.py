@@ -0,0 +1,109 @@
+"""Reading Telegram files: header reads for planning before a full download, and parallel
+ranged downloads into a job workspace."""
+
+import asyncio
+import contextlib
+import os
+import re
+import shutil
+import time
+
+import aiohttp
+from aiogram import Bot
+from aiogram.types import File
+
+from src.metrics import metrics
+from src.settings import settings
+
+# enough for image headers and the metadata of MP4 (faststart), WebM and GIF files
+HEAD_SIZE = 256 * 1024
+# a stalled connection fails, a slow one doesn't
+CHUNK_TIMEOUT = aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+async def read_head(bot: Bot, file: File, size: int = HEAD_SIZE) -> bytes:
+    """Return the first `size` bytes of a file without downloading the rest."""
+    if bot.session.api.is_local:
+        with open(bot.session.api.wrap_local_file.to_local(file.file_path), "rb") as f:
+            return f.read(size)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    chunks = []
+    received = 0
+    stream = bot.session.stream_content(url, headers={"Range": f"bytes=0-{size - 1}"})
+    # servers that ignore the Range header send the whole file; stop reading early then
+    async with contextlib.aclosing(stream):
+        async for chunk in stream:
+            chunks.append(chunk)
+            received += len(chunk)
+            if received >= size:
+                break
+    return b"".join(chunks)[:size]
+
+
+async def _write_stream(response: aiohttp.ClientResponse, fd: int, offset: int) -> int:
+    """Writes a response body to `fd` at `offset`; returns the number of bytes written."""
+    written = 0
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        os.pwrite(fd, chunk, offset + written)
+        written += len(chunk)
+    return written
+
+
+async def _fetch_range(session: aiohttp.ClientSession, url: str, fd: int, start: int, end: int) -> None:
+    begin = time.monotonic()
+    async with session.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=CHUNK_TIMEOUT, raise_for_status=True) as response:
+        if response.status != 206:
+            raise aiohttp.ClientPayloadError(f"Expected a partial response for bytes {start}-{end}, got {response.status}")
+        written = await _write_stream(response, fd, start)
+    if written != end - start + 1:
+        raise aiohttp.ClientPayloadError(f"Got {written} bytes for bytes {start}-{end}")
+    metrics.observe("download.chunk.seconds", time.monotonic() - begin)
+
+
+async def download(bot: Bot, file: File, destination: str) -> None:
+    """Download a file to `destination` in parallel Range requests over the bot's session.
+
+    The first chunk tells whether the server supports ranges and how large the file is;
+    the rest are fetched DOWNLOAD_CONCURRENCY at a time and written at their offsets.
+    Servers that ignore ranges get a single stream.
+    """
+    if bot.session.api.is_local:
+        await asyncio.to_thread(shutil.copyfile, bot.session.api.wrap_local_file.to_local(file.file_path), destination)
+        return
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    session = await bot.session.create_session()
+    chunk_size = settings.DOWNLOAD_CHUNK_SIZE
+    begin = time.monotonic()
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        async with session.get(url, headers={"Range": f"bytes=0-{chunk_size - 1}"}, timeout=CHUNK_TIMEOUT, raise_for_status=True) as response:
+            match = _CONTENT_RANGE.fullmatch(response.headers.get("Content-Range", ""))
+            if response.status != 206 or match is None or match[1] != "0" or match[3] == "*":
+                # no range support, the whole file is in this response
+                metrics.incr("download.single")
+                await _write_stream(response, fd, 0)
+                metrics.observe("download.seconds", time.monotonic() - begin)
+                return
+            size = int(match[3])
+            written = await _write_stream(response, fd, 0)
+        metrics.observe("download.chunk.seconds", time.monotonic() - begin)
+        metrics.incr("download.ranged")
+
+        semaphore = asyncio.Semaphore(settings.DOWNLOAD_CONCURRENCY)
+
+        async def fetch(start: int) -> None:
+            async with semaphore:
+                await _fetch_range(session, url, fd, start, min(start + chunk_size, size) - 1)
+
+        tasks = [asyncio.create_task(fetch(start)) for start in range(written, size, chunk_size)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        os.close(fd)
+    metrics.observe("download.seconds", time.monotonic() - begin)
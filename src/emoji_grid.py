@@ -0,0 +1,144 @@
+"""Deduplication of encoded tiles and rendering of the resulting custom emoji grid."""
+
+import asyncio
+import hashlib
+import io
+import logging
+from typing import NamedTuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputSticker
+
+from src.settings import settings
+
+# a message shows at most this many custom emoji
+MAX_EMOJI_PER_MESSAGE = 100
+MAX_MESSAGE_LENGTH = 4096
+
+_blank_emoji_id: str | None = None
+_blank_emoji_lock = asyncio.Lock()
+
+
+class Grid(NamedTuple):
+    """A converted image or video, ready for upload."""
+    stickers: list[InputSticker]  # distinct tiles
+    layout: list[int | None]  # see dedupe_tiles
+    tiles_width: int
+    blank_emoji_id: str | None = None
+
+
+def dedupe_tiles(tiles: list[bytes], blank: list[bool] | None = None) -> tuple[list[int], list[int | None]]:
+    """Find the distinct tiles of a grid.
+
+    Args:
+        tiles: Encoded tile files, row by row
+        blank: Flags for fully transparent tiles; these are left out of the upload
+
+    Returns:
+        Tuple of (indexes of the tiles to upload, layout), where the layout maps every
+        grid cell to a position in the upload list, or to None for a blank cell
+    """
+    unique: list[int] = []
+    positions: dict[bytes, int] = {}
+    layout: list[int | None] = []
+    for index, data in enumerate(tiles):
+        if blank and blank[index]:
+            layout.append(None)
+            continue
+        digest = hashlib.sha256(data).digest()
+        if digest not in positions:
+            positions[digest] = len(unique)
+            unique.append(index)
+        layout.append(positions[digest])
+    return unique, layout
+
+
+def render_grid(layout: list[int | None], custom_emoji_ids: list[str], tiles_width: int, blank_emoji_id: str | None = None) -> str:
+    """Build the HTML message that shows the emoji grid."""
+    msg_parts = []
+    for index, position in enumerate(layout):
+        emoji_id = blank_emoji_id if position is None else custom_emoji_ids[position]
+        msg_parts.append(f"<tg-emoji emoji-id=\"{emoji_id}\">🤯</tg-emoji>")
+        if (index + 1) % tiles_width == 0:
+            msg_parts.append("\n")
+    return "".join(msg_parts).strip()
+
+
+def render_grids(grids: list[Grid], custom_emoji_ids: list[str]) -> list[str]:
+    """Render several grids whose stickers were uploaded one after another into one set.
+
+    Grids are packed into as few messages as the message length and custom emoji limits allow.
+    """
+    messages: list[str] = []
+    current, current_emoji = "", 0
+    offset = 0
+    for grid in grids:
+        text = render_grid(grid.layout, custom_emoji_ids[offset:offset + len(grid.stickers)], grid.tiles_width, grid.blank_emoji_id)
+        offset += len(grid.stickers)
+        if current and (
+            len(current) + 2 + len(text) > MAX_MESSAGE_LENGTH
+            or current_emoji + len(grid.layout) > MAX_EMOJI_PER_MESSAGE
+        ):
+            messages.append(current)
+            current, current_emoji = "", 0
+        current = f"{current}\n\n{text}" if current else text
+        current_emoji += len(grid.layout)
+    if current:
+        messages.append(current)
+    return messages
+
+
+def _blank_sticker() -> InputSticker:
+    import PIL.Image  # Pillow loads with the converter, not at startup
+    sticker = io.BytesIO()
+    PIL.Image.new("RGBA", (100, 100), (0, 0, 0, 0)).save(sticker, format="PNG")
+    return InputSticker(
+        sticker=BufferedInputFile(file=sticker.getvalue(), filename="sticker.png"),
+        emoji_list=["😶"],
+        format="static",
+    )
+
+
+async def get_blank_emoji_id(bot: Bot) -> str | None:
+    """Return the id of the bot's transparent custom emoji, creating its set on first use.
+
+    The set belongs to the owner (settings.OWNER_ID), so no user can delete it.
+    Returns None if the emoji is not available, so callers can upload blank tiles as usual.
+    """
+    global _blank_emoji_id
+    if _blank_emoji_id is not None:
+        return _blank_emoji_id
+    async with _blank_emoji_lock:
+        if _blank_emoji_id is not None:
+            return _blank_emoji_id
+        name = f"blank_{settings.OWNER_ID}_by_{(await bot.me()).username}"
+        try:
+            try:
+                sticker_set = await bot.get_sticker_set(name=name)
+            except TelegramBadRequest:
+                await bot.create_new_sticker_set(
+                    user_id=settings.OWNER_ID,
+                    name=name,
+                    title="Blank",
+                    stickers=[_blank_sticker()],
+                    sticker_format="static",
+                    sticker_type="custom_emoji",
+                )
+                sticker_set = await bot.get_sticker_set(name=name)
+            if not sticker_set.stickers:
+                await bot.add_sticker_to_set(user_id=settings.OWNER_ID, name=name, sticker=_blank_sticker())
+                sticker_set = await bot.get_sticker_set(name=name)
+        except Exception as e:
+            logging.warning("Can't create blank emoji set %s: %s", name, e)
+            return None
+        _blank_emoji_id = sticker_set.stickers[0].custom_emoji_id
+        return _blank_emoji_id
+
+
+def forget_blank_emoji_id(emoji_id: str) -> None:
+    """Drop the cached blank emoji after a message using it was rejected; the next
+    `get_blank_emoji_id` checks the set again and recreates it if it's gone."""
+    global _blank_emoji_id
+    if _blank_emoji_id == emoji_id:
+        _blank_emoji_id = None
@@ -0,0 +1,186 @@
+"""Coalesces error reports to the owner into periodic digests.
+
+Errors are grouped by exception type and location and sent as one digest per interval,
+so an incident doesn't spend the rate limit that real work needs. The digest describes a
+few sample messages of each group (chat and user ids, text, file id) and the first sample
+of each group is forwarded after it. Each user gets at most one error reply per window.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import traceback
+from typing import NamedTuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Message
+
+from src.settings import settings
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ErrorKey(NamedTuple):
+    type: str
+    location: str
+
+
+class Sample(NamedTuple):
+    chat_id: int
+    message_id: int
+    description: str
+
+
+class ErrorGroup:
+    def __init__(self) -> None:
+        self.count = 0
+        self.last_error = ""
+        self.samples: list[Sample] = []
+
+
+def _location(exc: BaseException) -> str:
+    """Innermost frame of the traceback that belongs to the bot, e.g. `src/handlers/images.py:150 in image_converter`."""
+    frames = traceback.extract_tb(exc.__traceback__)
+    ours = [frame for frame in frames if frame.filename.startswith(_PROJECT_ROOT)]
+    if not ours:
+        return "unknown"
+    frame = ours[-1]
+    return f"{os.path.relpath(frame.filename, _PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+
+
+def describe_message(message: Message) -> str:
+    """What the owner needs to find or reproduce a message: ids, text and the file id of its media."""
+    parts = [f"chat {message.chat.id}"]
+    if message.from_user:
+        parts.append(f"user {message.from_user.id}")
+    parts.append(f"message {message.message_id}")
+    if message.chat.username:
+        parts.append(f"https://t.me/{message.chat.username}/{message.message_id}")
+    media = (
+        message.photo[-1] if message.photo
+        else message.document or message.video or message.animation or message.sticker or message.video_note
+    )
+    if media is not None:
+        parts.append(f"file_id {media.file_id}")
+    text = message.text or message.caption
+    if text:
+        parts.append(repr(text[:100]))
+    return ", ".join(parts)
+
+
+class ErrorReporter:
+    def __init__(self, owner_id: int, interval: float = 60, reply_window: float = 300, samples: int = 3):
+        """
+        :param owner_id: chat that receives the digests
+        :param interval: seconds between digests
+        :param reply_window: seconds during which a user gets at most one error reply
+        :param samples: message descriptions kept per error group; the first one is forwarded
+        """
+        self.owner_id = owner_id
+        self.interval = interval
+        self.reply_window = reply_window
+        self.samples = samples
+        self._groups: dict[ErrorKey, ErrorGroup] = {}
+        self._replied: dict[int, float] = {}
+        self._task: asyncio.Task | None = None
+        # monotonic time until which the owner chat is flood limited
+        self._retry_at = 0.0
+
+    def report(self, exc: BaseException, message: Message | None = None, context: str = "") -> None:
+        """Records an error for the next digest; never makes API calls."""
+        key = ErrorKey(type(exc).__name__, _location(exc))
+        group = self._groups.setdefault(key, ErrorGroup())
+        group.count += 1
+        group.last_error = f"{context}: {exc}" if context else str(exc)
+        if message is not None and len(group.samples) < self.samples:
+            group.samples.append(Sample(message.chat.id, message.message_id, describe_message(message)))
+
+    def should_reply(self, user_id: int) -> bool:
+        """Returns True at most once per `reply_window` for a user."""
+        now = time.monotonic()
+        last = self._replied.get(user_id)
+        if last is not None and now - last < self.reply_window:
+            return False
+        self._replied[user_id] = now
+        if len(self._replied) > 10_000:
+            self._replied = {k: v for k, v in self._replied.items() if now - v < self.reply_window}
+        return True
+
+    def format_digest(self, groups: dict[ErrorKey, ErrorGroup]) -> str:
+        lines = [f"Errors in the last {self.interval:.0f}s:"]
+        for key, group in sorted(groups.items(), key=lambda item: -item[1].count):
+            lines.append("")
+            lines.append(f"{group.count}× {key.type} at {key.location}")
+            lines.append(f"  {group.last_error[:300]}")
+            lines.extend(f"  {sample.description}" for sample in group.samples)
+        text = "\n".join(lines)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH - 1] + "…"
+        return text
+
+    def _keep(self, groups: dict[ErrorKey, ErrorGroup]) -> None:
+        """Puts groups that couldn't be sent back for the next digest."""
+        for key, group in groups.items():
+            current = self._groups.setdefault(key, ErrorGroup())
+            current.count += group.count
+            current.last_error = current.last_error or group.last_error
+            current.samples = (group.samples + current.samples)[:self.samples]
+
+    async def flush(self, bot: Bot) -> None:
+        """Sends one digest of everything reported since the last one, then a forward of the first sample of each group.
+
+        While the owner chat is flood limited the errors are kept for a later digest.
+        """
+        if not self._groups or time.monotonic() < self._retry_at:
+            return
+        groups, self._groups = self._groups, {}
+        try:
+            await bot.send_message(chat_id=self.owner_id, text=self.format_digest(groups))
+        except TelegramRetryAfter as e:
+            self._keep(groups)
+            self._retry_at = time.monotonic() + e.retry_after
+            return
+        except Exception as e:
+            logging.exception("Can't send error digest: %s", e)
+            return
+        for group in groups.values():
+            if not group.samples:
+                continue
+            try:
+                await bot.forward_message(
+                    chat_id=self.owner_id,
+                    from_chat_id=group.samples[0].chat_id,
+                    message_id=group.samples[0].message_id,
+                )
+            except TelegramRetryAfter as e:
+                # the digest already describes the samples
+                self._retry_at = time.monotonic() + e.retry_after
+                return
+            except Exception as e:
+                logging.warning("Can't forward error sample: %s", e)
+
+    async def _run(self, bot: Bot) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush(bot)
+
+    async def start(self, bot: Bot) -> None:
+        """Dispatcher startup hook: starts sending digests."""
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self, bot: Bot) -> None:
+        """Dispatcher shutdown hook: stops the digest task and sends what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush(bot)
+
+
+reporter = ErrorReporter(
+    settings.OWNER_ID,
+    interval=settings.ERROR_DIGEST_INTERVAL,
+    reply_window=settings.ERROR_REPLY_WINDOW,
+)
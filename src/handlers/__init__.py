@@ -1,3 +1,6 @@
+import asyncio
+import logging
+
 import aiogram
 
 
@@ -7,11 +10,29 @@ def setup_routers():
     from src.handlers.images import router as images_router
     from src.handlers.videos import router as videos_router
     from src.handlers.errors import router as errors_router
+    from src.handlers.owner import router as owner_router
 
     router = aiogram.Router()
     router.include_router(errors_router)
     router.include_router(start_router)
+    router.include_router(owner_router)
     router.include_router(emoji_converter_router)
     router.include_router(images_router)
     router.include_router(videos_router)
     return router
+
+
+async def resume_jobs(bot: aiogram.Bot, dispatcher: aiogram.Dispatcher) -> None:
+    """Finishes the conversions a previous process was interrupted in.
+
+    The messages of every job are fed through the dispatcher again with the job, so the
+    flood limits and error handling of new updates apply; album items regroup as usual.
+    """
+    from src.journal import journal
+
+    for job in journal.pending(bot):
+        logging.info("Resuming job %s of user %s after %s", job.path, job.messages[0].from_user.id, job.stage)
+        await asyncio.gather(*(
+            dispatcher.feed_update(bot, aiogram.types.Update(update_id=0, message=message), job=job)
+            for message in job.messages
+        ))
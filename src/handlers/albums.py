@@ -0,0 +1,173 @@
+"""Media groups (albums): every item is converted and the grids go into as few sticker sets as possible."""
+
+import asyncio
+import html
+import logging
+import time
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+import src.utils as utils
+from src import emoji_grid
+from src.converter import ConversionError
+from src.error_reporter import reporter
+from src.journal import Checkpoints, Job, journal
+from src.settings import settings
+from src.sticker_rate_limit import format_retry_message, save_retry_after
+
+# createNewStickerSet takes at most 50 stickers; larger albums are split into several sets
+MAX_STICKERS_PER_CREATE = 50
+
+# converts an album item, given the album caption and the item's journal checkpoints
+GridBuilder = Callable[[str | None, Checkpoints], Awaitable[emoji_grid.Grid]]
+
+
+class _Group:
+    def __init__(self) -> None:
+        self.items: list[tuple[Message, GridBuilder]] = []
+        self.last_item = time.monotonic()
+        self.job: Job | None = None
+
+
+_groups: dict[tuple[int, str], _Group] = {}
+
+
+async def collect(message: Message, build: GridBuilder, job: Job | None = None) -> None:
+    """Adds an album item; the handler of the first item waits for the rest and publishes the set.
+
+    Items arriving within MEDIA_GROUP_WINDOW of the previous one belong to the same album.
+    The album is journaled as one job once it is complete.
+
+    :param build: converts the item
+    :param job: the journaled album when resuming it; every item is fed again with it
+    """
+    key = (message.chat.id, message.media_group_id)
+    group = _groups.get(key)
+    if group is not None:
+        group.items.append((message, build))
+        group.last_item = time.monotonic()
+        return
+    group = _groups[key] = _Group()
+    group.items.append((message, build))
+    try:
+        await message.bot.send_chat_action(message.chat.id, "upload_photo")
+        while (left := group.last_item + settings.MEDIA_GROUP_WINDOW - time.monotonic()) > 0:
+            await asyncio.sleep(left)
+    finally:
+        del _groups[key]
+    items = sorted(group.items, key=lambda item: item[0].message_id)
+    with job or journal.start([message for message, _ in items]) as job:
+        await _publish(items, job)
+
+
+async def _build(build: GridBuilder, caption: str | None, checkpoints: Checkpoints) -> emoji_grid.Grid:
+    # a resumed album fails the same items again, so its grids are packed into the same sets
+    error = checkpoints.load_json("error")
+    if error is not None:
+        raise ConversionError(error)
+    grid = checkpoints.load_grid()
+    if grid is None:
+        try:
+            grid = await build(caption, checkpoints)
+        except ConversionError as e:
+            checkpoints.save_json("error", str(e))
+            raise
+        checkpoints.save_grid(grid)
+    return grid
+
+
+async def _publish(items: list[tuple[Message, GridBuilder]], job: Job) -> None:
+    first = items[0][0]
+    caption = next((message.caption for message, _ in items if message.caption), None)
+    # the album caption applies to every item; conversions share the worker pool
+    results = await asyncio.gather(
+        *(_build(build, caption, job.item(f"item{message.message_id}")) for message, build in items),
+        return_exceptions=True,
+    )
+
+    grids: list[emoji_grid.Grid] = []
+    notes: list[str] = []
+    for index, result in enumerate(results, start=1):
+        if isinstance(result, ConversionError):
+            notes.append(f"Item {index}: {result}")
+        elif isinstance(result, BaseException):
+            logging.exception(result, exc_info=result)
+            reporter.report(result, items[index - 1][0], "album item")
+            notes.append(f"Item {index}: some unexpected error occurred")
+        else:
+            grids.append(result)
+    if not grids:
+        await first.answer("\n".join(notes))
+        return
+
+    bot_username = (await first.bot.me()).username
+    title = "Created by @" + bot_username
+    title_map = utils.parse_convert_args(caption).get("name", None) # name for our pack
+    if title_map:
+        title = title_map[:50] + " w/ @" + bot_username
+    # whole grids are packed into sets of at most MAX_STICKERS_PER_CREATE stickers, one call each
+    chunks: list[list[emoji_grid.Grid]] = []
+    for grid in grids:
+        if chunks and sum(len(g.stickers) for g in chunks[-1]) + len(grid.stickers) <= MAX_STICKERS_PER_CREATE:
+            chunks[-1].append(grid)
+        else:
+            chunks.append([grid])
+    # names of the sets created so far, in chunk order; a resumed album skips them
+    names: list[str] = job.load_json("published") or []
+    published = list(zip(names, chunks))
+    for chunk in chunks[len(published):]:
+        name = f"album_{first.from_user.id}_{utils.random_string()}_by_{bot_username}"
+        try:
+            await first.bot.create_new_sticker_set(
+                user_id=first.from_user.id,
+                name=name,
+                title=title,
+                stickers=[sticker for grid in chunk for sticker in grid.stickers],
+                sticker_type="custom_emoji",
+            )
+        except TelegramRetryAfter as e:
+            retry_until = save_retry_after(first.from_user.id, e.retry_after)
+            logging.info(
+                "Sticker creation rate limited for user %s until %s.",
+                first.from_user.id,
+                retry_until.isoformat(),
+            )
+            if not published:
+                await first.answer(format_retry_message(retry_until))
+                return
+            notes.append(format_retry_message(retry_until))
+            break
+        except Exception as e:
+            logging.exception(e)
+            if not published:
+                await first.answer("Failed to create sticker set. Please try again later.")
+                return
+            notes.append("Some items couldn't be published. Please try again later.")
+            break
+        published.append((name, chunk))
+        names.append(name)
+        job.save_json("published", names)
+
+    try:
+        custom_emoji_ids = []
+        for name, _ in published:
+            sticker_set = await first.bot.get_sticker_set(name=name)
+            custom_emoji_ids += [sticker.custom_emoji_id for sticker in sticker_set.stickers]
+        messages = emoji_grid.render_grids([grid for _, chunk in published for grid in chunk], custom_emoji_ids)
+        if notes:
+            messages[-1] += "\n\n" + html.escape("\n".join(notes))
+        for text in messages:
+            await first.answer(text, parse_mode="HTML")
+    except Exception as e:
+        logging.exception(e)
+        if isinstance(e, TelegramBadRequest):
+            for _, chunk in published:
+                for grid in chunk:
+                    if grid.blank_emoji_id:
+                        emoji_grid.forget_blank_emoji_id(grid.blank_emoji_id)
+        await first.answer("\n".join(f"Sticker pack created: https://t.me/addemoji/{name}" for name in names))
+        reporter.report(e, first, f"custom emoji send failed for {', '.join(names)}")
+    for name in names:
+        logging.info(f"Sticker pack created: https://t.me/addemoji/{name}")
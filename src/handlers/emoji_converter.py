@@ -1,11 +1,68 @@
+import io
+import logging
+
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, FSInputFile, Message, MessageEntity
+
+import src.converter as converter
+from src import emoji_files, workers
+from src.converter import process
+from src.settings import settings
 
 router = Router()
 
 
+def _emoji_rows(text: str, entities: list[MessageEntity]) -> list[list[str]]:
+    """Custom emoji ids of a message, one list per line of text."""
+    encoded = text.encode("utf-16-le")  # entity offsets are in UTF-16 code units
+    rows: list[list[str]] = [[]]
+    position = 0
+    for entity in sorted(entities, key=lambda e: e.offset):
+        if entity.type != "custom_emoji":
+            continue
+        before = encoded[position * 2:entity.offset * 2].decode("utf-16-le", errors="ignore")
+        rows.extend([] for _ in range(before.count("\n")))
+        rows[-1].append(entity.custom_emoji_id)
+        position = entity.offset + entity.length
+    return [row for row in rows if row]
+
+
+def _encode_png(rows: list[list[bytes]]) -> bytes:
+    buffer = io.BytesIO()
+    converter.assemble_image(rows).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 @router.message(
     F.entities & F.entities.func(lambda x: any(x.type == "custom_emoji" for x in x))
 )  # catches all messages with custom emoji
 async def start(message: Message):
-    await message.answer("Yeah, not implemented yet.")
+    emoji_rows = _emoji_rows(message.text, message.entities)
+    files = await emoji_files.get_emoji_files(
+        message.bot, [custom_emoji_id for row in emoji_rows for custom_emoji_id in row]
+    )
+    rows = [[files[i] for i in row if i in files] for row in emoji_rows]
+    rows = [row for row in rows if row]
+    if not rows:
+        await message.answer("Sorry, I couldn't find these emoji.")
+        return
+    if any(file.format == "animated" for row in rows for file in row):
+        await message.answer("Sorry, animated (Lottie) emoji are not supported yet.")
+        return
+
+    try:
+        if all(file.format == "static" for row in rows for file in row):
+            await message.bot.send_chat_action(message.chat.id, "upload_photo")
+            png = await workers.run(_encode_png, [[file.data for file in row] for row in rows])
+            await message.answer_document(BufferedInputFile(png, filename="emoji.png"))
+            return
+        await message.bot.send_chat_action(message.chat.id, "upload_video")
+        with workers.workspaces.job() as workspace, \
+                process.job_limits(settings.JOB_TIMEOUT, settings.FFMPEG_NICE, settings.FFMPEG_CGROUP):
+            video = await converter.assemble_video(
+                workspace, [[(file.format, file.data) for file in row] for row in rows], executor=workers.executor
+            )
+            await message.answer_animation(FSInputFile(video, filename="emoji.mp4"))
+    except converter.ConversionError as e:
+        logging.warning("Can't assemble custom emoji: %s", e)
+        await message.answer("Sorry, I can't put these emoji together.")
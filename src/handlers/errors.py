@@ -1,29 +1,26 @@
 import logging
 
-from aiogram import Router, Bot
+from aiogram import Router
 from aiogram.exceptions import TelegramNetworkError
 from aiogram.types import ErrorEvent
 
+from src.error_reporter import reporter
+
 router = Router()
 
 
 @router.error()
-async def start(event: ErrorEvent, bot: Bot):
+async def start(event: ErrorEvent):
     if isinstance(event.exception, TelegramNetworkError):
         return
 
     message = event.update.message
-    if message:
-        await message.answer(
-            "The bot can't process it. Please tell me what you were trying to do.\n"
-            "Message here -> @aiexz"
-        )
-
+    reporter.report(event.exception, message)
+    if message and message.from_user and reporter.should_reply(message.from_user.id):
         try:
-            await bot.forward_message(
-                chat_id=443446876,
-                from_chat_id=message.chat.id,
-                message_id=message.message_id,
+            await message.answer(
+                "The bot can't process it. Please tell me what you were trying to do.\n"
+                "Message here -> @aiexz"
             )
         except Exception as e:
             logging.exception(e)
@@ -1,14 +1,19 @@
 import io
 import logging
+from typing import BinaryIO
 
-import PIL.Image
 import aiogram
 from aiogram import Router, F
-from aiogram.exceptions import TelegramRetryAfter
-from aiogram.types import Message
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message, PhotoSize
 
 import src.converter as converter
 import src.utils as utils
+from src import downloads, emoji_grid, load_policy, memory_profile, sticker_sets, workers
+from src.error_reporter import reporter
+from src.handlers import albums
+from src.journal import Checkpoints, Job, journal
+from src.settings import settings
 from src.sticker_rate_limit import format_retry_message, save_retry_after
 
 router = Router()
@@ -30,34 +35,25 @@ async def unsupported_heic(message: Message):
     await message.answer("Sorry, .heic/.heif images are not supported.")
 
 
-@router.message(F.photo, flags={"new_stickers": True})
-@router.message(F.document.mime_type.in_(["image/png", "image/jpeg", "image/webp"]), flags={"new_stickers": True})
-async def image_converter(message: Message):
-    await message.bot.send_chat_action(message.chat.id, "upload_photo")
-    max_size_bytes = 20 * 1024 * 1024 # 20MB
-    if message.photo:
-        message_text = message.caption
-        if message.photo[-1].file_size and message.photo[-1].file_size > max_size_bytes:
-            await message.answer("Sorry, we cannot process files bigger than 20MB.")
-            return
-        photo = await message.bot.download(message.photo[-1])
-    elif message.document:
-        message_text = message.caption
-        if message.document.file_size and message.document.file_size > max_size_bytes:
-            await message.answer("Sorry, we cannot process files bigger than 20MB.")
-            return
-        photo = await message.bot.download(message.document.file_id)
-    else:
-        raise ValueError("No photo or document provided")
+def _pick_photo_size(sizes: list[PhotoSize], custom_width: int, custom_height: int) -> PhotoSize:
+    """Returns the smallest photo size that still covers the converted grid."""
+    largest = sizes[-1]
+    try:
+        width, height = converter.plan_image_size(largest.width, largest.height, custom_width, custom_height)
+    except converter.ConversionError:
+        return largest  # rejected later with a proper message
+    for size in sorted(sizes, key=lambda s: s.width * s.height):
+        if size.width >= width and size.height >= height:
+            return size
+    return largest
+
+
+def parse_options(message_text: str | None) -> tuple[int, int, str | None, float, float]:
+    """Returns (custom_width, custom_height, bg_color, b_sim, b_blend) from a /convert caption."""
     custom_width, custom_height, bg_color, b_sim, b_blend = 0, 0, None, 30, 0
-    title = "Created by @" + (await message.bot.me()).username
-    # Parse command arguments if present
-    if message_text and message_text.startswith("/convert"):
-        # shoutout to @drip_tech for this style
-        command_args = message_text.removeprefix("/convert").strip().split()
-        command_map = {
-            k: v for k, v in (arg.split("=", 1) for arg in command_args if "=" in arg)
-        }
+    # shoutout to @drip_tech for this style
+    command_map = utils.parse_convert_args(message_text)
+    if command_map:
         try:
             custom_width = int(command_map.get("w", 0))
             custom_width = max(0, custom_width) # width can't be negative
@@ -81,87 +77,210 @@ async def image_converter(message: Message):
             b_blend = max(0, min(100, b_blend)) # clamp to 0-100
         except ValueError:
             b_blend = 0
-        title_map = command_map.get("name", None) # name for our pack
-        if title_map:
-            # 64 - w/ @itosbot
-            title = title_map[:50] + " w/ @" + (await message.bot.me()).username
+    return custom_width, custom_height, bg_color, b_sim, b_blend
+
 
+@workers.tracked_job
+async def build_image_grid(
+    message: Message,
+    custom_width: int = 0,
+    custom_height: int = 0,
+    bg_color: str | None = None,
+    b_sim: float = 30,
+    b_blend: float = 0,
+    checkpoints: Checkpoints | None = None,
+) -> emoji_grid.Grid:
+    """Downloads and tiles the image of a message.
 
-    stickers = []
+    :param checkpoints: Where the download and plan are journaled; a resumed job reuses them
+    :raises converter.ConversionError: with a message for the user if the image can't be converted
+    """
+    plan = checkpoints.load_json("plan") if checkpoints else None
+    source = checkpoints.file("source") if checkpoints else None
+    if plan is not None and source is not None:
+        quality = load_policy.quality_for(plan["quality"])
+        with open(source, "rb") as f:
+            photo = io.BytesIO(f.read())
+        return await tile_image(message, photo, plan["custom_width"], custom_height, bg_color, b_sim, b_blend, quality)
+
+    max_size_bytes = 20 * 1024 * 1024 # 20MB
+    quality = load_policy.current_quality(custom_width, custom_height)
     try:
-        tiles, tiles_width, tiles_height = converter.convert_to_images(
-            PIL.Image.open(photo),
-            custom_width,
-            custom_height,
-            bg_color,
-            b_sim,
-            b_blend,
+        # plan from the metadata first, so rejected images are never downloaded
+        if message.photo:
+            largest = message.photo[-1]
+            converter.plan_image(largest.width, largest.height, custom_width, custom_height, settings.MAX_IMAGE_PIXELS)
+            if quality.level != "normal":
+                custom_width = load_policy.limit_grid(largest.width, largest.height, quality.max_tiles, converter.plan_image_size)
+            photo_size = _pick_photo_size(message.photo, custom_width, custom_height)
+            if photo_size.file_size and photo_size.file_size > max_size_bytes:
+                raise converter.ConversionError("Sorry, we cannot process files bigger than 20MB.")
+            photo = await message.bot.download(photo_size)
+        elif message.document:
+            if message.document.file_size and message.document.file_size > max_size_bytes:
+                raise converter.ConversionError("Sorry, we cannot process files bigger than 20MB.")
+            file = await message.bot.get_file(message.document.file_id)
+            head = await downloads.read_head(message.bot, file)
+            # None if the header doesn't fit in the head or is unknown; open_image checks the full file
+            size = await workers.run(converter.header_size, head)
+            if size is not None:
+                width, height = size
+                converter.plan_image(width, height, custom_width, custom_height, settings.MAX_IMAGE_PIXELS)
+                if quality.level != "normal":
+                    custom_width = load_policy.limit_grid(width, height, quality.max_tiles, converter.plan_image_size)
+            photo = await message.bot.download_file(file.file_path)
+        else:
+            raise ValueError("No photo or document provided")
+    except converter.TileLimitError as e:
+        raise converter.ConversionError(f"❌ {str(e)}") from e
+    except converter.DimensionError as e:
+        raise converter.ConversionError(f"❌ {str(e)}") from e
+    memory_profile.checkpoint("downloaded")
+    if checkpoints:
+        checkpoints.save_bytes("source", photo.getvalue())
+        checkpoints.save_json("plan", {"quality": quality.level, "custom_width": custom_width})
+    return await tile_image(message, photo, custom_width, custom_height, bg_color, b_sim, b_blend, quality)
+
+
+def _open_and_tile(
+    photo: BinaryIO, custom_width: int, custom_height: int, bg_color: str | None, b_sim: float, b_blend: float
+) -> tuple[list, int, int]:
+    """Opens the image and slices it into tiles, see `converter.convert_to_images`."""
+    image, size = converter.open_image(photo, custom_width, custom_height, settings.MAX_IMAGE_PIXELS)
+    return converter.convert_to_images(image, custom_width, custom_height, bg_color, b_sim, b_blend, size)
+
+
+async def tile_image(
+    message: Message,
+    photo: BinaryIO,
+    custom_width: int,
+    custom_height: int,
+    bg_color: str | None,
+    b_sim: float,
+    b_blend: float,
+    quality: load_policy.Quality,
+) -> emoji_grid.Grid:
+    """Tiles a downloaded image into static stickers; also used for videos that show a single picture.
+
+    :raises converter.ConversionError: with a message for the user if the image can't be converted
+    """
+    try:
+        # decoding, keying and resizing block, so they run on the pool like the encoding
+        tiles, tiles_width, tiles_height = await workers.run(
+            _open_and_tile, photo, custom_width, custom_height, bg_color, b_sim, b_blend
         )
     except converter.TileLimitError as e:
-        await message.answer(f"❌ {str(e)}")
-        return
+        raise converter.ConversionError(f"❌ {str(e)}") from e
     except converter.DimensionError as e:
-        await message.answer(f"❌ {str(e)}")
-        return
+        raise converter.ConversionError(f"❌ {str(e)}") from e
     except ValueError as e:
-        await message.answer(f"❌ Invalid image: {str(e)}")
+        raise converter.ConversionError(f"❌ Invalid image: {str(e)}") from e
+
+    memory_profile.checkpoint("tiled")
+    encoded = await workers.map_batches(converter.encode_tiles, tiles, quality.tile_profile)
+    memory_profile.checkpoint("encoded")
+    # fully transparent tiles (padding, removed background) share one prebuilt emoji
+    blank = [tile.getchannel("A").getbbox() is None for tile in tiles]
+    blank_emoji_id = None
+    if any(blank) and not all(blank):
+        blank_emoji_id = await emoji_grid.get_blank_emoji_id(message.bot)
+    unique, layout = emoji_grid.dedupe_tiles(encoded, blank if blank_emoji_id else None)
+    stickers = [
+        aiogram.types.InputSticker(
+            sticker=aiogram.types.BufferedInputFile(
+                file=encoded[index],
+                filename=f"sticker.{converter.TILE_EXTENSIONS[quality.tile_profile]}",
+            ),
+            emoji_list=["😀"],
+            format="static",
+        )
+        for index in unique
+    ]
+    return emoji_grid.Grid(stickers, layout, tiles_width, blank_emoji_id)
+
+
+@router.message(F.photo, flags={"new_stickers": True})
+@router.message(F.document.mime_type.in_(["image/png", "image/jpeg", "image/webp"]), flags={"new_stickers": True})
+async def image_converter(message: Message, job: Job | None = None):
+    """Converts a single image into a new pack; `job` is passed when resuming a journaled one."""
+    if message.media_group_id:
+        await albums.collect(message, album_item(message), job)
         return
-    
-    for tile in tiles:
-        sticker = io.BytesIO()
-        tile.save(sticker, format="PNG")
-        stickers.append(
-            aiogram.types.InputSticker(
-                sticker=aiogram.types.BufferedInputFile(
-                    file=sticker.getvalue(), filename="sticker.png"
-                ),
-                emoji_list=["😀"],
-                format="static",
+    with job or journal.start([message]) as job:
+        await _publish_image(message, job)
+
+
+def album_item(message: Message) -> albums.GridBuilder:
+    """Converts an album item with the album caption."""
+    return lambda caption, checkpoints: build_image_grid(message, *parse_options(caption), checkpoints=checkpoints)
+
+
+async def _publish_image(message: Message, job: Job):
+    await message.bot.send_chat_action(message.chat.id, "upload_photo")
+    message_text = message.caption
+    custom_width, custom_height, bg_color, b_sim, b_blend = parse_options(message_text)
+    bot_username = (await message.bot.me()).username
+    title = "Created by @" + bot_username
+    title_map = utils.parse_convert_args(message_text).get("name", None) # name for our pack
+    if title_map:
+        # 64 - w/ @itosbot
+        title = title_map[:50] + " w/ @" + bot_username
+
+    grid = job.load_grid()
+    if grid is None:
+        try:
+            grid = await build_image_grid(message, custom_width, custom_height, bg_color, b_sim, b_blend, checkpoints=job)
+        except converter.ConversionError as e:
+            await message.answer(str(e))
+            return
+        job.save_grid(grid)
+
+    published = job.load_json("published")
+    if published is None:
+        try:
+            sticker_set = await sticker_sets.publish(
+                message.bot,
+                message.from_user.id,
+                "emojis",
+                title,
+                grid.stickers,
+                "static",
+                dedicated=bool(title_map),
             )
-        )
-    name = f"emojis_{message.from_user.id}_{utils.random_string()}_by_{(await message.bot.me()).username}"
+        except TelegramRetryAfter as e:
+            retry_until = save_retry_after(message.from_user.id, e.retry_after)
+            logging.info(
+                "Sticker creation rate limited for user %s until %s.",
+                message.from_user.id,
+                retry_until.isoformat(),
+            )
+            # if it is "SendMessage" flood limit, we cannot send a message to the user
+            if e.method == "SendMessage":
+                return
+            await message.answer(format_retry_message(retry_until))
+            return
+        except Exception as e:
+            logging.exception(e)
+            await message.answer("Failed to create sticker set. Please try again later.")
+            return
+        published = {
+            "name": sticker_set.name,
+            "custom_emoji_ids": [sticker.custom_emoji_id for sticker in sticker_set.stickers[-len(grid.stickers):]],
+        }
+        job.save_json("published", published)
+    name = published["name"]
     try:
-        res = await message.bot.create_new_sticker_set(
-            user_id=message.from_user.id,
-            name=name,
-            title=title,
-            stickers=stickers,
-            sticker_format="static",
-            sticker_type="custom_emoji",
-        )
-    except TelegramRetryAfter as e:
-        retry_until = save_retry_after(message.from_user.id, e.retry_after)
-        logging.info(
-            "Sticker creation rate limited for user %s until %s.",
-            message.from_user.id,
-            retry_until.isoformat(),
+        msg = emoji_grid.render_grid(
+            grid.layout,
+            published["custom_emoji_ids"],
+            grid.tiles_width,
+            grid.blank_emoji_id,
         )
-        # if it is "SendMessage" flood limit, we cannot send a message to the user
-        if e.method == "SendMessage":
-            return
-        await message.answer(format_retry_message(retry_until))
-        return
+        await message.answer(msg, parse_mode="HTML")
     except Exception as e:
         logging.exception(e)
-        await message.answer("Failed to create sticker set. Please try again later.")
-        return
-    if res:
-        try:
-            sticker_set = await message.bot.get_sticker_set(name=name)
-            msg_parts = []
-            for index, sticker in enumerate(sticker_set.stickers):
-                msg_parts.append(f"<tg-emoji emoji-id=\"{sticker.custom_emoji_id}\">🤯</tg-emoji>")
-                if (index + 1) % tiles_width == 0:
-                    msg_parts.append("\n")
-            msg = "".join(msg_parts).strip()
-            await message.answer(msg, parse_mode="HTML")
-        except Exception as e:
-            logging.exception(e)
-            await message.answer(f"Sticker pack created: https://t.me/addemoji/{name}")
-            await message.bot.send_message(
-                chat_id=443446876,
-                text=f"Custom emoji send failed for {name}: {type(e).__name__}: {e}",
-            )
-        logging.info(f"Sticker pack created: https://t.me/addemoji/{name}")
-    else:
-        await message.answer("Something went wrong. Please contact owner for help.")
+        if grid.blank_emoji_id and isinstance(e, TelegramBadRequest):
+            emoji_grid.forget_blank_emoji_id(grid.blank_emoji_id)
+        await message.answer(f"Sticker pack created: https://t.me/addemoji/{name}")
+        reporter.report(e, message, f"custom emoji send failed for {name}")
+    logging.info(f"Sticker pack created: https://t.me/addemoji/{name}")
@@ -0,0 +1,22 @@
+import html
+
+from aiogram import F, Router
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from src import memory_profile, workers
+from src.emoji_grid import MAX_MESSAGE_LENGTH
+from src.settings import settings
+
+router = Router()
+router.message.filter(F.from_user.id == settings.OWNER_ID)
+
+
+@router.message(Command("memstats"))
+async def memstats(message: Message):
+    """Heap statistics and the largest live objects; walking the heap blocks for a moment."""
+    lines = [f"Jobs in flight: {workers.active_jobs}", *memory_profile.heap_stats().splitlines()]
+    while len(html.escape("\n".join(lines))) > MAX_MESSAGE_LENGTH - len("<pre></pre>"):
+        lines.pop()
+    text = html.escape("\n".join(lines))
+    await message.answer(f"<pre>{text}</pre>", parse_mode="HTML")
@@ -1,51 +1,73 @@
+import io
 import logging
-import os
-import tempfile
+import shutil
+from fractions import Fraction
 
 import aiogram.types.input_file
 from aiogram import Router, F
-from aiogram.exceptions import TelegramRetryAfter
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message
 
-import src.converter.video as converter
-from src import utils
+import src.converter as converter
+from src.converter import process
+from src import downloads, emoji_grid, load_policy, memory_profile, sticker_sets, utils, workers
+from src.error_reporter import reporter
+from src.handlers import albums, images
+from src.journal import Checkpoints, Job, journal
+from src.metrics import metrics
+from src.settings import settings
 from src.sticker_rate_limit import format_retry_message, save_retry_after
 
 router = Router()
 
 
-def _cleanup_temp_tiles(tile_paths: list[str]) -> None:
-    if not tile_paths:
-        return
-    temp_dir = os.path.dirname(tile_paths[0])
-    for path in tile_paths:
-        try:
-            os.remove(path)
-        except FileNotFoundError:
-            continue
-        except OSError:
-            logging.exception("Failed to remove temporary tile file %s", path)
+async def _probe_file(filename: str) -> "converter.VideoInfo | None":
+    """Probes a video file; None if ffprobe can't read it."""
     try:
-        os.rmdir(temp_dir)
-    except OSError:
-        logging.debug("Temporary directory %s was not empty or already removed", temp_dir)
+        return await converter.probe_video(filename)
+    except (converter.ConversionError, KeyError, IndexError, ValueError) as e:
+        logging.info("Can't probe video: %s", e)
+        return None
 
 
-@router.message(F.animation | F.video, flags={"new_stickers": True})
-@router.message(F.document.mime_type.in_(["image/gif","video/mp4", "video/webm"]), flags={"new_stickers": True})
-async def video_converter(message: Message):
-    await message.bot.send_chat_action(message.chat.id, "upload_video")
-    message_text = message.caption
-    max_size_bytes = 20 * 1024 * 1024
-    
+async def _probe_bytes(data: bytes) -> "converter.VideoInfo | None":
+    """Probes a video, or the head of one, from memory; None if ffprobe can't read it."""
+    with workers.workspaces.job() as workspace:
+        filename = workspace.file("probe")
+        with open(filename, "wb") as f:
+            f.write(data)
+        return await _probe_file(filename)
+
+
+async def _is_still(filename: str, start: float, length: float | None, source: "converter.VideoInfo | None") -> bool:
+    """Whether the converted window shows a single picture; False if that can't be told.
+
+    `source` is the probed video; the samples are spread over the part of the window it covers.
+    """
+    window = length or settings.MAX_VIDEO_DURATION
+    if source is not None and source.duration:
+        window = min(window, source.duration - start)
+        if window <= 0:
+            # convert_video reports the window to the user
+            return False
+    try:
+        return await converter.is_still(filename, start, window)
+    except converter.ConversionError as e:
+        # convert_video reports the problem to the user
+        logging.info("Can't check for a still video: %s", e)
+        return False
+
+
+def parse_options(message_text: str | None) -> tuple[int, int, str | None, float, float, float, float | None]:
+    """Returns (custom_width, custom_height, bg_color, b_sim, b_blend, start, length) from a /convert caption.
+
+    `start=` and `len=` pick the window of the video to convert, in seconds or as m:ss;
+    by default the first MAX_VIDEO_DURATION seconds are used.
+    """
     custom_width, custom_height, bg_color, b_sim, b_blend = 0, 0, None, 30, 0
-    title = "Created by @" + (await message.bot.me()).username
-    # Parse command arguments if present
-    if message_text and message_text.startswith("/convert"):
-        command_args = message_text.removeprefix("/convert").strip().split()
-        command_map = {
-            k: v for k, v in (arg.split("=", 1) for arg in command_args if "=" in arg)
-        }
+    start, length = 0.0, None
+    command_map = utils.parse_convert_args(message_text)
+    if command_map:
         try:
             custom_width = int(command_map.get("w", 0))
             custom_width = max(0, custom_width)  # width can't be negative
@@ -69,55 +91,168 @@ async def video_converter(message: Message):
             b_blend = max(0, min(100, b_blend)) # clamp to 0-100
         except ValueError:
             b_blend = 0
-        title_map = command_map.get("name", None) # name for our pack
-        if title_map is not None:
-            # 64 - w/ @itosbot
-            title = title_map[:50] + " w/ @" + (await message.bot.me()).username
-
-    
-    if message.animation:
-        if message.animation.file_size and message.animation.file_size > max_size_bytes:
-            await message.answer("Sorry, we cannot process files bigger than 20MB.")
-            return
-        if message.animation.duration > 5:
-            await message.answer(
-                "Sorry, but I can't convert animations longer than 5 seconds."
+        try:
+            start = utils.parse_seconds(command_map.get("start", "0"))
+        except ValueError:
+            start = 0.0
+        try:
+            length = utils.parse_seconds(command_map["len"]) if "len" in command_map else None
+        except ValueError:
+            length = None
+        if length is not None and length <= 0:
+            length = None
+    return custom_width, custom_height, bg_color, b_sim, b_blend, start, length
+
+
+@workers.tracked_job
+async def build_video_grid(
+    message: Message,
+    custom_width: int = 0,
+    custom_height: int = 0,
+    bg_color: str | None = None,
+    b_sim: float = 20,
+    b_blend: float = 0,
+    start: float = 0,
+    length: float | None = None,
+    checkpoints: Checkpoints | None = None,
+) -> emoji_grid.Grid:
+    """Downloads and tiles the video or animation of a message.
+
+    Only the window from `start` is decoded, so long videos are cut rather than rejected.
+
+    Args:
+        checkpoints: Where the download and plan are journaled; a resumed job reuses them
+
+    Raises:
+        converter.ConversionError: with a message for the user if the video can't be converted
+    """
+    plan = checkpoints.load_json("plan") if checkpoints else None
+    saved_source = checkpoints.file("source") if checkpoints else None
+    if plan is not None and saved_source is not None:
+        quality = load_policy.quality_for(plan["quality"])
+        custom_width = plan["custom_width"]
+        source = None
+        if plan["source"] is not None:
+            width, height, fps, duration = plan["source"]
+            source = converter.VideoInfo(width, height, Fraction(fps), duration)
+        with workers.workspaces.job() as workspace:
+            return await _tile_video(
+                message, workspace, saved_source, custom_width, custom_height, bg_color, b_sim, b_blend, start, length, quality, source, checkpoints
             )
-            return
-        video = await message.bot.download(message.animation.file_id)
-    elif message.document:
-        if message.document.file_size and message.document.file_size > max_size_bytes:
-            await message.answer("Sorry, we cannot process files bigger than 20MB.")
-            return
-        video = await message.bot.download(message.document.file_id)
-        with tempfile.NamedTemporaryFile() as f:
-            f.write(video.read())
-            f.flush()
-            video.seek(0)
-            try:
-                length = await converter.get_video_length(f.name)
-            except Exception as e:
-                logging.exception(e)
-                await message.answer("Sorry, this file format is not supported.")
-                return
-            if length > 5:
-                await message.answer(
-                    "Sorry, but I can't convert videos longer than 5 seconds."
-                )
-                return
+
+    with workers.workspaces.job() as workspace:
+        return await _plan_video(message, workspace, custom_width, custom_height, bg_color, b_sim, b_blend, start, length, checkpoints)
+
+
+async def _plan_video(
+    message: Message,
+    workspace: "converter.Workspace",
+    custom_width: int,
+    custom_height: int,
+    bg_color: str | None,
+    b_sim: float,
+    b_blend: float,
+    start: float,
+    length: float | None,
+    checkpoints: Checkpoints | None,
+) -> emoji_grid.Grid:
+    """Checks the video against the limits before downloading as little of it as possible, then tiles it."""
+    max_size_bytes = 20 * 1024 * 1024
+    quality = load_policy.current_quality(custom_width, custom_height)
+    source = None
+    file = None
+    media = message.animation or message.video
+    if media:
+        if media.file_size and media.file_size > max_size_bytes:
+            raise converter.ConversionError("Sorry, we cannot process files bigger than 20MB.")
+        if media.width and media.height:
+            # Telegram doesn't report the frame rate, the converter probes it after the download;
+            # the duration is rounded to whole seconds, so the window check here allows one more
+            source = converter.VideoInfo(media.width, media.height, Fraction(0), media.duration + 1 if media.duration else None)
     else:
-        if message.video.file_size and message.video.file_size > max_size_bytes:
-            await message.answer("Sorry, we cannot process files bigger than 20MB.")
-            return
-        if message.video.duration > 5:
-            await message.answer(
-                "Sorry, but I can't convert videos longer than 5 seconds."
+        if message.document.file_size and message.document.file_size > max_size_bytes:
+            raise converter.ConversionError("Sorry, we cannot process files bigger than 20MB.")
+        file = await message.bot.get_file(message.document.file_id)
+        head = await downloads.read_head(message.bot, file)
+        complete = len(head) < downloads.HEAD_SIZE
+        # a truncated GIF probes as shorter than it is, other containers keep the duration in the header
+        if complete or message.document.mime_type != "image/gif":
+            source = await _probe_bytes(head)
+        if source is None or (source.duration is None and not complete):
+            # the header isn't enough, e.g. an MP4 with its index at the end
+            await downloads.download(message.bot, file, workspace.file("video.mp4"))
+            file = None
+            source = await _probe_file(workspace.file("video.mp4"))
+        if source is None:
+            raise converter.ConversionError("Sorry, this file format is not supported.")
+
+    if source is not None:
+        try:
+            if quality.level != "normal":
+                custom_width = load_policy.limit_grid(source.width, source.height, quality.max_tiles, converter.plan_video_dimensions)
+            converter.plan_normalization(
+                source, custom_width, custom_height, quality.max_fps, settings.MAX_VIDEO_DURATION, start, length
             )
-            return
-        video = await message.bot.download(message.video.file_id)
+        except converter.ConversionError as e:
+            raise converter.ConversionError(f"❌ {str(e)}") from e
+    if media:
+        file = await message.bot.get_file(media.file_id)
+    return await _tile_video(
+        message, workspace, file, custom_width, custom_height, bg_color, b_sim, b_blend, start, length, quality, source, checkpoints
+    )
 
-    result: list[str] = []
-    try:
+
+async def _tile_video(
+    message: Message,
+    workspace: "converter.Workspace",
+    file: "aiogram.types.File | str | None",
+    custom_width: int,
+    custom_height: int,
+    bg_color: str | None,
+    b_sim: float,
+    b_blend: float,
+    start: float,
+    length: float | None,
+    quality: load_policy.Quality,
+    source: "converter.VideoInfo | None",
+    checkpoints: Checkpoints | None,
+) -> emoji_grid.Grid:
+    """Downloads `file` into the workspace and tiles it.
+
+    `file` is a path when resuming from the journaled download, None if the video was
+    already downloaded into the workspace.
+    """
+    filename = workspace.file("video.mp4")
+    if isinstance(file, str):
+        shutil.copyfile(file, filename)
+    elif file is not None:
+        await downloads.download(message.bot, file, filename)
+    video = filename
+    workspace.check_quota()
+    memory_profile.checkpoint("downloaded")
+    if checkpoints and not isinstance(file, str):
+        checkpoints.save_file("source", filename)
+        checkpoints.save_json("plan", {
+            "quality": quality.level,
+            "custom_width": custom_width,
+            "source": None if source is None else [source.width, source.height, str(source.fps), source.duration],
+        })
+
+    with process.job_limits(settings.JOB_TIMEOUT, settings.FFMPEG_NICE, settings.FFMPEG_CGROUP):
+        if settings.STILL_VIDEOS_AS_IMAGES and (source is None or not source.fps):
+            # Telegram's rounded duration can't place the samples, and convert_video reuses the probe
+            source = await _probe_file(video)
+        if settings.STILL_VIDEOS_AS_IMAGES and await _is_still(video, start, length, source):
+            # one picture: a static emoji costs a fraction of a VP9 encode per tile
+            metrics.incr("video.still")
+            try:
+                still = await converter.extract_frame(video, start)
+            except converter.ProcessError as e:
+                logging.warning("Can't extract the frame of a still video: %s", e)
+                raise converter.ConversionError("Sorry, but I can't convert this video.") from e
+            return await images.tile_image(
+                message, io.BytesIO(still), custom_width, custom_height, bg_color, b_sim, b_blend, quality
+            )
         try:
             result, tiles_width, tiles_height = await converter.convert_video(
                 video,
@@ -126,40 +261,99 @@ async def video_converter(message: Message):
                 bg_color,
                 b_sim,
                 b_blend,
+                workspace=workspace,
+                strip_metadata=settings.STRIP_WEBM_METADATA,
+                encoder_profile=quality.vp9_profile,
+                max_fps=quality.max_fps,
+                max_duration=settings.MAX_VIDEO_DURATION,
+                source=source,
+                backend=workers.video_backend(),
+                start=start,
+                length=length,
             )
         except converter.TileLimitError as e:
-            await message.answer(f"❌ {str(e)}")
-            return
+            raise converter.ConversionError(f"❌ {str(e)}") from e
+        except converter.ProcessTimeoutError as e:
+            logging.warning("Video conversion timed out: %s", e)
+            raise converter.ConversionError("Sorry, converting this video took too long. Try a shorter or smaller one.") from e
+        except converter.ProcessError as e:
+            # the stderr tail names workspace files and filters, it is for the log only
+            logging.warning("Video conversion failed: %s", e)
+            raise converter.ConversionError("Sorry, but I can't convert this video.") from e
         except converter.ConversionError as e:
-            await message.answer("Sorry, but I can't convert this video. It is probably too long.\n" + str(e))
-            return
+            raise converter.ConversionError("Sorry, but I can't convert this video.\n" + str(e)) from e
         except Exception as e:
-            await message.answer("Some unexpected error occurred, sorry")
             logging.exception(e)
-            return
+            raise converter.ConversionError("Some unexpected error occurred, sorry") from e
+        memory_profile.checkpoint("converted")
         if len(result) > 50:
             logging.error("Too many tiles: %s", len(result))
-        stickers = []
+        tile_data = []
         for tile in result:
-            stickers.append(
-                aiogram.types.InputSticker(
-                    sticker=aiogram.types.input_file.FSInputFile(
-                        path=tile, filename="sticker.webm"
-                    ),
-                    emoji_list=["😀"],
-                    format="video",
-                )
-            )
-        name = f"video_{message.from_user.id}_{utils.random_string()}_by_{(await message.bot.me()).username}"
+            with open(tile, "rb") as f:
+                tile_data.append(f.read())
+    unique, layout = emoji_grid.dedupe_tiles(tile_data)
+    stickers = [
+        aiogram.types.InputSticker(
+            sticker=aiogram.types.input_file.BufferedInputFile(
+                file=tile_data[index], filename="sticker.webm"
+            ),
+            emoji_list=["😀"],
+            format="video",
+        )
+        for index in unique
+    ]
+    return emoji_grid.Grid(stickers, layout, tiles_width)
+
+
+@router.message(F.animation | F.video, flags={"new_stickers": True})
+@router.message(F.document.mime_type.in_(["image/gif","video/mp4", "video/webm"]), flags={"new_stickers": True})
+async def video_converter(message: Message, job: Job | None = None):
+    """Converts a single video into a new pack; `job` is passed when resuming a journaled one."""
+    if message.media_group_id:
+        await albums.collect(message, album_item(message), job)
+        return
+    with job or journal.start([message]) as job:
+        await _publish_video(message, job)
+
+
+def album_item(message: Message) -> albums.GridBuilder:
+    """Converts an album item with the album caption."""
+    return lambda caption, checkpoints: build_video_grid(message, *parse_options(caption), checkpoints=checkpoints)
+
+
+async def _publish_video(message: Message, job: Job):
+    await message.bot.send_chat_action(message.chat.id, "upload_video")
+    message_text = message.caption
+    options = parse_options(message_text)
+    bot_username = (await message.bot.me()).username
+    title = "Created by @" + bot_username
+    title_map = utils.parse_convert_args(message_text).get("name", None) # name for our pack
+    if title_map is not None:
+        # 64 - w/ @itosbot
+        title = title_map[:50] + " w/ @" + bot_username
+
+    grid = job.load_grid()
+    if grid is None:
         try:
-            res = await message.bot.create_new_sticker_set(
-                user_id=message.from_user.id,
-                name=name,
-                title=title,
-                stickers=stickers,
-                sticker_format="video",
-                needs_repainting=False,
-                sticker_type="custom_emoji",
+            grid = await build_video_grid(message, *options, checkpoints=job)
+        except converter.ConversionError as e:
+            await message.answer(str(e))
+            return
+        job.save_grid(grid)
+
+    published = job.load_json("published")
+    if published is None:
+        try:
+            sticker_set = await sticker_sets.publish(
+                message.bot,
+                message.from_user.id,
+                "video",
+                title,
+                grid.stickers,
+                # still videos are converted to static stickers
+                grid.stickers[0].format,
+                dedicated=bool(title_map),
             )
         except TelegramRetryAfter as e:
             retry_until = save_retry_after(message.from_user.id, e.retry_after)
@@ -175,25 +369,24 @@ async def video_converter(message: Message):
             await message.answer("Failed to create sticker set. Please try again later.")
             return
 
-        if res:
-            try:
-                sticker_set = await message.bot.get_sticker_set(name=name)
-                msg_parts = []
-                for index, sticker in enumerate(sticker_set.stickers):
-                    msg_parts.append(f"<tg-emoji emoji-id=\"{sticker.custom_emoji_id}\">🤯</tg-emoji>")
-                    if (index + 1) % tiles_width == 0:
-                        msg_parts.append("\n")
-                msg = "".join(msg_parts).strip()
-                await message.answer(msg, parse_mode="HTML")
-            except Exception as e:
-                logging.exception(e)
-                await message.answer(f"Sticker pack created: https://t.me/addemoji/{name}")
-                await message.bot.send_message(
-                    chat_id=443446876,
-                    text=f"Custom emoji send failed for {name}: {type(e).__name__}: {e}",
-                )
-            logging.info(f"Sticker pack created: https://t.me/addemoji/{name}")
-        else:
-            await message.answer("Something went wrong. Please contact @aiexzbot for help.")
-    finally:
-        _cleanup_temp_tiles(result)
+        published = {
+            "name": sticker_set.name,
+            "custom_emoji_ids": [sticker.custom_emoji_id for sticker in sticker_set.stickers[-len(grid.stickers):]],
+        }
+        job.save_json("published", published)
+    name = published["name"]
+    try:
+        msg = emoji_grid.render_grid(
+            grid.layout,
+            published["custom_emoji_ids"],
+            grid.tiles_width,
+            grid.blank_emoji_id,
+        )
+        await message.answer(msg, parse_mode="HTML")
+    except Exception as e:
+        logging.exception(e)
+        if grid.blank_emoji_id and isinstance(e, TelegramBadRequest):
+            emoji_grid.forget_blank_emoji_id(grid.blank_emoji_id)
+        await message.answer(f"Sticker pack created: https://t.me/addemoji/{name}")
+        reporter.report(e, message, f"custom emoji send failed for {name}")
+    logging.info(f"Sticker pack created: https://t.me/addemoji/{name}")
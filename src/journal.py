@@ -0,0 +1,221 @@
+"""Durable journal of conversion jobs, so a deploy or crash doesn't lose them.
+
+Every conversion gets a directory under JOURNAL_DIR holding the messages of the job and
+a checkpoint for each completed stage:
+
+- "source" and "plan": the downloaded file and the decisions made before converting it
+  (quality level, grid width, probed video info)
+- "grid": the encoded tiles and layout
+- "published": the sticker set(s) the tiles were uploaded to
+
+Album items keep their checkpoints under an item prefix. On startup `pending` returns the
+jobs a previous process didn't finish; they are fed through the dispatcher again and every
+stage with a checkpoint is skipped.
+
+Jobs are removed when they finish, fail or have been started JOURNAL_MAX_ATTEMPTS times;
+only a cancelled job (shutdown) stays for the next start.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Iterator
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, InputSticker, Message
+
+from src.emoji_grid import Grid
+from src.settings import settings
+
+
+def _write_json(path: str, data: Any) -> None:
+    # a crash mid-write leaves the previous version
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+class Checkpoints:
+    """Stage results of a job or of one album item, kept in the job's directory.
+
+    Without a journal directory nothing is saved and every load returns None.
+    """
+
+    def __init__(self, path: str | None, prefix: str = "", job: "Job | None" = None):
+        self.path = path
+        self.prefix = prefix
+        self._job = job
+
+    def item(self, name: str) -> "Checkpoints":
+        """Checkpoints of a part of the job, e.g. an album item."""
+        return Checkpoints(self.path, f"{self.prefix}{name}_", self._job or self)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{self.prefix}{name}")
+
+    def _reached(self, name: str) -> None:
+        if self._job is not None:
+            self._job._reached(f"{self.prefix}{name}")
+
+    def file(self, name: str) -> str | None:
+        """Path of a saved file, None if it wasn't saved."""
+        if self.path is None or not os.path.exists(self._file(name)):
+            return None
+        return self._file(name)
+
+    def save_file(self, name: str, source: str) -> None:
+        """Copies a file, e.g. a download from the (tmpfs) workspace."""
+        if self.path is None:
+            return
+        shutil.copyfile(source, f"{self._file(name)}.tmp")
+        os.replace(f"{self._file(name)}.tmp", self._file(name))
+        self._reached(name)
+
+    def save_bytes(self, name: str, data: bytes) -> None:
+        if self.path is None:
+            return
+        with open(f"{self._file(name)}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{self._file(name)}.tmp", self._file(name))
+        self._reached(name)
+
+    def load_json(self, name: str) -> Any:
+        """A saved JSON checkpoint, None if it wasn't saved."""
+        path = self.file(f"{name}.json")
+        if path is None:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_json(self, name: str, data: Any) -> None:
+        if self.path is None:
+            return
+        _write_json(self._file(f"{name}.json"), data)
+        self._reached(name)
+
+    def save_grid(self, grid: Grid) -> None:
+        """Stores the encoded tiles; a resumed job skips the download and conversion."""
+        if self.path is None:
+            return
+        stickers = []
+        for index, sticker in enumerate(grid.stickers):
+            filename = f"tile{index}_{sticker.sticker.filename}"
+            with open(self._file(filename), "wb") as f:
+                f.write(sticker.sticker.data)
+            stickers.append({"file": filename, "format": sticker.format, "emoji_list": sticker.emoji_list})
+        self.save_json("grid", {
+            "stickers": stickers,
+            "layout": grid.layout,
+            "tiles_width": grid.tiles_width,
+            "blank_emoji_id": grid.blank_emoji_id,
+        })
+
+    def load_grid(self) -> Grid | None:
+        data = self.load_json("grid")
+        if data is None:
+            return None
+        stickers = []
+        for sticker in data["stickers"]:
+            with open(self._file(sticker["file"]), "rb") as f:
+                content = f.read()
+            stickers.append(InputSticker(
+                sticker=BufferedInputFile(file=content, filename=sticker["file"].split("_", 1)[1]),
+                emoji_list=sticker["emoji_list"],
+                format=sticker["format"],
+            ))
+        return Grid(stickers, data["layout"], data["tiles_width"], data["blank_emoji_id"])
+
+
+class Job(Checkpoints):
+    """One journaled conversion; a context manager that removes the job unless it was cancelled."""
+
+    def __init__(self, path: str | None, messages: list[Message], stage: str = "started", attempts: int = 0, created: float | None = None):
+        super().__init__(path)
+        self.messages = messages
+        self.stage = stage
+        self.attempts = attempts
+        self.created = time.time() if created is None else created
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        _write_json(os.path.join(self.path, "job.json"), {
+            "messages": [message.model_dump(mode="json", exclude_none=True) for message in self.messages],
+            "stage": self.stage,
+            "attempts": self.attempts,
+            "created": self.created,
+        })
+
+    def _reached(self, name: str) -> None:
+        self.stage = name
+        self._save()
+
+    def finish(self) -> None:
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> "Job":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: Any) -> None:
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            logging.info("Job %s interrupted after %s, it resumes on the next start", self.path, self.stage)
+            return
+        self.finish()
+
+
+class Journal:
+    def __init__(self, root: str | None, max_attempts: int = 3, max_age: float = 24 * 3600):
+        """
+        :param root: Directory of the journal; None keeps jobs in memory only
+        :param max_attempts: Starts of a job, resumes included, before it is dropped
+        :param max_age: Seconds after which an unfinished job is dropped
+        """
+        self.root = root
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+
+    def start(self, messages: list[Message]) -> Job:
+        """Records a new job for a message, or for the items of an album."""
+        path = None
+        if self.root is not None:
+            path = os.path.join(self.root, f"{int(time.time())}_{uuid.uuid4().hex[:8]}")
+            os.makedirs(path)
+        job = Job(path, messages, attempts=1)
+        job._save()
+        return job
+
+    def pending(self, bot: Bot) -> Iterator[Job]:
+        """Jobs left by a previous process, oldest first; counts the new attempt of each."""
+        if self.root is None or not os.path.isdir(self.root):
+            return
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            try:
+                with open(os.path.join(path, "job.json")) as f:
+                    data = json.load(f)
+                job = Job(
+                    path,
+                    [Message.model_validate(message).as_(bot) for message in data["messages"]],
+                    data["stage"],
+                    data["attempts"] + 1,
+                    data["created"],
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("Dropping unreadable job %s: %s", path, e)
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if job.attempts > self.max_attempts or time.time() - job.created > self.max_age:
+                logging.warning("Dropping job %s after %s attempts", path, job.attempts - 1)
+                job.finish()
+                continue
+            job._save()
+            yield job
+
+
+journal = Journal(settings.JOURNAL_DIR, settings.JOURNAL_MAX_ATTEMPTS, settings.JOURNAL_MAX_AGE)
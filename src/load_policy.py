@@ -0,0 +1,65 @@
+"""Lowers the quality of new jobs while the bot is busy.
+
+A job that starts while many jobs are in flight or the worker pool is backed up gets a
+smaller default grid, a lower frame rate cap and faster encoder profiles, so a spike
+shortens the backlog instead of growing the latency of every job. Jobs with an explicit
+`w=`/`h=` are left alone.
+"""
+
+import logging
+import math
+from typing import Callable, NamedTuple
+
+from src import workers
+from src.metrics import metrics
+from src.settings import settings
+
+
+class Quality(NamedTuple):
+    level: str  # "normal", "busy" or "overloaded"
+    max_tiles: int  # for automatically sized grids
+    max_fps: float
+    vp9_profile: str
+    tile_profile: str
+
+
+def quality_for(level: str) -> Quality:
+    """The settings of a quality level, e.g. to resume a job at the level it started with."""
+    if level == "busy":
+        return Quality(level, 24, min(settings.MAX_VIDEO_FPS, 20), "fast", "fast")
+    if level == "overloaded":
+        return Quality(level, 12, min(settings.MAX_VIDEO_FPS, 15), "fast", "fast")
+    return Quality(level, 50, settings.MAX_VIDEO_FPS, settings.VP9_PROFILE, settings.TILE_PROFILE)
+
+
+def current_quality(custom_width: int = 0, custom_height: int = 0) -> Quality:
+    """Picks the quality of a job that is starting now and records the decision."""
+    jobs, pool = workers.active_jobs, workers.pool_usage()
+    level = "normal"
+    if settings.ADAPTIVE_QUALITY and not (custom_width or custom_height):
+        if jobs >= settings.LOAD_OVERLOADED_JOBS or pool >= settings.LOAD_OVERLOADED_POOL:
+            level = "overloaded"
+        elif jobs >= settings.LOAD_BUSY_JOBS or pool >= settings.LOAD_BUSY_POOL:
+            level = "busy"
+    metrics.incr(f"quality.{level}")
+    if level != "normal":
+        logging.info("Degrading job to %s quality: %s jobs in flight, pool usage %.2f", level, jobs, pool)
+    return quality_for(level)
+
+
+def limit_grid(width: int, height: int, max_tiles: int, plan: Callable[[int, int, int, int], tuple[int, int]]) -> int:
+    """Custom width that keeps an automatically sized grid within `max_tiles`.
+
+    :param width: Source width in pixels
+    :param height: Source height in pixels
+    :param plan: `plan_image_size` or `plan_video_dimensions`
+    :return: Width in pixels to convert with, or 0 if the automatic size already fits
+    """
+    planned_width, planned_height = plan(width, height, 0, 0)
+    if math.ceil(planned_width / 100) * math.ceil(planned_height / 100) <= max_tiles:
+        return 0
+    for columns in range(math.ceil(planned_width / 100) - 1, 1, -1):
+        planned_width, planned_height = plan(width, height, columns * 100, 0)
+        if math.ceil(planned_width / 100) * math.ceil(planned_height / 100) <= max_tiles:
+            return columns * 100
+    return 100
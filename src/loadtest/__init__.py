@@ -0,0 +1 @@
+"""Load testing against a local fake Bot API, see `python -m src.loadtest --help`."""
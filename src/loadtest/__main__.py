@@ -0,0 +1,215 @@
+"""Load test: runs the bot against a local fake Bot API and reports throughput and latency.
+
+Usage:
+    python -m src.loadtest --jobs 50 --concurrency 8 --kinds photo animation
+    python -m src.loadtest --retry-after-rate 0.1 --slow-rate 0.2 --error-rate 0.05
+
+The bot runs in this process with its real dispatcher, so CPU time and peak RSS
+include the conversion work; ffmpeg shows up as child CPU time.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import resource
+import time
+from collections import Counter, defaultdict
+
+from aiogram import Bot
+
+from src import memory_profile, workers
+from src.__main__ import create_bot_session, create_dispatcher
+from src.loadtest.server import FakeBotAPI, Faults, Reply
+from src.metrics import metrics
+from src.settings import settings
+
+FIRST_CHAT_ID = 1_000_000
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def _outcome(reply: Reply | None) -> str:
+    if reply is None:
+        return "timeout"
+    if "<tg-emoji" in reply.text or "t.me/addemoji" in reply.text:
+        return "ok"
+    return reply.text.splitlines()[0][:100] if reply.text else "empty reply"
+
+
+class Driver:
+    """Keeps `concurrency` jobs in flight, one chat per job, until `jobs` have finished."""
+
+    def __init__(self, api: FakeBotAPI, kinds: list[str], caption: str | None, job_timeout: float, album_size: int = 1):
+        self.api = api
+        self.album_size = album_size
+        self.kinds = itertools.cycle(kinds)
+        self.caption = caption
+        self.job_timeout = job_timeout
+        self._chat_ids = itertools.count(FIRST_CHAT_ID)
+        self._waiting: dict[int, asyncio.Future[Reply]] = {}
+        self.results: list[tuple[str, str, float]] = []  # (kind, outcome, seconds)
+        self.peak_workspace = 0
+
+    async def _dispatch_replies(self) -> None:
+        while True:
+            reply = await self.api.replies.get()
+            future = self._waiting.pop(reply.chat_id, None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+
+    async def _sample_workspaces(self) -> None:
+        while True:
+            self.peak_workspace = max(self.peak_workspace, workers.workspaces.usage())
+            await asyncio.sleep(0.2)
+
+    async def _job(self) -> None:
+        kind = next(self.kinds)
+        chat_id = next(self._chat_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[chat_id] = future
+        start = time.perf_counter()
+        if self.album_size > 1:
+            for index in range(self.album_size):
+                self.api.push_update(chat_id, kind, self.caption if index == 0 else None, media_group_id=f"album{chat_id}")
+        else:
+            self.api.push_update(chat_id, kind, self.caption)
+        try:
+            reply = await asyncio.wait_for(future, self.job_timeout)
+            end = reply.time
+        except asyncio.TimeoutError:
+            self._waiting.pop(chat_id, None)
+            reply, end = None, time.perf_counter()
+        self.results.append((kind, _outcome(reply), end - start))
+
+    async def run(self, jobs: int, concurrency: int) -> float:
+        """Runs the jobs; returns the wall time in seconds."""
+        background = [
+            asyncio.create_task(self._dispatch_replies()),
+            asyncio.create_task(self._sample_workspaces()),
+        ]
+        remaining = iter(range(jobs))
+
+        async def worker() -> None:
+            for _ in remaining:
+                await self._job()
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            for task in background:
+                task.cancel()
+        return time.perf_counter() - start
+
+
+def _report(driver: Driver, api: FakeBotAPI, wall: float, usage_before, children_before) -> None:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    by_kind: dict[str, list[float]] = defaultdict(list)
+    for kind, outcome, seconds in driver.results:
+        by_kind[kind].append(seconds)
+    by_kind["all"] = [seconds for _, _, seconds in driver.results]
+
+    print(f"jobs: {len(driver.results)} in {wall:.1f}s, {len(driver.results) / wall:.2f} jobs/s")
+    print(f"{'kind':<10} {'jobs':>5} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7}")
+    for kind, values in by_kind.items():
+        print(
+            f"{kind:<10} {len(values):>5} {_percentile(values, 50):>7.2f} {_percentile(values, 90):>7.2f} "
+            f"{_percentile(values, 99):>7.2f} {max(values):>7.2f}"
+        )
+    print("outcomes:")
+    for outcome, count in Counter(outcome for _, outcome, _ in driver.results).most_common():
+        print(f"  {count:>5}  {outcome}")
+    print(
+        f"cpu: bot {usage.ru_utime - usage_before.ru_utime + usage.ru_stime - usage_before.ru_stime:.1f}s, "
+        f"ffmpeg {children.ru_utime - children_before.ru_utime + children.ru_stime - children_before.ru_stime:.1f}s; "
+        f"peak rss {usage.ru_maxrss / 1024:.0f} MB; peak workspace {driver.peak_workspace / 1024 / 1024:.1f} MB"
+    )
+    quality = {name: count for name, count in metrics.counters.items() if name.startswith("quality.")}
+    if quality:
+        print(f"quality: {quality}")
+    downloads = {name: count for name, count in metrics.counters.items() if name.startswith("download.")}
+    chunk_p50, chunk_p95 = metrics.percentile("download.chunk.seconds", 50), metrics.percentile("download.chunk.seconds", 95)
+    if downloads:
+        chunks = f", chunk p50 {chunk_p50:.3f}s p95 {chunk_p95:.3f}s" if chunk_p50 is not None else ""
+        print(f"downloads: {downloads}{chunks}")
+    print(f"api calls: {dict(api.calls)}")
+    if api.injected:
+        print(f"injected: {dict(api.injected)}")
+
+
+async def load_test(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(Faults(
+        retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay,
+        methods=frozenset(args.fault_methods),
+    ), ranges=not args.no_ranges)
+    for kind in args.kinds:
+        path = getattr(args, kind)
+        if path is None:
+            api.add_media(kind)
+        else:
+            with open(path, "rb") as f:
+                api.add_media(kind, f.read(), args.width, args.height, args.duration)
+    await api.start(port=args.port)
+    memory_profile.start()
+
+    bot = Bot(token=settings.BOT_TOKEN.get_secret_value(), session=await create_bot_session(api.url))
+    dp = create_dispatcher()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+    driver = Driver(api, args.kinds, args.caption, args.job_timeout, args.album_size)
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        wall = await driver.run(args.jobs, args.concurrency)
+    finally:
+        await dp.stop_polling()
+        await polling
+        await bot.session.close()
+        await api.stop()
+    _report(driver, api, wall, usage_before, children_before)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.loadtest")
+    parser.add_argument("--jobs", type=int, default=20, help="total number of conversions")
+    parser.add_argument("--concurrency", type=int, default=4, help="conversions in flight at a time")
+    parser.add_argument("--kinds", nargs="+", choices=["photo", "animation", "video"], default=["photo"],
+                        help="message kinds, used in turn")
+    parser.add_argument("--caption", help='caption for every message, e.g. "/convert w=5 h=3"')
+    parser.add_argument("--album-size", type=int, default=1, help="send every job as an album of this many items")
+    parser.add_argument("--job-timeout", type=float, default=120, help="seconds to wait for a reply")
+    parser.add_argument("--port", type=int, default=0, help="port of the fake Bot API (random if 0)")
+
+    inputs = parser.add_argument_group("inputs (synthetic samples if omitted)")
+    inputs.add_argument("--photo", help="image file")
+    inputs.add_argument("--animation", help="MP4 sent as an animation")
+    inputs.add_argument("--video", help="MP4 sent as a video")
+    inputs.add_argument("--width", type=int, default=0, help="width reported for --animation/--video")
+    inputs.add_argument("--height", type=int, default=0, help="height reported for --animation/--video")
+    inputs.add_argument("--duration", type=int, default=3, help="duration reported for --animation/--video")
+
+    faults = parser.add_argument_group("fault injection")
+    faults.add_argument("--retry-after-rate", type=float, default=0, help="share of calls answered with 429")
+    faults.add_argument("--retry-after", type=int, default=5, help="retry_after in the 429 responses")
+    faults.add_argument("--error-rate", type=float, default=0, help="share of calls answered with 500")
+    faults.add_argument("--slow-rate", type=float, default=0, help="share of calls answered late")
+    faults.add_argument("--slow-delay", type=float, default=2, help="seconds a slow call takes")
+    faults.add_argument("--fault-methods", nargs="+", default=sorted(Faults().methods),
+                        help="Bot API methods faults are injected into")
+    faults.add_argument("--no-ranges", action="store_true", help="serve files without Range support")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    asyncio.run(load_test(args))
+
+
+if __name__ == "__main__":
+    main()
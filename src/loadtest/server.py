@@ -0,0 +1,350 @@
+"""A local stand-in for the Bot API server, enough to drive the bot's conversion handlers."""
+
+import asyncio
+import io
+import itertools
+import json
+import random
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from typing import Any, NamedTuple
+
+import numpy as np
+from aiohttp import web
+from PIL import Image as PILImage
+
+BOT_ID = 100000
+BOT_USERNAME = "loadtest_bot"
+
+
+class Faults(NamedTuple):
+    """Failures injected into Bot API responses.
+
+    Rates are probabilities per call of a method in `methods`.
+    """
+    retry_after_rate: float = 0
+    retry_after: int = 5
+    error_rate: float = 0
+    slow_rate: float = 0
+    slow_delay: float = 2
+    methods: frozenset[str] = frozenset({"createNewStickerSet", "getStickerSet"})
+
+
+class Media(NamedTuple):
+    kind: str  # "photo", "animation" or "video"
+    sizes: list[tuple[str, int, int, bytes]]  # (file_id, width, height, data), smallest first
+    duration: int = 0
+
+
+class Reply(NamedTuple):
+    chat_id: int
+    text: str
+    time: float  # time.perf_counter() value
+
+
+def _sample_photo(width: int = 1280, height: int = 960) -> PILImage.Image:
+    """Photo-like gradient with noise, so JPEG sizes are realistic."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    data = np.stack([
+        np.tile(x, (height, 1)),
+        np.tile(y[:, None], (1, width)),
+        rng.normal(128, 40, (height, width)),
+    ], axis=2).clip(0, 255).astype(np.uint8)
+    return PILImage.fromarray(data, "RGB")
+
+
+def _encode_jpeg(image: PILImage.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _sample_clip(size: str, duration: int) -> bytes:
+    """Synthetic H.264 clip made by ffmpeg."""
+    with tempfile.NamedTemporaryFile(suffix=".mp4") as f:
+        subprocess.run([
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={duration}",
+            "-pix_fmt", "yuv420p",
+            f.name,
+        ], check=True)
+        return f.read()
+
+
+class FakeBotAPI:
+    """Serves `getUpdates` from a queue of synthetic messages, files for them and sticker set calls.
+
+    Every `sendMessage` is recorded as a `Reply`; the load driver uses the first reply
+    to a job's chat as the end of that job.
+    """
+
+    def __init__(self, faults: Faults = Faults(), seed: int = 0, ranges: bool = True):
+        """
+        :param ranges: answer Range requests for files with partial content, like the cloud API
+        """
+        self.faults = faults
+        self.ranges = ranges
+        self.calls: Counter[str] = Counter()
+        self.injected: Counter[str] = Counter()
+        self.replies: asyncio.Queue[Reply] = asyncio.Queue()
+        self.media: dict[str, Media] = {}
+        self._files: dict[str, bytes] = {}
+        self._sticker_sets: dict[str, list[str]] = {}  # name -> custom emoji ids
+        self._emoji_formats: dict[str, str] = {}  # custom emoji id -> sticker format
+        self._updates: list[dict[str, Any]] = []
+        self._new_updates = asyncio.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._custom_emoji_ids = itertools.count(5000000000000000000)
+        self._random = random.Random(seed)
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    def add_media(self, kind: str, data: bytes | None = None, width: int = 0, height: int = 0, duration: int = 0) -> None:
+        """Registers an input the updates can carry; synthetic samples are generated if `data` is None."""
+        if kind == "photo":
+            image = PILImage.open(io.BytesIO(data)) if data else _sample_photo()
+            sizes = []
+            for limit in (320, 800, 1280):
+                scaled = image.copy()
+                scaled.thumbnail((limit, limit))
+                sizes.append((scaled.width, scaled.height, _encode_jpeg(scaled.convert("RGB"))))
+                if max(image.size) <= limit:
+                    break
+        else:
+            if data is None:
+                size, duration = ("320x240", 3) if kind == "animation" else ("640x360", 4)
+                data = _sample_clip(size, duration)
+                width, height = map(int, size.split("x"))
+            sizes = [(width, height, data)]
+        files = []
+        for index, (w, h, content) in enumerate(sizes):
+            file_id = f"{kind}_{len(self.media)}_{index}"
+            self._files[file_id] = content
+            files.append((file_id, w, h, content))
+        self.media[kind] = Media(kind, files, duration)
+
+    def push_update(self, chat_id: int, kind: str, caption: str | None = None, media_group_id: str | None = None) -> None:
+        """Queues a private message from `chat_id` carrying the media registered for `kind`."""
+        media = self.media[kind]
+        message: dict[str, Any] = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+        }
+        if caption:
+            message["caption"] = caption
+        if media_group_id:
+            message["media_group_id"] = media_group_id
+        if kind == "photo":
+            message["photo"] = [self._file_object(file_id, w, h, data) for file_id, w, h, data in media.sizes]
+        else:
+            file_id, w, h, data = media.sizes[-1]
+            message[kind] = {
+                **self._file_object(file_id, w, h, data),
+                "duration": media.duration,
+                "mime_type": "video/mp4",
+            }
+        self._updates.append({"update_id": next(self._update_ids), "message": message})
+        asyncio.get_running_loop().create_task(self._notify())
+
+    @staticmethod
+    def _file_object(file_id: str, width: int, height: int, data: bytes) -> dict[str, Any]:
+        return {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "width": width,
+            "height": height,
+            "file_size": len(data),
+        }
+
+    async def _notify(self) -> None:
+        async with self._new_updates:
+            self._new_updates.notify_all()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving; returns the base URL to pass to `TelegramAPIServer.from_base`."""
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/", self._index)
+        app.router.add_route("*", "/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _index(self, request: web.Request) -> web.Response:
+        return web.Response(text="fake bot api")
+
+    async def _file(self, request: web.Request) -> web.Response:
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        if file_id not in self._files:
+            raise web.HTTPNotFound()
+        data = self._files[file_id]
+        requested = request.http_range
+        if not self.ranges or requested.start is None or requested.start >= len(data):
+            return web.Response(body=data)
+        stop = min(len(data), requested.stop or len(data))
+        return web.Response(
+            status=206,
+            body=data[requested.start:stop],
+            headers={"Content-Range": f"bytes {requested.start}-{stop - 1}/{len(data)}"},
+        )
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if method != "getUpdates":
+            error = await self._inject(method)
+            if error is not None:
+                return error
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return self._ok(True)
+        try:
+            return await handler(params)
+        except (KeyError, ValueError) as e:
+            return self._error(400, f"Bad Request: {e}")
+
+    async def _inject(self, method: str) -> web.Response | None:
+        faults = self.faults
+        if method not in faults.methods:
+            return None
+        if self._random.random() < faults.slow_rate:
+            self.injected["slow"] += 1
+            await asyncio.sleep(faults.slow_delay)
+        if self._random.random() < faults.retry_after_rate:
+            self.injected["retry_after"] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {faults.retry_after}",
+                "parameters": {"retry_after": faults.retry_after},
+            })
+        if self._random.random() < faults.error_rate:
+            self.injected["error"] += 1
+            return self._error(500, "Internal Server Error: injected")
+        return None
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str) -> web.Response:
+        return web.json_response({"ok": False, "error_code": code, "description": description})
+
+    async def _api_getMe(self, params: dict) -> web.Response:
+        return self._ok({"id": BOT_ID, "is_bot": True, "first_name": "Load test", "username": BOT_USERNAME})
+
+    async def _api_getUpdates(self, params: dict) -> web.Response:
+        offset = int(params.get("offset", 0))
+        timeout = float(params.get("timeout", 0))
+        limit = int(params.get("limit", 100))
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            async with self._new_updates:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._ok(self._updates[:limit])
+
+    async def _api_sendMessage(self, params: dict) -> web.Response:
+        return self._reply(params, params.get("text", ""))
+
+    async def _api_sendDocument(self, params: dict) -> web.Response:
+        return self._reply(params, "[document]")
+
+    async def _api_sendAnimation(self, params: dict) -> web.Response:
+        return self._reply(params, "[animation]")
+
+    def _reply(self, params: dict, text: str) -> web.Response:
+        chat_id = int(params["chat_id"])
+        self.replies.put_nowait(Reply(chat_id, text, time.perf_counter()))
+        return self._ok({
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        })
+
+    async def _api_getFile(self, params: dict) -> web.Response:
+        file_id = params["file_id"]
+        if file_id not in self._files:
+            return self._error(400, "Bad Request: invalid file_id")
+        return self._ok({
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": len(self._files[file_id]),
+            "file_path": f"documents/{file_id}",
+        })
+
+    def _add_sticker(self, params: dict, sticker: dict) -> str:
+        """Stores an uploaded sticker so getCustomEmojiStickers and downloads can return it."""
+        emoji_id = str(next(self._custom_emoji_ids))
+        upload = params.get(sticker["sticker"].removeprefix("attach://"))
+        if upload is not None and hasattr(upload, "file"):
+            self._files[f"sticker_{emoji_id}"] = upload.file.read()
+        self._emoji_formats[emoji_id] = sticker.get("format", "static")
+        return emoji_id
+
+    def _sticker_object(self, emoji_id: str) -> dict[str, Any]:
+        sticker_format = self._emoji_formats.get(emoji_id, "static")
+        return {
+            "file_id": f"sticker_{emoji_id}",
+            "file_unique_id": f"sticker_{emoji_id}",
+            "type": "custom_emoji",
+            "width": 100,
+            "height": 100,
+            "is_animated": sticker_format == "animated",
+            "is_video": sticker_format == "video",
+            "custom_emoji_id": emoji_id,
+        }
+
+    async def _api_createNewStickerSet(self, params: dict) -> web.Response:
+        stickers = json.loads(params["stickers"])
+        if not 1 <= len(stickers) <= 50:
+            return self._error(400, "Bad Request: invalid sticker count")
+        self._sticker_sets[params["name"]] = [self._add_sticker(params, sticker) for sticker in stickers]
+        return self._ok(True)
+
+    async def _api_addStickerToSet(self, params: dict) -> web.Response:
+        stickers = self._sticker_sets[params["name"]]
+        if len(stickers) >= 200:
+            return self._error(400, "Bad Request: STICKERS_TOO_MUCH")
+        stickers.append(self._add_sticker(params, json.loads(params["sticker"])))
+        return self._ok(True)
+
+    async def _api_deleteStickerFromSet(self, params: dict) -> web.Response:
+        emoji_id = params["sticker"].removeprefix("sticker_")
+        for stickers in self._sticker_sets.values():
+            if emoji_id in stickers:
+                stickers.remove(emoji_id)
+                return self._ok(True)
+        return self._error(400, "Bad Request: STICKER_INVALID")
+
+    async def _api_getStickerSet(self, params: dict) -> web.Response:
+        name = params["name"]
+        if name not in self._sticker_sets:
+            return self._error(400, "Bad Request: STICKERSET_INVALID")
+        stickers = [self._sticker_object(emoji_id) for emoji_id in self._sticker_sets[name]]
+        return self._ok({"name": name, "title": name, "sticker_type": "custom_emoji", "stickers": stickers})
+
+    async def _api_getCustomEmojiStickers(self, params: dict) -> web.Response:
+        ids = json.loads(params["custom_emoji_ids"])
+        return self._ok([self._sticker_object(emoji_id) for emoji_id in ids if emoji_id in self._emoji_formats])
@@ -0,0 +1,181 @@
+"""Opt-in memory profiling of conversion jobs.
+
+With MEMORY_PROFILING on, tracemalloc traces every allocation. Each job records RSS and
+traced memory at its checkpoints (after the download, after tiling, ...). A job whose
+traced memory grows by more than MEMORY_PROFILE_THRESHOLD logs its stages and the top
+allocation sites live at its largest checkpoint.
+
+Tracing is process-wide, so the sites of concurrent jobs mix; profile with little
+concurrency to attribute them. Tracing slows allocations down noticeably.
+"""
+
+import contextlib
+import contextvars
+import gc
+import io
+import logging
+import os
+import sys
+import tracemalloc
+from typing import Iterator
+
+from src.settings import settings
+
+_FRAMES = 10
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    # without the allocations of tracemalloc itself
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def rss() -> int | None:
+    """Resident set size of the process in bytes, None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _format_bytes(size: int | None) -> str:
+    if size is None:
+        return "?"
+    return f"{size / 2**20:.1f}MB"
+
+
+class JobProfile:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start_rss = rss()
+        self.start_traced = tracemalloc.get_traced_memory()[0]
+        self.start_snapshot = _snapshot()
+        # the peak is process-wide, restart it so it measures this job
+        tracemalloc.reset_peak()
+        # (label, RSS, traced bytes) at every checkpoint
+        self.checkpoints: list[tuple[str, int | None, int]] = []
+        self.largest: tuple[str, tracemalloc.Snapshot] | None = None
+        self._largest_traced = 0
+
+    def checkpoint(self, label: str) -> None:
+        traced = tracemalloc.get_traced_memory()[0]
+        self.checkpoints.append((label, rss(), traced))
+        if traced - self.start_traced > settings.MEMORY_PROFILE_THRESHOLD and traced > self._largest_traced:
+            self._largest_traced = traced
+            self.largest = (label, _snapshot())
+
+    def report(self) -> str:
+        _, peak = tracemalloc.get_traced_memory()
+        lines = [f"{self.name}: traced peak {_format_bytes(peak - self.start_traced)} above the start"]
+        for label, rss_at, traced in self.checkpoints:
+            rss_delta = None if rss_at is None or self.start_rss is None else rss_at - self.start_rss
+            lines.append(f"  {label}: traced {_format_bytes(traced - self.start_traced)}, rss {_format_bytes(rss_delta)}")
+        if self.largest is not None:
+            label, snapshot = self.largest
+            lines.append(f"  top allocation sites at {label}:")
+            for stat in snapshot.compare_to(self.start_snapshot, "lineno")[:settings.MEMORY_PROFILE_TOP]:
+                lines.append(f"    {stat}")
+        return "\n".join(lines)
+
+
+_current: contextvars.ContextVar[JobProfile | None] = contextvars.ContextVar("memory_profile", default=None)
+
+
+def start() -> None:
+    """Starts tracing allocations if profiling is enabled; call it once at startup."""
+    if settings.MEMORY_PROFILING and not tracemalloc.is_tracing():
+        tracemalloc.start(_FRAMES)
+        logging.info("Memory profiling enabled")
+
+
+@contextlib.contextmanager
+def job(name: str) -> Iterator[None]:
+    """Profiles the block as one job; a no-op unless tracing."""
+    if not tracemalloc.is_tracing():
+        yield
+        return
+    profile = JobProfile(name)
+    token = _current.set(profile)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        profile.checkpoint("end")
+        _, peak = tracemalloc.get_traced_memory()
+        if peak - profile.start_traced > settings.MEMORY_PROFILE_THRESHOLD:
+            logging.warning("Memory profile of %s", profile.report())
+
+
+def checkpoint(label: str) -> None:
+    """Records RSS and traced memory for the current job, e.g. after a stage."""
+    profile = _current.get()
+    if profile is not None:
+        profile.checkpoint(label)
+
+
+def _is_image(obj: object) -> bool:
+    # Pillow is only imported by the converter; without it there are no images
+    module = sys.modules.get("PIL.Image")
+    return module is not None and isinstance(obj, module.Image)
+
+
+def _object_size(obj: object) -> int:
+    if _is_image(obj):
+        # the pixel data lives outside the Python object
+        return obj.width * obj.height * len(obj.getbands())
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    return sys.getsizeof(obj)
+
+
+def _describe(obj: object) -> str:
+    # no repr(), it would copy large buffers
+    description = f"{type(obj).__module__}.{type(obj).__qualname__}"
+    if hasattr(obj, "shape") and hasattr(obj, "dtype"):
+        return f"{description} {obj.shape} {obj.dtype}"
+    if _is_image(obj):
+        return f"{description} {obj.mode} {obj.width}x{obj.height}"
+    with contextlib.suppress(TypeError):
+        return f"{description} len={len(obj)}"
+    return description
+
+
+def largest_objects(count: int = 10) -> list[tuple[int, str]]:
+    """(size, description) of the largest live objects.
+
+    Bytes and NumPy arrays aren't tracked by the garbage collector, so the objects
+    referenced by tracked ones (frames, lists, dicts) are looked at too.
+    """
+    seen: set[int] = set()
+    sizes: list[tuple[int, str]] = []
+    for container in gc.get_objects():
+        for obj in (container, *gc.get_referents(container)):
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            try:
+                size = _object_size(obj)
+            except (TypeError, ValueError):
+                continue
+            if size >= 64 * 1024:
+                sizes.append((size, _describe(obj)))
+    return sorted(sizes, key=lambda item: -item[0])[:count]
+
+
+def heap_stats() -> str:
+    """Text for the owner's /memstats command."""
+    lines = [f"RSS: {_format_bytes(rss())}"]
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"Traced: {_format_bytes(current)}, peak {_format_bytes(peak)}")
+        lines.append("")
+        lines.append("Top allocation sites:")
+        for stat in _snapshot().statistics("lineno")[:settings.MEMORY_PROFILE_TOP]:
+            lines.append(f"  {stat}")
+    else:
+        lines.append("Tracing is off (MEMORY_PROFILING=false)")
+    lines.append("")
+    lines.append("Largest live objects:")
+    for size, description in largest_objects():
+        lines.append(f"  {_format_bytes(size)} {description}")
+    return "\n".join(lines)
@@ -0,0 +1,52 @@
+"""In-process counters and timing samples.
+
+Nothing is exported anywhere; the load policy reads them and the owner can look at a
+snapshot. Timings keep the most recent samples per name, so percentiles follow the
+current traffic rather than the whole uptime.
+"""
+
+import collections
+import math
+
+
+class Metrics:
+    def __init__(self, samples: int = 1024):
+        """
+        :param samples: timing samples kept per name
+        """
+        self.samples = samples
+        self.counters: collections.Counter[str] = collections.Counter()
+        self._timings: dict[str, collections.deque[float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records one timing sample."""
+        timings = self._timings.get(name)
+        if timings is None:
+            timings = self._timings[name] = collections.deque(maxlen=self.samples)
+        timings.append(seconds)
+
+    def percentile(self, name: str, q: float) -> float | None:
+        """Nearest-rank percentile (0-100) of the recent samples, or None without samples."""
+        timings = self._timings.get(name)
+        if not timings:
+            return None
+        ordered = sorted(timings)
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+    def snapshot(self) -> dict[str, object]:
+        """Counters and p50/p95/max of every timing, e.g. for a stats message."""
+        result: dict[str, object] = dict(sorted(self.counters.items()))
+        for name, timings in sorted(self._timings.items()):
+            result[name] = {
+                "count": len(timings),
+                "p50": self.percentile(name, 50),
+                "p95": self.percentile(name, 95),
+                "max": max(timings),
+            }
+        return result
+
+
+metrics = Metrics()
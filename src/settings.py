@@ -1,10 +1,83 @@
+from typing import Literal
+
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     BOT_TOKEN: SecretStr
+    # "filter" keys and crops every tile in its own ffmpeg filtergraph,
+    # "frames" decodes once and tiles raw frames in NumPy
+    VIDEO_ENGINE: Literal["filter", "frames"] = "filter"
+    # "subprocess" runs ffmpeg processes with VIDEO_ENGINE, "pyav" encodes in-process (needs the av package)
+    VIDEO_BACKEND: Literal["subprocess", "pyav"] = "subprocess"
+    # libvpx speed profile for video tiles, see VP9_PROFILES in src.converter.video
+    VP9_PROFILE: Literal["default", "fast", "balanced", "quality"] = "default"
+    # videos are resampled and trimmed to these limits before tiling
+    MAX_VIDEO_FPS: float = 30
+    MAX_VIDEO_DURATION: float = 5
+    # videos and GIFs that show a single picture become static emoji instead of VP9 clips
+    STILL_VIDEOS_AS_IMAGES: bool = True
+    # add conversions to one rolling custom emoji set per user and format instead of a new set each;
+    # the oldest grids are deleted from a full set, so the messages that showed them lose those emoji
+    ROLLING_STICKER_SETS: bool = False
+    # stickers kept in a rolling set, at most 200 (the custom emoji set limit)
+    ROLLING_SET_SIZE: int = 200
+    # JSON index of the rolling sets, keep it on a volume; None keeps it in memory only
+    STICKER_SET_INDEX: str | None = None
+    # drop the title and tags from video tiles to save bytes toward the 64KB limit
+    STRIP_WEBM_METADATA: bool = False
+    # encoder profile for static tiles, see src.converter.encoder
+    TILE_PROFILE: Literal["default", "fast", "small", "webp"] = "default"
+    # images with more pixels are rejected before decoding
+    MAX_IMAGE_PIXELS: int = 100_000_000
+    # album items arriving within this many seconds of each other go into one sticker set
+    MEDIA_GROUP_WINDOW: float = 1.0
+    # bytes of custom emoji files kept in memory for the emoji handler
+    EMOJI_CACHE_SIZE: int = 64 * 1024 * 1024
+    # threads for CPU-bound conversion work
+    WORKERS: int = 4
+    # job workspaces; point the root at a tmpfs to keep intermediate files in RAM
+    WORKSPACE_ROOT: str | None = None
+    WORKSPACE_JOB_QUOTA: int = 256 * 1024 * 1024
+    WORKSPACE_TOTAL_QUOTA: int = 1024 * 1024 * 1024
+    # ffmpeg/ffprobe limits for one video job: total seconds, niceness increment
+    # and an optional cgroup v2 directory to run the processes in
+    JOB_TIMEOUT: float = 300
+    FFMPEG_NICE: int = 0
+    FFMPEG_CGROUP: str | None = None
+    # videos are downloaded from the cloud Bot API in Range requests of this many bytes,
+    # this many at a time
+    DOWNLOAD_CHUNK_SIZE: int = 2 * 1024 * 1024
+    DOWNLOAD_CONCURRENCY: int = 4
+    # jobs without w=/h= get a smaller grid, lower fps and faster encoders ("busy") while this
+    # many jobs are in flight or this many jobs per worker thread have work in the pool,
+    # and even less ("overloaded") past the second pair of thresholds
+    ADAPTIVE_QUALITY: bool = True
+    LOAD_BUSY_JOBS: int = 8
+    LOAD_BUSY_POOL: float = 1.5
+    LOAD_OVERLOADED_JOBS: int = 16
+    LOAD_OVERLOADED_POOL: float = 3.0
+    # unfinished conversions are journaled here (keep it on a volume) and resumed after a restart;
+    # a job is dropped after this many starts or seconds
+    JOURNAL_DIR: str | None = None
+    JOURNAL_MAX_ATTEMPTS: int = 3
+    JOURNAL_MAX_AGE: float = 24 * 3600
+    # trace allocations of conversion jobs and log the top allocation sites of jobs whose
+    # traced memory grows by more than the threshold (bytes); the owner gets /memstats
+    MEMORY_PROFILING: bool = False
+    MEMORY_PROFILE_THRESHOLD: int = 64 * 1024 * 1024
+    MEMORY_PROFILE_TOP: int = 10
+
+    # errors are sent to the owner as one digest per interval;
+    # users get at most one error reply per window (seconds)
+    OWNER_ID: int = 443446876
+    ERROR_DIGEST_INTERVAL: float = 60
+    ERROR_REPLY_WINDOW: float = 300
 
     class Config:
         env_file = ".env"  # this is for local development
         extra = "ignore"
+
+
+settings = Settings()
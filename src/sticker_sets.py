@@ -0,0 +1,128 @@
+"""Publishing converted grids as custom emoji sets.
+
+Each conversion gets a new set, or with ROLLING_STICKER_SETS is added to one set per user
+and sticker format, which saves calls to the heavily rate limited createNewStickerSet.
+When a rolling set is full its oldest grids are deleted, and the messages that showed
+them lose those emoji.
+
+The index of which stickers of a set belong to which grid is kept in STICKER_SET_INDEX.
+Stickers are tracked by `file_unique_id` and checked against the set before anything is
+deleted, so a lost or stale index only means a new set is started.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputSticker, StickerSet
+
+from src import utils
+from src.settings import settings
+
+# "<user id>:<format>" -> {"name": set name, "grids": [[file_unique_id, ...], ...] oldest first}
+_index: dict[str, dict] | None = None
+_locks: collections.defaultdict[str, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+
+
+def _load() -> dict[str, dict]:
+    global _index
+    if _index is None:
+        _index = {}
+        if settings.STICKER_SET_INDEX and os.path.exists(settings.STICKER_SET_INDEX):
+            try:
+                with open(settings.STICKER_SET_INDEX) as f:
+                    _index = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning("Can't read the sticker set index, starting new sets: %s", e)
+    return _index
+
+
+def _save() -> None:
+    if not settings.STICKER_SET_INDEX:
+        return
+    temporary = f"{settings.STICKER_SET_INDEX}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(_load(), f)
+    os.replace(temporary, settings.STICKER_SET_INDEX)
+
+
+async def _create(bot: Bot, user_id: int, prefix: str, title: str, stickers: list[InputSticker], sticker_format: str) -> StickerSet:
+    name = f"{prefix}_{user_id}_{utils.random_string()}_by_{(await bot.me()).username}"
+    await bot.create_new_sticker_set(
+        user_id=user_id,
+        name=name,
+        title=title,
+        stickers=stickers,
+        sticker_format=sticker_format,
+        # sent for video sets only, like the other create_new_sticker_set calls
+        needs_repainting=False if sticker_format == "video" else None,
+        sticker_type="custom_emoji",
+    )
+    return await bot.get_sticker_set(name=name)
+
+
+async def _add(bot: Bot, user_id: int, entry: dict, sticker_set: StickerSet, stickers: list[InputSticker]) -> StickerSet:
+    """Adds the grid to a rolling set, deleting the oldest grids to make room."""
+    live = {sticker.file_unique_id: sticker.file_id for sticker in sticker_set.stickers}
+    count = len(sticker_set.stickers)
+    while count + len(stickers) > settings.ROLLING_SET_SIZE and entry["grids"]:
+        for unique_id in entry["grids"].pop(0):
+            await bot.delete_sticker_from_set(sticker=live.pop(unique_id))
+            count -= 1
+    try:
+        for sticker in stickers:
+            await bot.add_sticker_to_set(user_id=user_id, name=sticker_set.name, sticker=sticker)
+    finally:
+        # record what was added even if adding failed midway, so it's deleted in turn
+        sticker_set = await bot.get_sticker_set(name=sticker_set.name)
+        added = [sticker.file_unique_id for sticker in sticker_set.stickers if sticker.file_unique_id not in live]
+        if added:
+            entry["grids"].append(added)
+        _save()
+    return sticker_set
+
+
+async def publish(
+    bot: Bot,
+    user_id: int,
+    prefix: str,
+    title: str,
+    stickers: list[InputSticker],
+    sticker_format: str,
+    dedicated: bool = False,
+) -> StickerSet:
+    """Uploads the stickers of a grid for the user; they are the last `len(stickers)` of the returned set.
+
+    :param prefix: Start of the name of a new set, e.g. "emojis"
+    :param title: Title of a new set; a rolling set keeps the title it was created with
+    :param dedicated: Create a set of its own even with rolling sets on, e.g. for a custom title
+    """
+    if not settings.ROLLING_STICKER_SETS or dedicated:
+        return await _create(bot, user_id, prefix, title, stickers, sticker_format)
+    key = f"{user_id}:{sticker_format}"
+    async with _locks[key]:
+        entry = _load().get(key)
+        if entry is not None:
+            try:
+                sticker_set = await bot.get_sticker_set(name=entry["name"])
+            except TelegramBadRequest as e:
+                logging.info("Rolling sticker set %s is gone, starting a new one: %s", entry["name"], e)
+                sticker_set = None
+            if sticker_set is not None:
+                # forget stickers that were deleted some other way
+                live = {sticker.file_unique_id for sticker in sticker_set.stickers}
+                entry["grids"] = [kept for grid in entry["grids"] if (kept := [unique_id for unique_id in grid if unique_id in live])]
+            if sticker_set is not None and len(sticker_set.stickers) - sum(map(len, entry["grids"])) + len(stickers) <= settings.ROLLING_SET_SIZE:
+                return await _add(bot, user_id, entry, sticker_set, stickers)
+        # no set yet, or it's filled with stickers the index doesn't know about
+        sticker_set = await _create(bot, user_id, prefix, title, stickers, sticker_format)
+        _load()[key] = {
+            "name": sticker_set.name,
+            "grids": [[sticker.file_unique_id for sticker in sticker_set.stickers]],
+        }
+        _save()
+        return sticker_set
@@ -1 +1,3 @@
-from .random import random_string
\ No newline at end of file
+from .random import random_string
+from .command import parse_convert_args, parse_seconds
+from .lru import LRUCache
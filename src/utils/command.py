@@ -0,0 +1,27 @@
+import math
+
+
+def parse_convert_args(text: str | None) -> dict[str, str]:
+    """Returns the key=value arguments of a "/convert ..." caption, or {} for any other text."""
+    if not text or not text.startswith("/convert"):
+        return {}
+    command_args = text.removeprefix("/convert").strip().split()
+    return {
+        k: v for k, v in (arg.split("=", 1) for arg in command_args if "=" in arg)
+    }
+
+
+def parse_seconds(value: str) -> float:
+    """Parses "90", "1.5" or "1:30" into seconds; raises ValueError for anything else."""
+    parts = [float(part) for part in value.split(":")]
+    if (
+        len(parts) > 3
+        or any(part < 0 or not math.isfinite(part) for part in parts)
+        # minutes and seconds after a colon, as in 1:30 or 1:02:03
+        or any(part >= 60 for part in parts[1:])
+    ):
+        raise ValueError(f"Invalid time: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
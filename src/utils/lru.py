@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Least recently used cache bounded by the total size of its values.
+
+    `size_of` gives the size of a value (1 per entry by default, i.e. an entry limit).
+    """
+
+    def __init__(self, max_size: int, size_of: Callable[[V], int] = lambda value: 1):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, V] = OrderedDict()
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> V | None:
+        if key not in self._data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key: K, value: V) -> None:
+        if key in self._data:
+            self.size -= self.size_of(self._data.pop(key))
+        size = self.size_of(value)
+        if size > self.max_size:
+            return
+        self._data[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= self.size_of(evicted)
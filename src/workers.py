@@ -0,0 +1,124 @@
+"""Shared resources for conversion jobs: the thread pool for CPU-bound work, the job workspaces
+and the load they are under."""
+
+import asyncio
+import functools
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, TypeVar
+
+import src.converter as converter
+from src import memory_profile
+from src.converter.workspace import WorkspaceManager
+from src.metrics import metrics
+from src.settings import settings
+
+T = TypeVar("T")
+
+
+class _Executor(ThreadPoolExecutor):
+    """Thread pool that counts the jobs with queued or running tasks.
+
+    A task counts as one job unless it is submitted as a share of one, like the batches
+    of `map_batches`, so a job that fans out to every worker adds as much as one that doesn't.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.pending = 0.0
+        self._pending_lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> Future[T]:
+        return self.submit_share(1.0, fn, *args, **kwargs)
+
+    def submit_share(self, share: float, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> Future[T]:
+        """Submits a task that counts as `share` of a job in `pending`."""
+        with self._pending_lock:
+            self.pending += share
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._done(share)
+            raise
+        future.add_done_callback(lambda _: self._done(share))
+        return future
+
+    def _done(self, share: float) -> None:
+        with self._pending_lock:
+            self.pending -= share
+
+
+executor = _Executor(max_workers=settings.WORKERS, thread_name_prefix="worker")
+# conversion jobs in flight, from the first download to the finished tiles
+active_jobs = 0
+workspaces = WorkspaceManager(
+    settings.WORKSPACE_ROOT,
+    job_quota=settings.WORKSPACE_JOB_QUOTA,
+    total_quota=settings.WORKSPACE_TOTAL_QUOTA,
+)
+_video_backend: "converter.VideoBackend | None" = None
+
+
+def video_backend() -> "converter.VideoBackend":
+    """The backend of video jobs, created on first use since it loads the converter."""
+    global _video_backend
+    if _video_backend is None:
+        if settings.VIDEO_BACKEND == "pyav":
+            from src.converter.pyav_backend import PyAVBackend
+            _video_backend = PyAVBackend(executor)
+        else:
+            _video_backend = converter.SubprocessBackend(settings.VIDEO_ENGINE)
+    return _video_backend
+
+
+def preload() -> None:
+    """Loads the converter and creates the video backend, so the first job doesn't wait for it."""
+    converter.preload()
+    video_backend()
+
+
+async def run(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function on the worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def map_batches(func: Callable[..., list[T]], items: list[Any], *args: Any) -> list[T]:
+    """Split items into one batch per worker, run `func(batch, *args)` for each and join the results in order."""
+    if not items:
+        return []
+    size = math.ceil(len(items) / settings.WORKERS)
+    batches = [items[i:i + size] for i in range(0, len(items), size)]
+    # the batches together count as one job in the pool usage
+    share = 1 / len(batches)
+    results = await asyncio.gather(*(
+        asyncio.wrap_future(executor.submit_share(share, func, batch, *args)) for batch in batches
+    ))
+    return [item for result in results for item in result]
+
+
+def pool_usage() -> float:
+    """Jobs with queued or running pool work per worker thread.
+
+    An image job's batches count as one job, so this is about the number of jobs encoding
+    at once over WORKERS; above 1 a single-task job (e.g. a PyAV encode) has to wait.
+    """
+    return executor.pending / settings.WORKERS
+
+
+def tracked_job(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Counts calls of a conversion coroutine in `active_jobs`, records their duration and profiles their memory."""
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        global active_jobs
+        active_jobs += 1
+        start = time.monotonic()
+        try:
+            with memory_profile.job(func.__name__):
+                return await func(*args, **kwargs)
+        finally:
+            active_jobs -= 1
+            metrics.observe("job.seconds", time.monotonic() - start)
+    return wrapper
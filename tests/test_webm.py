@@ -0,0 +1,259 @@
+"""EBML post-processing of WebM tiles, on a handmade file and on real ffmpeg output.
+
+Runs with `python -m unittest` (or pytest); the ffmpeg tests are skipped without ffmpeg.
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import unittest
+
+from src.converter import webm
+
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+TIMECODE_SCALE = 0x2AD7B1
+TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+CUE_TIME = 0xB3
+CUE_TRACK = 0xF7
+TAG = 0x7373
+
+
+def _element(element_id: int, payload: bytes) -> bytes:
+    """An element with an 8-byte size field, so sizes don't depend on the content."""
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big") + ((1 << 56) | len(payload)).to_bytes(8, "big") + payload
+
+
+def _uint(element_id: int, value: int) -> bytes:
+    return _element(element_id, value.to_bytes(8, "big"))
+
+
+def _handmade(title: bool = True, duration: bool = True) -> tuple[bytes, dict[int, int]]:
+    """A minimal WebM laid out like ffmpeg's: SeekHead, Void, Info, Cluster, Cues, Tags.
+
+    The Void pushes Info past the first header chunk that patch_duration reads.
+
+    Returns:
+        Tuple of (file, position of every top-level element relative to the segment data)
+    """
+    info = _uint(TIMECODE_SCALE, 1_000_000)
+    if title:
+        info += _element(webm.TITLE, b"@itosbot")
+    if duration:
+        info += _element(webm.DURATION, struct.pack(">d", 3000.0))
+    cluster = _element(webm.CLUSTER, _uint(TIMECODE, 0) + _element(SIMPLE_BLOCK, b"\x81\x00\x00\x80frame"))
+    tags = _element(webm.TAGS, _element(TAG, b"ENCODER Lavf"))
+
+    def layout(positions: dict[int, int]) -> list[bytes]:
+        seek_head = _element(webm.SEEK_HEAD, b"".join(
+            _element(webm.SEEK, _element(webm.SEEK_ID, element_id.to_bytes(4, "big")) + _uint(webm.SEEK_POSITION, positions.get(element_id, 0)))
+            for element_id in (webm.INFO, webm.TAGS, webm.CUES)
+        ))
+        cues = _element(webm.CUES, _element(webm.CUE_POINT, _uint(CUE_TIME, 0) + _element(
+            webm.CUE_TRACK_POSITIONS, _uint(CUE_TRACK, 1) + _uint(webm.CUE_CLUSTER_POSITION, positions.get(webm.CLUSTER, 0))
+        )))
+        return [seek_head, _element(webm.VOID, bytes(webm.HEADER_CHUNK)), _element(webm.INFO, info), cluster, cues, tags]
+
+    # the sizes don't depend on the positions, so one pass finds them
+    positions: dict[int, int] = {}
+    offset = 0
+    for element_id, element in zip((webm.SEEK_HEAD, webm.VOID, webm.INFO, webm.CLUSTER, webm.CUES, webm.TAGS), layout({})):
+        positions[element_id] = offset
+        offset += len(element)
+    header = _element(EBML, _element(DOC_TYPE, b"webm"))
+    return header + _element(webm.SEGMENT, b"".join(layout(positions))), positions
+
+
+def _top_level(data: bytes) -> list[webm.Element]:
+    segment = webm._find_segment(data)
+    return list(webm.iter_elements(data, segment.data_start, min(segment.end, len(data))))
+
+
+def _uint_value(data: bytes, element: webm.Element) -> int:
+    return int.from_bytes(data[element.data_start:element.end], "big")
+
+
+class WebMTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def write(self, data: bytes, name: str = "tile.webm") -> str:
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, "wb") as f:
+            f.write(data)
+        return filename
+
+    def read(self, filename: str) -> bytes:
+        with open(filename, "rb") as f:
+            return f.read()
+
+    def assert_positions(self, data: bytes) -> None:
+        """Every SeekPosition and CueClusterPosition points at an element with the right ID."""
+        segment = webm._find_segment(data)
+        elements = _top_level(data)
+        by_position = {element.start - segment.data_start: element.id for element in elements}
+        seek_head = next(element for element in elements if element.id == webm.SEEK_HEAD)
+        for seek in webm.iter_elements(data, seek_head.data_start, seek_head.end):
+            if seek.id == webm.SEEK:
+                target = _uint_value(data, webm._find_child(data, seek, webm.SEEK_ID))
+                self.assertEqual(by_position[_uint_value(data, webm._find_child(data, seek, webm.SEEK_POSITION))], target)
+        cues = next(element for element in elements if element.id == webm.CUES)
+        for cue_point in webm.iter_elements(data, cues.data_start, cues.end):
+            for positions in webm.iter_elements(data, cue_point.data_start, cue_point.end):
+                if positions.id == webm.CUE_TRACK_POSITIONS:
+                    cluster = webm._find_child(data, positions, webm.CUE_CLUSTER_POSITION)
+                    self.assertEqual(by_position[_uint_value(data, cluster)], webm.CLUSTER)
+
+
+class HandmadeTest(WebMTestCase):
+    def test_handmade_file_is_consistent(self):
+        data, _ = _handmade()
+        self.assert_positions(data)
+        self.assertGreater(webm._duration_offset(data), webm.HEADER_CHUNK)
+
+    def test_patch_duration_only_touches_the_duration(self):
+        original, _ = _handmade()
+        offset = webm._duration_offset(original)
+        filename = self.write(original)
+
+        self.assertTrue(webm.patch_duration(filename))
+
+        patched = self.read(filename)
+        end = offset + len(webm.DURATION_PATCH)
+        self.assertEqual(patched[offset:end], webm.DURATION_PATCH)
+        self.assertEqual(patched[:offset] + patched[end:], original[:offset] + original[end:])
+
+    def test_patch_duration_without_duration(self):
+        original, _ = _handmade(duration=False)
+        filename = self.write(original)
+        self.assertFalse(webm.patch_duration(filename))
+        self.assertEqual(self.read(filename), original)
+
+    def test_patch_duration_rejects_other_files(self):
+        self.assertFalse(webm.patch_duration(self.write(b"\x00" * 100)))
+        # the header ends before Info does
+        data, _ = _handmade()
+        self.assertFalse(webm.patch_duration(self.write(data[:webm.HEADER_CHUNK + 100])))
+
+    def test_strip_metadata(self):
+        original, positions = _handmade()
+        stripped = webm.strip_metadata(original)
+
+        elements = _top_level(stripped)
+        self.assertNotIn(webm.TAGS, [element.id for element in elements])
+        self.assertIsNone(webm._find_child(stripped, webm._find_info(stripped), webm.TITLE))
+        self.assertIsNotNone(webm._find_child(stripped, webm._find_info(stripped), webm.DURATION))
+        title = len(_element(webm.TITLE, b"@itosbot"))
+        tags = len(_element(webm.TAGS, _element(TAG, b"ENCODER Lavf")))
+        self.assertEqual(len(stripped), len(original) - title - tags)
+        segment = webm._find_segment(stripped)
+        self.assertEqual(segment.end, len(stripped))
+
+        # the Tags entry became a Void of the same length, the SeekHead kept its size
+        seek_head = elements[0]
+        children = list(webm.iter_elements(stripped, seek_head.data_start, seek_head.end))
+        self.assertEqual([child.id for child in children], [webm.SEEK, webm.VOID, webm.SEEK])
+        self.assertEqual(seek_head.end - seek_head.start, positions[webm.VOID])
+        # Info is before the Title, Cluster and Cues move by its length
+        segment_start = segment.data_start
+        self.assertEqual({element.id: element.start - segment_start for element in elements}, {
+            webm.SEEK_HEAD: 0,
+            webm.VOID: positions[webm.VOID],
+            webm.INFO: positions[webm.INFO],
+            webm.CLUSTER: positions[webm.CLUSTER] - title,
+            webm.CUES: positions[webm.CUES] - title,
+        })
+        self.assert_positions(stripped)
+
+    def test_strip_metadata_without_metadata(self):
+        original, _ = _handmade(title=False)
+        stripped = webm.strip_metadata(original)
+        self.assertNotIn(webm.TAGS, [element.id for element in _top_level(stripped)])
+        self.assert_positions(stripped)
+        data = webm.strip_metadata(stripped)
+        self.assertEqual(data, stripped)
+
+    def test_postprocess_strip(self):
+        original, _ = _handmade()
+        expected = bytearray(webm.strip_metadata(original))
+        offset = webm._duration_offset(expected)
+        expected[offset:offset + len(webm.DURATION_PATCH)] = webm.DURATION_PATCH
+        filename = self.write(original)
+
+        webm.postprocess(filename, strip=True)
+
+        self.assertEqual(self.read(filename), expected)
+
+
+FRAMES = 20
+
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "needs ffmpeg")
+class FFmpegTest(WebMTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        # a 2 s, 10 fps VP9 tile with a title, like the converter's output before post-processing
+        self.tile = os.path.join(self.tempdir, "tile.webm")
+        subprocess.run([
+            "ffmpeg", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc=s=100x100:r=10:d={FRAMES / 10}",
+            "-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-g", "5",
+            "-metadata", "title=tile",
+            self.tile,
+        ], check=True)
+
+    def decoded_frames(self, seek: float | None = None) -> int:
+        """Frames ffmpeg decodes from the tile, optionally after seeking to `seek` seconds."""
+        output = subprocess.run(
+            ["ffmpeg", "-v", "error", *(["-ss", str(seek)] if seek is not None else []), "-i", self.tile,
+             "-f", "framemd5", "-"],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return sum(1 for line in output.splitlines() if line and not line.startswith("#"))
+
+    def test_patch_duration_only_touches_the_duration(self):
+        original = self.read(self.tile)
+        offset = webm._duration_offset(original)
+        self.assertIsNotNone(offset)
+
+        self.assertTrue(webm.patch_duration(self.tile))
+
+        patched = self.read(self.tile)
+        end = offset + len(webm.DURATION_PATCH)
+        self.assertEqual(patched[offset:end], webm.DURATION_PATCH)
+        self.assertEqual(patched[:offset] + patched[end:], original[:offset] + original[end:])
+        self.assertEqual(self.decoded_frames(), FRAMES)
+
+    def test_strip_metadata(self):
+        original = self.read(self.tile)
+        self.assertIn(webm.TAGS, [element.id for element in _top_level(original)])
+        self.assertIsNotNone(webm._find_child(original, webm._find_info(original), webm.TITLE))
+
+        stripped = webm.strip_metadata(original)
+
+        self.assertNotIn(webm.TAGS, [element.id for element in _top_level(stripped)])
+        self.assertIsNone(webm._find_child(stripped, webm._find_info(stripped), webm.TITLE))
+        seek_head = _top_level(stripped)[0]
+        self.assertIn(webm.VOID, [child.id for child in webm.iter_elements(stripped, seek_head.data_start, seek_head.end)])
+        self.assert_positions(stripped)
+
+    def test_postprocess_strip_decodes_and_seeks(self):
+        expected = bytearray(webm.strip_metadata(self.read(self.tile)))
+        offset = webm._duration_offset(expected)
+        # the patch overwrites the Duration size too, so the result is compared rather than parsed again
+        expected[offset:offset + len(webm.DURATION_PATCH)] = webm.DURATION_PATCH
+
+        webm.postprocess(self.tile, strip=True)
+
+        self.assertEqual(self.read(self.tile), expected)
+        self.assertEqual(self.decoded_frames(), FRAMES)
+        # seeking goes through the Cues, whose cluster positions were shifted
+        self.assertTrue(0 < self.decoded_frames(seek=1.0) < FRAMES)
+
+
+if __name__ == "__main__":
+    unittest.main()